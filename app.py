@@ -1,8 +1,41 @@
-from flask import Flask
+from flask import Flask, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import logging
 import os
 from src.routes.main import main_blueprint
+from src.log_pipeline import BatchingQueueHandler, RotatingFileSink
+from src.chat_store import ChatLogStore, ChatStoreSink
+from src.blob_store import BlobStore
+from src import codec, config, metrics, output
+from src.config import settings
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask's JSON (jsonify, request.get_json) on src.codec; calls with options keep Flask's own."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return codec.dumps(obj).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        try:
+            body = codec.dumps(obj)
+        except TypeError:
+            # Types only Flask's encoder knows (dates, dataclasses) when the codec is the stdlib one.
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 
 def setup_logging(app):
     # Ensure log directory exists for chat logs
@@ -30,23 +63,69 @@ def setup_logging(app):
     chat_logger = logging.getLogger("chat_logger")
     chat_logger.setLevel(logging.INFO)
     chat_formatter = logging.Formatter('%(asctime)s - %(message)s')
-    chat_handler = logging.FileHandler("logs/chat_logs.txt")
+    # Records are queued and written in batches by a background thread
+    sink = RotatingFileSink(
+        "logs/chat_logs.txt",
+        max_bytes=app.config["CHAT_LOG_MAX_BYTES"],
+        rotate_seconds=app.config["CHAT_LOG_ROTATE_SECONDS"],
+        compress=app.config["CHAT_LOG_COMPRESS"],
+        backup_count=app.config["CHAT_LOG_BACKUP_COUNT"],
+    )
+    blobs = None
+    if app.config["CHAT_LOG_BLOB_DIR"]:
+        blobs = BlobStore(app.config["CHAT_LOG_BLOB_DIR"], min_bytes=app.config["CHAT_LOG_BLOB_MIN_BYTES"])
+    store = ChatLogStore(app.config["CHAT_LOG_DB"], blobs=blobs)
+    chat_handler = BatchingQueueHandler(
+        [sink, ChatStoreSink(store)],
+        maxsize=app.config["CHAT_LOG_QUEUE_SIZE"],
+        policy=app.config["CHAT_LOG_QUEUE_POLICY"],
+        block_timeout=app.config["CHAT_LOG_BLOCK_TIMEOUT"],
+        batch_size=app.config["CHAT_LOG_BATCH_SIZE"],
+        flush_interval=app.config["CHAT_LOG_FLUSH_INTERVAL"],
+        blobs=blobs,
+    )
     chat_handler.setFormatter(chat_formatter)
+    chat_logger.handlers.clear()
     chat_logger.addHandler(chat_handler)
     chat_logger.propagate = False
+    app.extensions["chat_log_store"] = store
 
-def create_app():
+    def collect_chat_log_stats():
+        stats = chat_handler.stats()
+        for name in ("enqueued", "dropped", "written", "batches", "write_errors", "rotations"):
+            yield ("bridgeai_chat_log_records_total", "counter", "Chat log pipeline counters.",
+                   {"event": name}, stats[name])
+        yield ("bridgeai_chat_log_queue_depth", "gauge", "Records waiting for the chat log writer.",
+               {}, stats["queue_depth"])
+
+    metrics.register_collector(collect_chat_log_stats)
+
+def create_app(app_settings=None):
+    """
+    Build the Flask app. Nothing here opens upstream connections or starts request
+    threads: clients and pools are created per process on first use, so the app can be
+    built once in the gunicorn master (preload_app) and shared copy-on-write by workers.
+    """
+    app_settings = app_settings or settings
     app = Flask(__name__)
-    app.config.from_pyfile('src/config.py')
+    app.json = CodecJSONProvider(app)
+    app.config.from_mapping(app_settings.as_dict())
 
     CORS(app)
     
     setup_logging(app)
     app.register_blueprint(main_blueprint)
 
-    return app
+    @app.after_request
+    def compress(response):
+        return output.compress_response(response, request.headers.get("Accept-Encoding"))
 
-app = create_app()
+    @config.on_reload
+    def update_app_config(changed):
+        app.config.from_mapping(app_settings.as_dict())
+
+    config.start_watcher()
+    return app
 
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=7000, debug=True) 
\ No newline at end of file
+    create_app().run(host="127.0.0.1", port=7000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+ASGI entry point: async proxy endpoints in front of the Flask app.
+
+    gunicorn "asgi:create_asgi_app()" -k uvicorn.workers.UvicornWorker
+
+Importing this module (or app.py) builds nothing; gunicorn calls the factory, once in
+the master with preload_app or else once per worker.
+"""
+from contextlib import asynccontextmanager
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount
+
+from app import create_app
+from src.output import CompressionMiddleware
+from src.routes.async_api import routes
+from src.services import async_http_client
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await async_http_client.aclose()
+
+
+def create_asgi_app(flask_app=None):
+    """The ASGI app, mounting flask_app (by default a new one from app.create_app())."""
+    flask_app = flask_app if flask_app is not None else create_app()
+    asgi_app = Starlette(
+        routes=routes + [Mount("/", app=WsgiToAsgi(flask_app))],
+        middleware=[
+            Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+            # Flask compresses its own responses; this one skips anything already encoded.
+            Middleware(CompressionMiddleware),
+        ],
+        lifespan=lifespan,
+    )
+    asgi_app.state.flask_app = flask_app
+    return asgi_app
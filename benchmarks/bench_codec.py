@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: CPU per relayed event for each installed JSON codec backend.
+
+For every backend in src.codec.available(), over a Groq-style stream from bench_sse:
+  - decode: decode_chunk() of each event (what the stream accumulator does);
+  - round trip: loads() + dumps() of each event (ChunkRewriter's fallback path);
+  - relay: the whole relay path with the backend selected: SSE framing, the default
+    response transforms and accumulating, plus the completion record encoded at the end.
+Times are process CPU time (best of --repeat), in microseconds per event.
+
+Run from the repository root:
+    python -m benchmarks.bench_codec [--events 2000] [--content-size 8] [--json]
+"""
+import argparse
+import json
+import time
+
+from benchmarks.bench_sse import make_stream, split
+from src import codec
+from src.sse import SSEParser, relay
+from src.stream_assembly import CompletionAccumulator
+from src.transforms import TransformChain
+
+
+def cpu_per_event(work, events, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        work()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / events * 1e6
+
+
+def relay_stream(chunks):
+    transform = TransformChain().stream()
+    accumulator = CompletionAccumulator()
+
+    def rewrite(data):
+        data = transform(data)
+        accumulator.feed(data)
+        return data
+
+    for _ in relay(chunks, rewrite):
+        pass
+    codec.dumps(accumulator.completion())
+
+
+def run(name, chunks, events, repeat):
+    codec.use(name)
+    payloads = [data for data in SSEParser().events(chunks) if data != b"[DONE]"]
+
+    def decode():
+        for data in payloads:
+            codec.decode_chunk(data)
+
+    def round_trip():
+        for data in payloads:
+            codec.dumps(codec.loads(data))
+
+    return {
+        "backend": codec.backend,
+        "decode_us": cpu_per_event(decode, len(payloads), repeat),
+        "round_trip_us": cpu_per_event(round_trip, len(payloads), repeat),
+        "relay_us": cpu_per_event(lambda: relay_stream(chunks), events, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--content-size", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    stream = make_stream(args.events, args.content_size)
+    chunks = split(stream, args.chunk_size)
+    results = [run(name, chunks, args.events, args.repeat) for name in codec.available()]
+
+    if args.json:
+        print(json.dumps({"benchmark": "codec", "params": vars(args), "results": results}))
+        return
+    print(f"{len(stream)} bytes, {args.events} events; CPU per event")
+    for r in results:
+        print(f"{r['backend']:>8}: decode {r['decode_us']:6.2f} us  round trip {r['round_trip_us']:6.2f} us  "
+              f"relay {r['relay_us']:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
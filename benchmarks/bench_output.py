@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: writes and bytes per completion sent to the client, by coalescing window and encoding.
+
+A Groq-style stream from bench_sse arrives --burst events at a time every --gap-ms (wall
+clock), goes through src.output.acoalesce() with each window, and the resulting writes are
+encoded with each available content-encoding as CompressionMiddleware would:
+  - writes: body messages per completion; under uvicorn each is one send() syscall unless
+    the socket buffer is backed up;
+  - first write: delay to the first event, which coalescing must not add to;
+  - bytes: on the wire per completion for identity, gzip and (if installed) br;
+  - cpu: process CPU time spent compressing, in microseconds per completion.
+
+Run from the repository root:
+    python -m benchmarks.bench_output [--events 200] [--gap-ms 5] [--windows 0,0.01,0.05] [--json]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.bench_sse import make_stream
+from src import output
+from src.sse import SSEParser
+
+
+def make_events(count, content_size):
+    return [b"data: " + data + b"\n\n" for data in SSEParser().events([make_stream(count, content_size)])]
+
+
+async def upstream(events, burst, gap):
+    for i in range(0, len(events), burst):
+        if i:
+            await asyncio.sleep(gap)
+        for event in events[i:i + burst]:
+            yield event
+
+
+async def coalesced(events, burst, gap, window, max_bytes):
+    """(writes, seconds to the first write) for one completion."""
+    started = time.monotonic()
+    first = None
+    writes = []
+    async for data in output.acoalesce(upstream(events, burst, gap), window, max_bytes):
+        if first is None:
+            first = time.monotonic() - started
+        writes.append(data)
+    return writes, first
+
+
+def encode(writes, encoding):
+    """(bytes on the wire, CPU microseconds) for sending writes with encoding."""
+    if encoding == "identity":
+        return sum(len(data) for data in writes), 0.0
+    start = time.process_time()
+    encoder = output.StreamEncoder(encoding)
+    size = sum(len(encoder.encode(data)) for data in writes) + len(encoder.finish())
+    return size, (time.process_time() - start) * 1e6
+
+
+def run(events, args):
+    results = []
+    for window in args.windows:
+        writes, first = asyncio.run(coalesced(events, args.burst, args.gap_ms / 1000, window, args.max_bytes))
+        result = {"window": window, "writes": len(writes), "first_write_ms": first * 1000, "bytes": {}, "cpu_us": {}}
+        for encoding in ("identity",) + output.available_encodings():
+            result["bytes"][encoding], result["cpu_us"][encoding] = encode(writes, encoding)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--content-size", type=int, default=8)
+    parser.add_argument("--burst", type=int, default=1, help="events arriving together")
+    parser.add_argument("--gap-ms", type=float, default=5.0, help="time between arrivals")
+    parser.add_argument("--windows", type=lambda s: [float(w) for w in s.split(",")], default=[0, 0.01, 0.05])
+    parser.add_argument("--max-bytes", type=int, default=16384)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    events = make_events(args.events, args.content_size)
+    results = run(events, args)
+
+    if args.json:
+        print(json.dumps({"benchmark": "output", "params": vars(args), "results": results}))
+        return
+    print(f"{len(events)} events, {args.burst} every {args.gap_ms:g} ms; per completion")
+    for r in results:
+        sizes = "  ".join(f"{name} {size:7d} B" for name, size in r["bytes"].items())
+        cpu = "  ".join(f"{name} {us:7.0f} us" for name, us in r["cpu_us"].items() if name != "identity")
+        print(f"window {r['window'] * 1000:5g} ms: {r['writes']:4d} writes  first write {r['first_write_ms']:5.2f} ms  "
+              f"{sizes}  cpu {cpu}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Load test: proxy overhead on /openai/v1/chat/completions and /chat/message.
+
+Starts benchmarks.mock_upstream in-process and the proxy under gunicorn (WSGI or ASGI)
+in a scratch directory, then drives streaming requests at the given concurrency, first
+directly against the mock (baseline) and then through the proxy. Reports time to first
+token (and how much the proxy adds), inter-chunk latency percentiles, throughput, proxy
+CPU per stream and proxy RSS, including peak RSS growth per concurrent stream, which
+--body-kb makes meaningful for large agent-style requests. CPU and RSS are read from
+/proc, so they are Linux-only.
+
+Run from the repository root:
+    python -m benchmarks.bench_proxy [--server asgi] [--concurrency 32] [--requests 256] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import mock_upstream
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BEARER_TOKEN = "bench-bearer"
+ACCESS_TOKEN = "bench-access"
+ENDPOINTS = ("completions", "chat-message")
+
+
+def percentiles(values, scale=1000.0):
+    """p50/p90/p99/max of values, in milliseconds by default."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(pct):
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)] * scale
+
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": ordered[-1] * scale}
+
+
+def process_tree(pid):
+    """pid and all of its descendants (gunicorn master plus workers)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, ()))
+    return tree
+
+
+def cpu_seconds(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def start_proxy(args, upstream_url, workdir):
+    app_module = "asgi:create_asgi_app()" if args.server == "asgi" else "app:create_app()"
+    command = [sys.executable, "-m", "gunicorn", app_module, "-b", f"127.0.0.1:{args.port}",
+               "-w", str(args.workers), "--log-level", "warning"]
+    if args.server == "asgi":
+        command += ["-k", "uvicorn.workers.UvicornWorker"]
+    else:
+        command += ["-k", "gthread", "--threads", str(args.threads)]
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT,
+        TARGET_API_BASE_URL=upstream_url,
+        TARGET_API_KEY="bench",
+        BEARER_TOKEN=BEARER_TOKEN,
+        ACCESS_TOKEN=ACCESS_TOKEN,
+    )
+    # Run in a scratch directory so logs/ and the chat log database don't touch the checkout.
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/login", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Proxy did not start within 30 seconds")
+
+
+async def timed_stream(client, url, **kwargs):
+    """Send one streaming request; return timings measured at SSE-event granularity."""
+    started = time.perf_counter()
+    first = last = None
+    gaps = []
+    events = 0
+    size = 0
+    async with client.stream("POST", url, **kwargs) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"error": response.status_code}
+        async for chunk in response.aiter_raw():
+            now = time.perf_counter()
+            size += len(chunk)
+            count = chunk.count(b"data:")
+            if not count:
+                continue
+            if first is None:
+                first = now
+            else:
+                gaps.append(now - last)
+            last = now
+            events += count
+    if first is None:
+        return {"error": "empty stream"}
+    return {"ttft": first - started, "gaps": gaps, "duration": time.perf_counter() - started,
+            "events": events, "bytes": size}
+
+
+async def drive(make_request, concurrency, total):
+    """Run total requests with at most concurrency in flight; returns (results, wall seconds)."""
+    results = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            try:
+                results.append(await make_request())
+            except httpx.HTTPError as e:
+                results.append({"error": type(e).__name__})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def summarize(name, results, wall):
+    ok = [r for r in results if "error" not in r]
+    events = sum(r["events"] for r in ok)
+    return {
+        "target": name,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": wall,
+        "streams_per_sec": len(ok) / wall if wall else 0.0,
+        "events_per_sec": events / wall if wall else 0.0,
+        "bytes_per_sec": sum(r["bytes"] for r in ok) / wall if wall else 0.0,
+        "ttft_ms": percentiles([r["ttft"] for r in ok]),
+        "inter_chunk_ms": percentiles([gap for r in ok for gap in r["gaps"]]),
+        "duration_ms": percentiles([r["duration"] for r in ok]),
+    }
+
+
+async def sample_rss(pids_fn, peak, stop):
+    while not stop.is_set():
+        peak[0] = max(peak[0], rss_bytes(pids_fn()))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_benchmark(args, upstream_url, proxy_pid):
+    proxy = f"http://127.0.0.1:{args.port}"
+    system_prompt = "You are a benchmark. " + "Context line for the agent.\n" * (args.body_kb * 1024 // 28)
+    body = {"model": "gpt-4o", "stream": True,
+            "messages": [{"role": "system", "content": system_prompt},
+                         {"role": "user", "content": "Stream some tokens."}]}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(120.0)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        def baseline():
+            return timed_stream(client, f"{upstream_url}/chat/completions", json=body)
+
+        def completions():
+            return timed_stream(client, f"{proxy}/openai/v1/chat/completions", json=body,
+                                headers={"Authorization": f"Bearer {BEARER_TOKEN}"})
+
+        # Log in once; the session cookie stays on the client for /chat/message.
+        await client.post(f"{proxy}/login", data={"token": ACCESS_TOKEN})
+
+        def chat_message():
+            return timed_stream(client, f"{proxy}/chat/message", json={"message": "Stream some tokens."})
+
+        await drive(completions, min(args.concurrency, 4), args.warmup)
+
+        reports = []
+        results, wall = await drive(baseline, args.concurrency, args.requests)
+        baseline_report = summarize("baseline", results, wall)
+        reports.append(baseline_report)
+
+        for name, make_request in (("completions", completions), ("chat-message", chat_message)):
+            if name not in args.endpoints:
+                continue
+            pids = process_tree(proxy_pid) if proxy_pid else []
+            cpu_before = cpu_seconds(pids)
+            rss_before = rss_bytes(pids)
+            peak, stop = [rss_before], asyncio.Event()
+            sampler = asyncio.create_task(sample_rss(lambda: process_tree(proxy_pid) if proxy_pid else [], peak, stop))
+            results, wall = await drive(make_request, args.concurrency, args.requests)
+            stop.set()
+            await sampler
+            report = summarize(name, results, wall)
+            ok = report["requests"] - report["errors"]
+            if proxy_pid:
+                cpu = cpu_seconds(process_tree(proxy_pid)) - cpu_before
+                report["proxy_cpu_ms_per_stream"] = cpu * 1000 / ok if ok else None
+                report["proxy_rss_peak_bytes"] = peak[0]
+                report["proxy_rss_growth_per_stream_bytes"] = (peak[0] - rss_before) / args.concurrency
+            if report["ttft_ms"] and baseline_report["ttft_ms"]:
+                report["added_ttft_ms"] = {
+                    key: report["ttft_ms"][key] - baseline_report["ttft_ms"][key] for key in ("p50", "p90", "p99")
+                }
+            reports.append(report)
+        return reports
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"{report['target']:>13}: {report['requests']} requests, {report['errors']} errors, "
+          f"{report['streams_per_sec']:.1f} streams/s, {report['events_per_sec']:.0f} events/s")
+    if report["ttft_ms"]:
+        ttft, gaps = report["ttft_ms"], report["inter_chunk_ms"] or {}
+        print(f"{'':>15}TTFT p50 {ttft['p50']:.2f} ms  p99 {ttft['p99']:.2f} ms;  "
+              f"inter-chunk p50 {gaps.get('p50', 0):.2f} ms  p99 {gaps.get('p99', 0):.2f} ms")
+    if "added_ttft_ms" in report:
+        added = report["added_ttft_ms"]
+        print(f"{'':>15}added TTFT p50 {added['p50']:.2f} ms  p99 {added['p99']:.2f} ms")
+    if report.get("proxy_cpu_ms_per_stream") is not None:
+        print(f"{'':>15}proxy CPU {report['proxy_cpu_ms_per_stream']:.2f} ms/stream, "
+              f"peak RSS {report['proxy_rss_peak_bytes'] / 2**20:.1f} MiB "
+              f"(+{report['proxy_rss_growth_per_stream_bytes'] / 1024:.0f} KiB per concurrent stream)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi",
+                        help="asgi: gunicorn + UvicornWorker (as deployed); wsgi: gunicorn gthread")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=64, help="gthread threads per worker (wsgi only)")
+    parser.add_argument("--port", type=int, default=8077)
+    parser.add_argument("--proxy-url", help="benchmark an already running proxy instead of starting one; "
+                                            "it must use the mock as its target (see --upstream-port)")
+    parser.add_argument("--proxy-pid", type=int, help="pid of the already running proxy, for CPU/RSS")
+    parser.add_argument("--upstream-port", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256, help="requests per target")
+    parser.add_argument("--warmup", type=int, default=8)
+    parser.add_argument("--body-kb", type=int, default=0,
+                        help="pad the system prompt of /openai/v1/chat/completions requests to about this size")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    mock_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = mock_upstream.start(args, port=args.upstream_port)
+    upstream_url = mock_upstream.base_url(upstream)
+    process = None
+    with tempfile.TemporaryDirectory(prefix="bridgeai-bench-") as workdir:
+        try:
+            if args.proxy_url:
+                args.port = int(args.proxy_url.rsplit(":", 1)[1].strip("/"))
+                proxy_pid = args.proxy_pid
+            else:
+                process = start_proxy(args, upstream_url, workdir)
+                proxy_pid = process.pid
+            reports = asyncio.run(run_benchmark(args, upstream_url, proxy_pid))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+            upstream.shutdown()
+
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if k not in ("json",)}
+        print(json.dumps({"benchmark": "proxy", "revision": git_revision(), "params": params, "results": reports}))
+        return
+    print(f"{args.server} proxy, {args.workers} worker(s), concurrency {args.concurrency}, "
+          f"{args.tokens} tokens at {args.rate or 'unlimited'} tok/s of {args.token_size} chars")
+    for report in reports:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: legacy generate_stream buffer loop vs. src.sse re-framer.
+
+"sse" relays with a bare ChunkRewriter; "chain" with the default compiled response
+transform chain (src.transforms), as proxy_stream does.
+
+Run from the repository root:
+    python -m benchmarks.bench_sse [--events 2000] [--chunk-size 512] [--json]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from src.sse import ChunkRewriter, relay
+from src.transforms import TransformChain
+
+
+def make_stream(events, content_size, seed=0):
+    """Build a Groq-style chat-completion SSE stream."""
+    rnd = random.Random(seed)
+    parts = []
+    for i in range(events):
+        chunk = {
+            "id": "chatcmpl-0123456789",
+            "object": "chat.completion.chunk",
+            "created": 1717000000,
+            "model": "deepseek-r1-distill-llama-70b",
+            "system_fingerprint": "fp_123",
+            "choices": [{
+                "index": 0,
+                "delta": {"content": "".join(rnd.choice("abcdefgh ") for _ in range(content_size))},
+                "logprobs": None,
+                "finish_reason": None,
+            }],
+        }
+        if i == 0:
+            chunk["x_groq"] = {"id": "req_01"}
+        if i == events - 1:
+            chunk["choices"][0]["finish_reason"] = "stop"
+            chunk["x_groq"] = {"id": "req_01", "usage": {"prompt_tokens": 10, "completion_tokens": events}}
+        parts.append(b"data: " + json.dumps(chunk, separators=(",", ":")).encode() + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+
+def split(stream, chunk_size):
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def legacy_loop(chunks):
+    """The pre-src.sse generate_stream loop, minus the stdout print."""
+    buffer = b""
+    for chunk in chunks:
+        buffer = buffer + chunk
+        index = buffer.find(b"\n\n")
+        while index > -1:
+            line = buffer[6:index]
+            if line.find(b"[DONE]") > -1:
+                yield b"data: " + line + b"\n\n"
+                break
+            json_chunk = json.loads(line)
+            json_chunk["model"] = "gpt-4o-mini"
+            if "x_groq" in json_chunk:
+                del json_chunk["x_groq"]
+            new_chunk = "data: " + json.dumps(json_chunk) + "\n\n"
+            binary_chunk = bytes(new_chunk, "UTF-8")
+            buffer = buffer[index + 2:]
+            index = buffer.find(b"\n\n")
+            yield binary_chunk
+
+
+def reframer(chunks):
+    rewrite = ChunkRewriter({"model": "gpt-4o-mini"}, drop_fields=("x_groq",))
+    return relay(chunks, rewrite)
+
+
+def chain(chunks):
+    return relay(chunks, TransformChain().stream())
+
+
+def timed(chunks):
+    """Wrap the chunk iterator to record time spent processing each network chunk."""
+    latencies = []
+
+    def gen():
+        last = time.perf_counter()
+        for chunk in chunks:
+            yield chunk
+            now = time.perf_counter()
+            latencies.append(now - last)
+            last = now
+    return gen(), latencies
+
+
+def run(name, impl, chunks, total_bytes, repeat):
+    best = None
+    for _ in range(repeat):
+        source, latencies = timed(chunks)
+        start = time.perf_counter()
+        events = sum(1 for _ in impl(source))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best["seconds"]:
+            latencies.sort()
+            best = {
+                "impl": name,
+                "events": events,
+                "seconds": elapsed,
+                "bytes_per_sec": total_bytes / elapsed,
+                "chunk_latency_us_mean": statistics.fmean(latencies) * 1e6,
+                "chunk_latency_us_p50": latencies[len(latencies) // 2] * 1e6,
+                "chunk_latency_us_p99": latencies[int(len(latencies) * 0.99)] * 1e6,
+            }
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--content-size", type=int, default=8)
+    parser.add_argument("--chunk-size", type=int, default=512,
+                        help="network chunk size; use a large value to simulate a slow consumer")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    stream = make_stream(args.events, args.content_size)
+    chunks = split(stream, args.chunk_size)
+    results = [
+        run("legacy", legacy_loop, chunks, len(stream), args.repeat),
+        run("sse", reframer, chunks, len(stream), args.repeat),
+        run("chain", chain, chunks, len(stream), args.repeat),
+    ]
+
+    if args.json:
+        print(json.dumps({"benchmark": "sse", "params": vars(args), "results": results}))
+        return
+    print(f"{len(stream)} bytes, {args.events} events, {len(chunks)} chunks of {args.chunk_size} B")
+    for r in results:
+        print(f"{r['impl']:>8}: {r['bytes_per_sec'] / 1e6:8.2f} MB/s  "
+              f"chunk latency mean {r['chunk_latency_us_mean']:7.1f} us  "
+              f"p50 {r['chunk_latency_us_p50']:7.1f} us  p99 {r['chunk_latency_us_p99']:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: cold import, gunicorn boot, worker respawn and per-worker memory.
+
+Measures, each over --repeat runs in a scratch directory:
+  - cold import: a fresh interpreter importing the app module;
+  - boot: from starting gunicorn until the first response;
+  - respawn: from SIGKILLing every worker until a replacement answers;
+  - memory: PSS and private (unshared) memory per worker after boot, from
+    /proc/<pid>/smaps_rollup, so Linux-only.
+Boot, respawn and memory are reported with and without preload (GUNICORN_PRELOAD, see
+gunicorn.conf.py); with preload, workers share the master's pages copy-on-write.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [--server asgi] [--workers 4] [--repeat 5] [--json]
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_proxy import REPO_ROOT, git_revision, process_tree
+
+BEARER_TOKEN = "bench-bearer"
+ACCESS_TOKEN = "bench-access"
+
+
+def proxy_env():
+    return dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT,
+        TARGET_API_BASE_URL="http://127.0.0.1:9",
+        TARGET_API_KEY="bench",
+        BEARER_TOKEN=BEARER_TOKEN,
+        ACCESS_TOKEN=ACCESS_TOKEN,
+    )
+
+
+def cold_import(args, workdir):
+    """Seconds to import the app module in a fresh interpreter: (import only, whole process)."""
+    module = "asgi" if args.server == "asgi" else "app"
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    started = time.perf_counter()
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=workdir, env=proxy_env(), text=True)
+    return float(output.strip().splitlines()[-1]), time.perf_counter() - started
+
+
+def wait_until_serving(url, deadline):
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return True
+        except httpx.TransportError:
+            time.sleep(0.01)
+    return False
+
+
+def start_gunicorn(args, workdir, preload):
+    app_module = "asgi:create_asgi_app()" if args.server == "asgi" else "app:create_app()"
+    command = [sys.executable, "-m", "gunicorn", app_module, "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py"),
+               "-b", f"127.0.0.1:{args.port}", "-w", str(args.workers), "--log-level", "warning"]
+    if args.server == "asgi":
+        command += ["-k", "uvicorn.workers.UvicornWorker"]
+    else:
+        command += ["-k", "gthread", "--threads", "8"]
+    env = dict(proxy_env(), GUNICORN_PRELOAD="1" if preload else "0")
+    return subprocess.Popen(command, cwd=workdir, env=env)
+
+
+def workers_of(master):
+    return [pid for pid in process_tree(master) if pid != master]
+
+
+def wait_for_workers(master, count, deadline):
+    while time.monotonic() < deadline:
+        pids = workers_of(master)
+        if len(pids) >= count:
+            return pids
+        time.sleep(0.05)
+    return workers_of(master)
+
+
+def memory(pid):
+    """(PSS, private) bytes of one process, from smaps_rollup."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("Pss", "Private_Clean", "Private_Dirty"):
+                    values[name] = int(rest.split()[0]) * 1024
+    except OSError:
+        return None, None
+    return values.get("Pss"), values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+
+
+def boot_run(args, workdir, preload):
+    """One gunicorn lifetime: boot time, respawn times and per-worker memory."""
+    url = f"http://127.0.0.1:{args.port}/login"
+    started = time.perf_counter()
+    process = start_gunicorn(args, workdir, preload)
+    try:
+        if not wait_until_serving(url, time.monotonic() + 60):
+            raise RuntimeError("gunicorn did not start within 60 seconds")
+        boot = time.perf_counter() - started
+
+        workers = wait_for_workers(process.pid, args.workers, time.monotonic() + 60)
+        # Touch every worker a few times so memory reflects a warmed-up process.
+        for _ in range(args.workers * 4):
+            httpx.get(url, timeout=5)
+        pss, private = zip(*(memory(pid) for pid in workers)) if workers else ((), ())
+
+        respawns = []
+        for _ in range(args.respawns):
+            workers = wait_for_workers(process.pid, args.workers, time.monotonic() + 60)
+            started = time.perf_counter()
+            for pid in workers:
+                os.kill(pid, signal.SIGKILL)
+            # Wait for the old workers to be gone so the request can't reach one of them.
+            while set(workers) & set(workers_of(process.pid)):
+                time.sleep(0.005)
+            if not wait_until_serving(url, time.monotonic() + 60):
+                raise RuntimeError("no worker came back within 60 seconds")
+            respawns.append(time.perf_counter() - started)
+        return boot, respawns, [p for p in pss if p], [p for p in private if p]
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def summary(values, scale=1000.0):
+    if not values:
+        return None
+    return {"median": statistics.median(values) * scale, "min": min(values) * scale, "max": max(values) * scale}
+
+
+def run_benchmark(args):
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="bridgeai-bench-") as workdir:
+        imports = [cold_import(args, workdir) for _ in range(args.repeat)]
+        reports.append({
+            "target": "cold-import",
+            "import_ms": summary([i for i, _ in imports]),
+            "process_ms": summary([p for _, p in imports]),
+        })
+        for preload in (False, True):
+            boots, respawns, pss, private = [], [], [], []
+            for _ in range(args.repeat):
+                boot, respawn, run_pss, run_private = boot_run(args, workdir, preload)
+                boots.append(boot)
+                respawns.extend(respawn)
+                pss.extend(run_pss)
+                private.extend(run_private)
+            reports.append({
+                "target": "preload" if preload else "no-preload",
+                "boot_ms": summary(boots),
+                "respawn_ms": summary(respawns),
+                "worker_pss_bytes": statistics.median(pss) if pss else None,
+                "worker_private_bytes": statistics.median(private) if private else None,
+            })
+    return reports
+
+
+def print_report(report):
+    def ms(name):
+        value = report.get(name)
+        return f"median {value['median']:.0f} ms (min {value['min']:.0f}, max {value['max']:.0f})" if value else "n/a"
+
+    if report["target"] == "cold-import":
+        print(f"{'cold import':>12}: import {ms('import_ms')}; interpreter total {ms('process_ms')}")
+        return
+    print(f"{report['target']:>12}: boot {ms('boot_ms')}; respawn {ms('respawn_ms')}")
+    if report["worker_pss_bytes"]:
+        print(f"{'':>14}per worker PSS {report['worker_pss_bytes'] / 2**20:.1f} MiB, "
+              f"private {report['worker_private_bytes'] / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi",
+                        help="asgi: gunicorn + UvicornWorker (as deployed); wsgi: gunicorn gthread")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8078)
+    parser.add_argument("--repeat", type=int, default=5, help="cold imports and gunicorn boots per variant")
+    parser.add_argument("--respawns", type=int, default=3, help="worker kills per gunicorn boot")
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    reports = run_benchmark(args)
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if k not in ("json",)}
+        print(json.dumps({"benchmark": "startup", "revision": git_revision(), "params": params, "results": reports}))
+        return
+    print(f"{args.server} proxy, {args.workers} worker(s), {args.repeat} run(s) per variant")
+    for report in reports:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI-compatible upstream (Groq flavoured).
+
+Streams chat.completion.chunk events at a configurable token rate and size, with
+x_groq fields on the first and last chunk like Groq does. Serves POST .../chat/completions
+(streaming and not) and GET .../models.
+
+Run from the repository root:
+    python -m benchmarks.mock_upstream [--port 8001] [--tokens 200] [--rate 100] [--token-size 4]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL = "deepseek-r1-distill-llama-70b"
+
+
+def chunk_event(index, content, finish_reason=None, x_groq=None, usage=None):
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": 1717000000,
+        "model": MODEL,
+        "system_fingerprint": "fp_mock",
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content} if content is not None else {},
+            "logprobs": None,
+            "finish_reason": finish_reason,
+        }],
+    }
+    if x_groq is not None:
+        chunk["x_groq"] = x_groq
+    if usage is not None:
+        chunk["choices"] = []
+        chunk["usage"] = usage
+    return b"data: " + json.dumps(chunk, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.rstrip("/").endswith("/models"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        self._send_json(200, {"object": "list", "data": [{"id": MODEL, "object": "model", "owned_by": "mock"}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        options = self.server.options
+        self.server.requests += 1
+        tokens = options.tokens
+        token = "x" * (options.token_size - 1) + " "
+        usage = {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": 10 + tokens}
+        if options.ttft:
+            time.sleep(options.ttft)
+
+        if not body.get("stream"):
+            return self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": 1717000000,
+                "model": MODEL,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": token * tokens},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / options.rate if options.rate else 0.0
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        try:
+            for i in range(tokens):
+                x_groq = {"id": "req_mock"} if options.x_groq and i == 0 else None
+                self._write_chunk(chunk_event(i, token, x_groq=x_groq))
+                if interval:
+                    time.sleep(interval)
+            x_groq = {"id": "req_mock", "usage": usage} if options.x_groq else None
+            self._write_chunk(chunk_event(tokens, None, finish_reason="stop", x_groq=x_groq))
+            if include_usage:
+                self._write_chunk(chunk_event(tokens, None, usage=usage))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client (or proxy) went away; nothing left to do.
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def start(options, host="127.0.0.1", port=0):
+    """Start the mock in a daemon thread and return the server; its URL is base_url(server)."""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name="mock-upstream", daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--tokens", type=int, default=200, help="content chunks per completion")
+    parser.add_argument("--rate", type=float, default=100.0, help="tokens per second; 0 streams as fast as possible")
+    parser.add_argument("--token-size", type=int, default=4, help="characters per content chunk")
+    parser.add_argument("--ttft", type=float, default=0.0, help="upstream delay before the first chunk, seconds")
+    parser.add_argument("--no-x-groq", dest="x_groq", action="store_false", help="omit Groq x_groq fields")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start(args, args.host, args.port)
+    print(f"Mock upstream listening on {base_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Gunicorn settings, picked up automatically from the working directory:
+
+    gunicorn "asgi:create_asgi_app()" -k uvicorn.workers.UvicornWorker
+
+With GUNICORN_PRELOAD=1 the app is imported once in the master and forked into
+workers, so a worker (or a replacement after a crash) is serving almost as soon as it
+is spawned. Garbage collection stays off while the app loads and everything loaded is
+frozen before forking, keeping the shared pages out of the collector's reach so the
+workers don't copy them on the first collection.
+
+Metric snapshots left in METRICS_DIR by the previous run are removed before any worker
+starts.
+"""
+import gc
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() in ("1", "true", "yes")
+
+if preload_app:
+    gc.disable()
+
+
+def on_starting(server):
+    # Snapshots from the previous run would otherwise be merged into this run's totals.
+    from src import metrics
+    metrics.clear()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+    # With preload the config watcher thread stayed in the master; start this worker's own.
+    from src import config, metrics
+    config.start_watcher()
+    metrics.start_flusher()
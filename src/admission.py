@@ -0,0 +1,390 @@
+"""
+Per-API-key admission control for the completion endpoints.
+
+Each key has a cap on in-flight completions, a requests-per-minute and a
+tokens-per-minute token bucket, and a FIFO wait queue: requests that can't be admitted
+wait their turn for up to ADMISSION_MAX_WAIT seconds and are otherwise rejected with
+429 and Retry-After. One aggressive client only ever queues behind itself.
+
+State for every key is a 64-byte slot in an mmap'd file (QUOTA_FILE) shared by all
+gunicorn workers. A check takes the slot's byte-range lock, refills the buckets from
+the elapsed time and updates the slot in place, so its cost doesn't depend on load.
+Tokens are debited up front from an estimate and corrected with the usage the
+upstream reports. Each key set gets its own file (named by a fingerprint of the keys and
+limits), so a reload never changes the layout under workers that haven't reloaded yet.
+A reload that leaves the keys as they were keeps the open store; otherwise the old one is
+closed once the last request admitted through it is released.
+In-flight counts held by a worker that is killed are not recovered until the keys change.
+"""
+import asyncio
+import fcntl
+import hashlib
+import hmac
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from src import config, metrics
+from src.config import settings
+
+# in_flight, request level, request refill time, token level, token refill time,
+# next queue ticket, ticket being served, last time the head of the queue polled.
+_SLOT = struct.Struct("<qddddqqd")
+_HEADER = struct.Struct("<8s32s")
+_MAGIC = b"BRQUOTA1"
+_HEADER_SIZE = 64
+# Waiters poll at this interval; a queue head silent for _STALE_HEAD is skipped.
+_POLL_INTERVAL = 0.05
+_STALE_HEAD = 0.25
+# Retry-After hint when the wait can't be computed (concurrency cap, queue).
+_CONCURRENCY_RETRY = 1.0
+# Rough bytes per token for the up-front estimate.
+_BYTES_PER_TOKEN = 4
+
+ADMISSIONS = metrics.Counter("bridgeai_admissions_total", "Admission decisions per API key.", ("key", "result"))
+ADMISSION_WAIT = metrics.Histogram("bridgeai_admission_wait_seconds", "Time spent queued before admission.", ("key",))
+
+
+class ApiKey:
+    __slots__ = ("name", "digest", "max_concurrent", "rpm", "tpm", "index")
+
+    def __init__(self, name, token, max_concurrent=0, rpm=0, tpm=0):
+        self.name = name
+        self.digest = hashlib.sha256(token.encode("utf-8")).digest()
+        self.max_concurrent = int(max_concurrent)
+        self.rpm = float(rpm)
+        self.tpm = float(tpm)
+        self.index = None
+
+
+class Rejected(Exception):
+    def __init__(self, key, reason, retry_after):
+        super().__init__(f"Rate limit exceeded for API key '{key.name}': {reason}")
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def estimate_tokens(body):
+    return len(body) // _BYTES_PER_TOKEN if body else 0
+
+
+class Lease:
+    """An admitted request. Set tokens to the reported usage, then release() exactly once (extra calls are no-ops)."""
+
+    def __init__(self, store, key, estimate):
+        self.store = store
+        self.key = key
+        self.estimate = estimate
+        self.tokens = None
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        adjust = self.tokens - self.estimate if self.tokens is not None else 0
+        self.store.release(self.key, adjust)
+        self.store.drop()
+
+
+class QuotaStore:
+    def __init__(self, path, keys):
+        self.keys = keys
+        for index, key in enumerate(keys):
+            key.index = index
+        fingerprint = hashlib.sha256(
+            json.dumps([(k.name, k.max_concurrent, k.rpm, k.tpm) for k in keys]).encode("utf-8")
+        ).digest()
+        root, ext = os.path.splitext(path)
+        self.path = f"{root}-{fingerprint.hex()[:12]}{ext}"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = _HEADER_SIZE + _SLOT.size * max(len(keys), 1)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) < _HEADER.size or _HEADER.unpack(header) != (_MAGIC, fingerprint) \
+                    or os.fstat(self._fd).st_size != size:
+                # A new file (or a damaged one): start every slot from scratch.
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, fingerprint), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        # Requests admitted through (or waiting on) this store; see hold() and retire().
+        self._users = 0
+        self._retired = False
+        self._reset_locks()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        # fcntl locks don't exclude threads of the same process, hence the thread locks too.
+        self._locks = [threading.Lock() for _ in self.keys]
+        self._users_lock = threading.Lock()
+
+    def hold(self):
+        """Keep the store open for a request until drop() is called."""
+        with self._users_lock:
+            self._users += 1
+
+    def drop(self):
+        with self._users_lock:
+            self._users -= 1
+            close = self._retired and self._users == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """The key set changed: close the store once the requests still using it are done."""
+        with self._users_lock:
+            self._retired = True
+            close = self._users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @property
+    def closed(self):
+        return self._map.closed
+
+    @contextmanager
+    def _slot(self, key):
+        offset = _HEADER_SIZE + key.index * _SLOT.size
+        with self._locks[key.index]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, _SLOT.size, offset)
+            try:
+                values = list(_SLOT.unpack_from(self._map, offset))
+                yield values
+                _SLOT.pack_into(self._map, offset, *values)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, _SLOT.size, offset)
+
+    def take_ticket(self, key):
+        with self._slot(key) as slot:
+            ticket = slot[5]
+            slot[5] += 1
+            if slot[5] - 1 == slot[6]:
+                slot[7] = time.time()
+            return ticket
+
+    def try_admit(self, key, ticket, estimate):
+        """
+        Return (admitted, wait, reason). When not admitted, wait is the time until the
+        rate limits allow the request, or None if it depends on other requests finishing.
+        """
+        now = time.time()
+        with self._slot(key) as slot:
+            in_flight, req_level, req_time, tok_level, tok_time, _, serving, head_seen = slot
+            if ticket != serving:
+                if serving < ticket and now - head_seen > _STALE_HEAD:
+                    # The waiter at the head gave up or died; move the queue along.
+                    slot[6] = serving + 1
+                    slot[7] = now
+                return False, None, "too many queued requests"
+            slot[7] = now
+
+            if key.rpm:
+                req_level = key.rpm if req_time == 0 else min(key.rpm, req_level + (now - req_time) * key.rpm / 60)
+                slot[1], slot[2] = req_level, now
+            if key.tpm:
+                tok_level = key.tpm if tok_time == 0 else min(key.tpm, tok_level + (now - tok_time) * key.tpm / 60)
+                slot[3], slot[4] = tok_level, now
+
+            wait = 0.0
+            if key.rpm and req_level < 1:
+                wait = max(wait, (1 - req_level) * 60 / key.rpm)
+            if key.tpm and tok_level <= 0:
+                wait = max(wait, (1 - tok_level) * 60 / key.tpm)
+            if wait:
+                return False, wait, "request or token rate limit reached"
+            if key.max_concurrent and in_flight >= key.max_concurrent:
+                return False, None, f"more than {key.max_concurrent} concurrent requests"
+
+            slot[0] = in_flight + 1
+            if key.rpm:
+                slot[1] = req_level - 1
+            if key.tpm:
+                slot[3] = tok_level - estimate
+            slot[6] = serving + 1
+            return True, 0.0, None
+
+    def abandon(self, key, ticket):
+        with self._slot(key) as slot:
+            if slot[6] == ticket:
+                slot[6] += 1
+                slot[7] = time.time()
+
+    def release(self, key, token_adjust=0):
+        with self._slot(key) as slot:
+            slot[0] = max(slot[0] - 1, 0)
+            if key.tpm and token_adjust:
+                slot[3] -= token_adjust
+
+    def stats(self):
+        result = {}
+        for key in self.keys:
+            with self._slot(key) as slot:
+                result[key.name] = {
+                    "in_flight": slot[0],
+                    "max_concurrent": key.max_concurrent,
+                    "queued": slot[5] - slot[6],
+                    "requests_available": slot[1] if key.rpm and slot[2] else key.rpm or None,
+                    "tokens_available": slot[3] if key.tpm and slot[4] else key.tpm or None,
+                    "rpm": key.rpm or None,
+                    "tpm": key.tpm or None,
+                }
+        return result
+
+
+class Admission:
+    def __init__(self, keys, store_path=None, max_wait=None):
+        self._lock = threading.Lock()
+        self.configure(keys, store_path, max_wait)
+
+    def configure(self, keys, store_path=None, max_wait=None):
+        """
+        Switch to a new key set; its quota store is opened on next use. If the keys, their
+        limits and the path are unchanged the current store is kept, else it is retired.
+        """
+        store_path = store_path or settings.QUOTA_FILE
+        fingerprint = ([(k.name, k.digest, k.max_concurrent, k.rpm, k.tpm) for k in keys], store_path)
+        retired = None
+        with self._lock:
+            self.max_wait = settings.ADMISSION_MAX_WAIT if max_wait is None else max_wait
+            if fingerprint == getattr(self, "_fingerprint", None):
+                return
+            self._fingerprint = fingerprint
+            self.keys = keys
+            self._by_digest = {key.digest: key for key in keys}
+            retired, self._store = getattr(self, "_store", None), None
+            self._store_path = store_path
+        if retired is not None:
+            retired.retire()
+
+    def _hold_store(self):
+        """The current quota store, held open for the caller; drop() it when done."""
+        with self._lock:
+            # Opened on first use so importing this module never touches the filesystem.
+            if self._store is None:
+                self._store = QuotaStore(self._store_path, self.keys)
+            self._store.hold()
+            return self._store
+
+    def authenticate(self, token):
+        """Return the ApiKey for token, or None. One hash and one dict lookup, compared in constant time."""
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        key = self._by_digest.get(digest)
+        if key is not None and hmac.compare_digest(key.digest, digest):
+            return key
+        return None
+
+    def _unlimited(self, key):
+        return not (key.max_concurrent or key.rpm or key.tpm)
+
+    def acquire(self, key, estimate=0):
+        """Admit a request for key, waiting in its queue if needed; raises Rejected."""
+        if self._unlimited(key):
+            return Lease(_NullStore, key, estimate)
+        store = self._hold_store()
+        try:
+            started = time.time()
+            deadline = started + self.max_wait
+            ticket = store.take_ticket(key)
+            while True:
+                admitted, wait, reason = store.try_admit(key, ticket, estimate)
+                if admitted:
+                    self._record(key, started)
+                    # The lease keeps the store held until it is released.
+                    return Lease(store, key, estimate)
+                remaining = deadline - time.time()
+                # Give up early when the rate limits alone outlast the wait.
+                if remaining <= 0 or wait is not None and wait > remaining:
+                    raise self._reject(store, key, ticket, reason, wait)
+                time.sleep(min(_POLL_INTERVAL, remaining))
+        except BaseException:
+            store.drop()
+            raise
+
+    async def aacquire(self, key, estimate=0):
+        """acquire() for the event loop: waits with asyncio.sleep."""
+        if self._unlimited(key):
+            return Lease(_NullStore, key, estimate)
+        store = self._hold_store()
+        try:
+            started = time.time()
+            deadline = started + self.max_wait
+            ticket = store.take_ticket(key)
+            while True:
+                admitted, wait, reason = store.try_admit(key, ticket, estimate)
+                if admitted:
+                    self._record(key, started)
+                    return Lease(store, key, estimate)
+                remaining = deadline - time.time()
+                if remaining <= 0 or wait is not None and wait > remaining:
+                    raise self._reject(store, key, ticket, reason, wait)
+                await asyncio.sleep(min(_POLL_INTERVAL, remaining))
+        except BaseException:
+            store.drop()
+            raise
+
+    def _record(self, key, started):
+        waited = time.time() - started
+        ADMISSIONS.inc(key.name, "queued" if waited > _POLL_INTERVAL else "admitted")
+        ADMISSION_WAIT.observe(waited, key.name)
+
+    def _reject(self, store, key, ticket, reason, wait):
+        store.abandon(key, ticket)
+        ADMISSIONS.inc(key.name, "rejected")
+        return Rejected(key, reason, _CONCURRENCY_RETRY if wait is None else wait)
+
+    def stats(self):
+        if not self.keys:
+            return {}
+        store = self._hold_store()
+        try:
+            return store.stats()
+        finally:
+            store.drop()
+
+
+class _NullStore:
+    @staticmethod
+    def release(key, token_adjust=0):
+        pass
+
+    @staticmethod
+    def drop():
+        pass
+
+
+def load_keys():
+    """API keys from API_KEYS (JSON list), plus BEARER_TOKEN as key "default" when set."""
+    defaults = {"max_concurrent": settings.API_KEY_MAX_CONCURRENT, "rpm": settings.API_KEY_RPM,
+                "tpm": settings.API_KEY_TPM}
+    keys = []
+    for entry in json.loads(settings.API_KEYS) if settings.API_KEYS else []:
+        token = entry.get("key") or settings.get(entry.get("key_env", ""), "")
+        if not token:
+            continue
+        keys.append(ApiKey(entry["name"], token, **{k: entry.get(k, v) for k, v in defaults.items()}))
+    bearer = settings.BEARER_TOKEN
+    if bearer and not any(k.digest == hashlib.sha256(bearer.encode("utf-8")).digest() for k in keys):
+        keys.append(ApiKey("default", bearer, **defaults))
+    return keys
+
+
+admission = Admission(load_keys())
+
+
+@config.on_reload
+def _apply_settings(changed):
+    admission.configure(load_keys())
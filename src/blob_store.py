@@ -0,0 +1,160 @@
+"""
+Content-addressed blob store for large, repeated parts of logged requests.
+
+Clients such as Cursor resend the same multi-kilobyte system prompt and tool definitions
+on every turn. Before a request is written to the chat log, each message content (and
+the top-level tools/functions lists) at least min_bytes long is stored once under its
+SHA-256 and replaced by {"$blob": "<sha256>"}. Blobs are zstd-compressed when the
+zstandard package is installed, gzip otherwise; readers handle either.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOB_KEY = "$blob"
+# Top-level request fields that are deduplicated as a whole.
+DEDUPE_FIELDS = ("tools", "functions")
+# Bound on the in-memory set of digests known to be on disk.
+_MAX_KNOWN = 100_000
+
+
+def _is_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and isinstance(value.get(BLOB_KEY), str)
+
+
+class BlobStore:
+    def __init__(self, directory, min_bytes=1024):
+        self.directory = directory
+        self.min_bytes = min_bytes
+        self.extension = ".zst" if zstandard else ".gz"
+        self._known = set()
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "deduplicated": 0, "bytes_in": 0, "bytes_stored": 0}
+        self.get = functools.lru_cache(maxsize=256)(self._read)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest, extension):
+        return os.path.join(self.directory, digest[:2], digest + extension)
+
+    def _compress(self, data):
+        if zstandard:
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return gzip.compress(data, compresslevel=6)
+
+    def put(self, data):
+        """Store data (bytes) if not already present and return its hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = digest in self._known
+        if known or any(os.path.exists(self._path(digest, ext)) for ext in (".zst", ".gz")):
+            self.stats["deduplicated"] += 1
+        else:
+            path = self._path(digest, self.extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = self._compress(data)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(compressed)
+            # Atomic publish; concurrent writers of the same digest write identical content.
+            os.replace(tmp, path)
+            self.stats["stored"] += 1
+            self.stats["bytes_stored"] += len(compressed)
+        self.stats["bytes_in"] += len(data)
+        with self._lock:
+            if len(self._known) >= _MAX_KNOWN:
+                self._known.clear()
+            self._known.add(digest)
+        return digest
+
+    def _read(self, digest):
+        for extension in (".zst", ".gz"):
+            try:
+                with open(self._path(digest, extension), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            if extension == ".gz":
+                return gzip.decompress(data)
+            if zstandard is None:
+                raise RuntimeError(f"Blob {digest} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        raise FileNotFoundError(f"Blob {digest} not found in {self.directory}")
+
+    def _ref(self, value):
+        """Return a blob reference for value if it is large enough, else value itself."""
+        if value is None or _is_ref(value):
+            return value
+        encoded = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if len(encoded) < self.min_bytes:
+            return value
+        return {BLOB_KEY: self.put(encoded)}
+
+    def dedupe(self, obj):
+        """
+        Return a copy of a chat request with large message contents and tool lists replaced
+        by blob references. obj itself is not modified; non-request values pass through.
+        """
+        if not isinstance(obj, dict):
+            return obj
+        result = dict(obj)
+        for field in DEDUPE_FIELDS:
+            if field in result:
+                result[field] = self._ref(result[field])
+        messages = result.get("messages")
+        if isinstance(messages, list):
+            result["messages"] = [
+                dict(m, content=self._ref(m["content"])) if isinstance(m, dict) and "content" in m else m
+                for m in messages
+            ]
+        return result
+
+    def _resolve(self, value):
+        if _is_ref(value):
+            try:
+                return json.loads(self.get(value[BLOB_KEY]))
+            except (OSError, ValueError, RuntimeError):
+                # Leave the reference in place rather than failing the whole read.
+                return value
+        return value
+
+    def rehydrate(self, obj):
+        """Inverse of dedupe()."""
+        if not isinstance(obj, dict):
+            return obj
+        result = dict(obj)
+        for field in DEDUPE_FIELDS:
+            if field in result:
+                result[field] = self._resolve(result[field])
+        messages = result.get("messages")
+        if isinstance(messages, list):
+            result["messages"] = [
+                dict(m, content=self._resolve(m["content"])) if isinstance(m, dict) and "content" in m else m
+                for m in messages
+            ]
+        return result
+
+    def rehydrate_text(self, text):
+        """Rehydrate a logged message if it is a JSON request containing blob references."""
+        if f'"{BLOB_KEY}"' not in text:
+            return text
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            return text
+        return json.dumps(self.rehydrate(obj))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 4 or sys.argv[1] != "cat":
+        sys.exit("usage: python -m src.blob_store cat <blob dir> <sha256>")
+    sys.stdout.write(BlobStore(sys.argv[2]).get(sys.argv[3]).decode("utf-8") + "\n")
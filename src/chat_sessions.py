@@ -0,0 +1,135 @@
+"""
+Server-side conversations for the /chat page.
+
+The browser only sends its new message and a conversation id; the history lives here,
+so a turn costs the same on the wire however long the conversation gets. Each
+conversation is one row in a SQLite database (WAL mode, shared by all gunicorn workers)
+holding its messages as zlib-compressed JSON. Conversations idle for CHAT_SESSION_TTL,
+or beyond the newest CHAT_SESSION_MAX, are evicted.
+
+History is kept within CHAT_CONTEXT_TOKENS (estimated from the UTF-8 size, like
+admission's estimate): the oldest turns are dropped first, and reasoning (<think>
+blocks) is never stored, since the model doesn't need its old reasoning back.
+"""
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+
+from src import codec
+from src.config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    messages BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chat_sessions_updated ON chat_sessions (updated);
+"""
+
+# Rough bytes per token, and per-message overhead for the role and framing.
+_BYTES_PER_TOKEN = 4
+_MESSAGE_OVERHEAD = 4
+# Evict expired conversations once every this many saves per process.
+_EVICT_EVERY = 100
+
+_THINK = re.compile(r"<think>.*?(?:</think>|$)\s*", re.DOTALL)
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def message_tokens(message):
+    return len(str(message.get("content") or "").encode("utf-8")) // _BYTES_PER_TOKEN + _MESSAGE_OVERHEAD
+
+
+def fit_context(messages, budget):
+    """
+    Return (the newest messages that fit in budget tokens, number dropped). The last
+    message is always kept, and the result never starts with an assistant reply.
+    """
+    total = 0
+    start = len(messages)
+    while start > 0:
+        tokens = message_tokens(messages[start - 1])
+        if total + tokens > budget and start < len(messages):
+            break
+        total += tokens
+        start -= 1
+    while start < len(messages) - 1 and messages[start].get("role") == "assistant":
+        start += 1
+    return messages[start:], start
+
+
+def strip_reasoning(text):
+    return _THINK.sub("", text).strip()
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class ChatSessionStore:
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+        self._saves = 0
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forks. Opened on first use.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            path = self.path or settings.CHAT_SESSION_DB
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, session_id):
+        """The stored messages of a conversation, or None if it doesn't exist (or expired)."""
+        if not session_id or not _SESSION_ID.match(session_id):
+            return None
+        row = self._connect().execute(
+            "SELECT messages FROM chat_sessions WHERE id = ? AND updated >= ?",
+            (session_id, time.time() - settings.CHAT_SESSION_TTL),
+        ).fetchone()
+        return codec.loads(zlib.decompress(row[0])) if row else None
+
+    def append(self, session_id, messages):
+        """Add messages to a conversation (creating it), keeping it within CHAT_CONTEXT_TOKENS."""
+        conn = self._connect()
+        with conn:
+            # BEGIN IMMEDIATE: two workers appending to one conversation must not interleave.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT messages FROM chat_sessions WHERE id = ?", (session_id,)).fetchone()
+            history = codec.loads(zlib.decompress(row[0])) if row else []
+            history, _ = fit_context(history + messages, settings.CHAT_CONTEXT_TOKENS)
+            data = zlib.compress(codec.dumps(history))
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (id, updated, messages) VALUES (?, ?, ?)",
+                (session_id, time.time(), data),
+            )
+        self._saves += 1
+        if self._saves % _EVICT_EVERY == 1:
+            self.evict()
+
+    def evict(self):
+        """Delete expired conversations and all but the newest CHAT_SESSION_MAX."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM chat_sessions WHERE updated < ?", (time.time() - settings.CHAT_SESSION_TTL,))
+            conn.execute(
+                "DELETE FROM chat_sessions WHERE id IN "
+                "(SELECT id FROM chat_sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                (settings.CHAT_SESSION_MAX,),
+            )
+
+
+chat_sessions = ChatSessionStore()
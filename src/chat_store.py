@@ -0,0 +1,232 @@
+"""
+Indexed chat log store.
+
+Chat log records are appended to a SQLite database (WAL mode, safe for several gunicorn
+workers) indexed by timestamp, role and conversation, with an FTS5 index for text search
+when the SQLite build supports it. /api/chat-logs pages through it with a cursor instead
+of re-parsing logs/chat_logs.txt. Messages that reference a blob store (see
+src/blob_store.py) are rehydrated on read.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_logs (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    role TEXT NOT NULL,
+    source TEXT NOT NULL,
+    conversation TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chat_logs_ts ON chat_logs (ts);
+CREATE INDEX IF NOT EXISTS ix_chat_logs_role_ts ON chat_logs (role, ts);
+CREATE INDEX IF NOT EXISTS ix_chat_logs_conversation_ts ON chat_logs (conversation, ts);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chat_logs_fts USING fts5(
+    message, content='chat_logs', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS chat_logs_fts_insert AFTER INSERT ON chat_logs BEGIN
+    INSERT INTO chat_logs_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_logs_fts_delete AFTER DELETE ON chat_logs BEGIN
+    INSERT INTO chat_logs_fts (chat_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+_TEXT_LOG_LINE = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (.*?): (.*)", re.DOTALL)
+
+
+def conversation_key(messages):
+    """Stable conversation id derived from the opening system and user messages."""
+    opening = [
+        str(m.get("content")) for m in messages[:4]
+        if isinstance(m, dict) and m.get("role") in ("system", "user")
+    ][:2]
+    return hashlib.sha1("\x00".join(opening).encode("utf-8")).hexdigest()[:16]
+
+
+def role_for(source, levelno=logging.INFO):
+    if levelno >= logging.WARNING:
+        return "system"
+    return "user" if "user" in source.lower() else "assistant"
+
+
+def format_timestamp(ts):
+    """Format like logging's asctime, which the chat log page parses."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) + f",{int(ts % 1 * 1000):03d}"
+
+
+def parse_time(value):
+    """Accept epoch seconds or an ISO 8601 timestamp."""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class ChatLogStore:
+    def __init__(self, path, blobs=None):
+        self.path = path
+        self.blobs = blobs
+        self._local = threading.local()
+        self.fts = None
+        self._ensure_schema()
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forks.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_schema(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self._connect()
+        with conn:
+            conn.executescript(_SCHEMA)
+        try:
+            with conn:
+                conn.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE.
+            self.fts = False
+
+    def append_many(self, rows):
+        """Insert (ts, role, source, conversation, message) rows in one transaction."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO chat_logs (ts, role, source, conversation, message) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def query(self, cursor=None, limit=100, since=None, until=None, role=None, conversation=None, q=None):
+        """
+        Return (entries, next_cursor), newest first. Pass next_cursor back as cursor to
+        fetch the following page; it is None on the last page.
+        """
+        clauses, params = [], []
+        if cursor:
+            clauses.append("c.id < ?")
+            params.append(int(cursor))
+        if since is not None:
+            clauses.append("c.ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("c.ts < ?")
+            params.append(until)
+        if role:
+            clauses.append("c.role = ?")
+            params.append(role)
+        if conversation:
+            clauses.append("c.conversation = ?")
+            params.append(conversation)
+        source = "chat_logs AS c"
+        if q:
+            if self.fts:
+                source = "chat_logs_fts JOIN chat_logs AS c ON c.id = chat_logs_fts.rowid"
+                clauses.append("chat_logs_fts MATCH ?")
+                params.append('"' + q.replace('"', '""') + '"')
+            else:
+                clauses.append("c.message LIKE ?")
+                params.append(f"%{q}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params.append(limit + 1)
+        rows = self._connect().execute(
+            f"SELECT c.id, c.ts, c.role, c.source, c.conversation, c.message FROM {source} "
+            f"{where} ORDER BY c.id DESC LIMIT ?",
+            params,
+        ).fetchall()
+
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        entries = [
+            {
+                "id": row_id,
+                "timestamp": format_timestamp(ts),
+                "role": role,
+                "source": source_name,
+                "conversation": conversation_id,
+                "message": self.blobs.rehydrate_text(message) if self.blobs else message,
+            }
+            for row_id, ts, role, source_name, conversation_id, message in rows[:limit]
+        ]
+        return entries, next_cursor
+
+    def import_text_log(self, path):
+        """One-off import of a legacy logs/chat_logs.txt, joining multi-line entries."""
+        rows = []
+        current = None
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if _TEXT_LOG_LINE.match(line):
+                    if current:
+                        rows.append(current)
+                    current = line
+                elif current is not None:
+                    current += line
+        if current:
+            rows.append(current)
+
+        parsed = []
+        for entry in rows:
+            timestamp, source, message = _TEXT_LOG_LINE.match(entry.rstrip("\n")).groups()
+            ts = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S,%f").timestamp()
+            parsed.append((ts, role_for(source), source, None, message))
+        self.append_many(parsed)
+        return len(parsed)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class ChatStoreSink:
+    """log_pipeline sink that writes chat log records into a ChatLogStore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def write_batch(self, records, format):
+        rows = []
+        for record in records:
+            message = record.getMessage()
+            source = getattr(record, "source", None)
+            if source is None:
+                source, sep, rest = message.partition(": ")
+                if sep:
+                    message = rest
+                else:
+                    source = record.levelname
+            role = getattr(record, "role", None) or role_for(source, record.levelno)
+            rows.append((record.created, role, source, getattr(record, "conversation", None), message))
+        self.store.append_many(rows)
+        return len(rows)
+
+    def close(self):
+        self.store.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 4 or sys.argv[1] != "import":
+        sys.exit("usage: python -m src.chat_store import <chat_logs.txt> <chat_logs.db>")
+    print(f"Imported {ChatLogStore(sys.argv[3]).import_text_log(sys.argv[2])} entries")
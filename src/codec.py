@@ -0,0 +1,189 @@
+"""
+JSON encoding and decoding for the request path.
+
+One backend is used per process: orjson if it is installed, else msgspec, else the
+standard library; JSON_CODEC forces one. Every backend encodes to compact UTF-8 bytes
+and raises ValueError for malformed input, so callers don't need to know which is in
+use. Anything a fast backend rejects (integers beyond 64 bits, non-string keys) is
+handed to the standard library instead of failing.
+
+decode_chunk() decodes one chat.completion.chunk event. With msgspec it decodes against
+ChatCompletionChunk, skipping the fields nothing reads instead of building them.
+
+Hashes that must stay stable across backends (cache keys, blob digests) keep using the
+standard library directly.
+"""
+import json
+import logging
+from typing import List, Optional, TypedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from src import config
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FunctionDelta(TypedDict, total=False):
+    name: Optional[str]
+    arguments: Optional[str]
+
+
+class ToolCallDelta(TypedDict, total=False):
+    index: int
+    id: Optional[str]
+    type: Optional[str]
+    function: Optional[FunctionDelta]
+
+
+class Delta(TypedDict, total=False):
+    role: Optional[str]
+    content: Optional[str]
+    reasoning: Optional[str]
+    reasoning_content: Optional[str]
+    refusal: Optional[str]
+    tool_calls: Optional[List[ToolCallDelta]]
+
+
+class ChunkChoice(TypedDict, total=False):
+    index: int
+    delta: Delta
+    finish_reason: Optional[str]
+
+
+class Usage(TypedDict, total=False):
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    total_tokens: Optional[int]
+
+
+class XGroq(TypedDict, total=False):
+    id: Optional[str]
+    usage: Optional[Usage]
+
+
+class ChatCompletionChunk(TypedDict, total=False):
+    id: Optional[str]
+    object: Optional[str]
+    created: Optional[int]
+    model: Optional[str]
+    system_fingerprint: Optional[str]
+    choices: Optional[List[ChunkChoice]]
+    usage: Optional[Usage]
+    x_groq: Optional[XGroq]
+    error: Optional[dict]
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _json_decode_chunk(data):
+    chunk = json.loads(data)
+    if not isinstance(chunk, dict):
+        raise ValueError("chunk is not a JSON object")
+    return chunk
+
+
+class Codec:
+    """A JSON backend: loads(bytes or str), dumps(obj) -> bytes and decode_chunk(bytes)."""
+
+    def __init__(self, name, loads, dumps, decode_chunk):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.decode_chunk = decode_chunk
+
+
+def _stdlib_codec():
+    return Codec("json", json.loads, _json_dumps, _json_decode_chunk)
+
+
+def _orjson_codec():
+    def loads(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            return _json_dumps(obj)
+
+    def decode_chunk(data):
+        chunk = loads(data)
+        if not isinstance(chunk, dict):
+            raise ValueError("chunk is not a JSON object")
+        return chunk
+
+    return Codec("orjson", loads, dumps, decode_chunk)
+
+
+def _msgspec_codec():
+    decoder = msgspec.json.Decoder()
+    chunk_decoder = msgspec.json.Decoder(ChatCompletionChunk)
+    encoder = msgspec.json.Encoder()
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError:
+            return json.loads(data)
+
+    def dumps(obj):
+        try:
+            return encoder.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            return _json_dumps(obj)
+
+    def decode_chunk(data):
+        try:
+            return chunk_decoder.decode(data)
+        except msgspec.DecodeError:
+            # Off-schema (or invalid) chunks get a plain decode, which raises ValueError if invalid.
+            return _json_decode_chunk(data)
+
+    return Codec("msgspec", loads, dumps, decode_chunk)
+
+
+def available():
+    """The installed backends by name, fastest first."""
+    codecs = {}
+    if orjson is not None:
+        codecs["orjson"] = _orjson_codec()
+    if msgspec is not None:
+        codecs["msgspec"] = _msgspec_codec()
+    codecs["json"] = _stdlib_codec()
+    return codecs
+
+
+def use(name="auto"):
+    """Switch this process to backend name ("auto" picks the fastest installed one)."""
+    global backend, loads, dumps, decode_chunk
+    codecs = available()
+    if name not in codecs:
+        if name != "auto":
+            logger.warning(f"JSON codec {name!r} is not available; using {next(iter(codecs))}")
+        name = next(iter(codecs))
+    codec = codecs[name]
+    backend, loads, dumps, decode_chunk = codec.name, codec.loads, codec.dumps, codec.decode_chunk
+
+
+use(settings.JSON_CODEC)
+
+
+@config.on_reload
+def _apply_settings(changed):
+    if "JSON_CODEC" in changed:
+        use(settings.JSON_CODEC)
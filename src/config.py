@@ -1,20 +1,278 @@
+"""
+Settings, read from the environment with .env on top (.env takes precedence).
+
+Everything lives on the settings object and is read where it is used, so reload()
+applies changes without restarting workers. Workers reload on their own when .env or
+CONFIG_RELOAD_FILE changes (POST /api/config/reload touches the latter). Components
+that build state from settings (the router, API keys, connection pools) rebuild it in
+an on_reload() hook.
+"""
+import logging
 import os
-from dotenv import load_dotenv
+import threading
+import time
+
+from dotenv import dotenv_values, find_dotenv
+
+logger = logging.getLogger(__name__)
+
+
+def environ():
+    """The process environment overlaid with .env, without modifying os.environ."""
+    env = dict(os.environ)
+    path = find_dotenv()
+    if path:
+        env.update((key, value) for key, value in dotenv_values(path).items() if value is not None)
+    return env
+
+
+class Settings:
+    def __init__(self, env=None):
+        self.load(env)
+
+    def get(self, name, default=None):
+        """A raw variable, for settings that name another variable (api_key_env, key_env)."""
+        return self.env.get(name, default)
+
+    def as_dict(self):
+        """The settings as a mapping, e.g. for Flask's app.config."""
+        return {name: value for name, value in vars(self).items() if name.isupper()}
+
+    def load(self, env=None):
+        """(Re)read every setting from env, by default environ()."""
+        env = environ() if env is None else env
+        self.env = env
+
+        # Generate a secret key with: python -c 'import secrets; print(secrets.token_hex(16))'
+        self.SECRET_KEY = env.get("SECRET_KEY", "default-secret-key-for-development")
+
+        # Token for web UI access
+        self.ACCESS_TOKEN = env.get("ACCESS_TOKEN")
+
+        # OpenAI/Target API Config
+        self.OPENAI_API_KEY = env.get("OPENAI_API_KEY")
+        self.TARGET_API_KEY = env.get("TARGET_API_KEY")
+        self.TARGET_API_BASE_URL = env.get("TARGET_API_BASE_URL")
+
+        # Bearer token for securing API endpoints
+        self.BEARER_TOKEN = env.get("BEARER_TOKEN")
+
+        # Upstream HTTP connection pool
+        # Default number of keep-alive connections kept per upstream host.
+        self.UPSTREAM_POOL_MAXSIZE = int(env.get("UPSTREAM_POOL_MAXSIZE", "20"))
+        # Per-host overrides, e.g. "https://api.groq.com=64,https://api.openai.com=8"
+        self.UPSTREAM_POOL_SIZES = env.get("UPSTREAM_POOL_SIZES", "")
+        self.UPSTREAM_CONNECT_TIMEOUT = float(env.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+        self.UPSTREAM_READ_TIMEOUT = float(env.get("UPSTREAM_READ_TIMEOUT", "120"))
+        # Proxied completion streams are cut off after this many seconds; 0 means no limit.
+        self.STREAM_MAX_SECONDS = float(env.get("STREAM_MAX_SECONDS", "600"))
+        # Output to clients (src/output.py). Streamed events arriving within the window are joined
+        # into one write of up to STREAM_COALESCE_BYTES (ASGI only; 0 sends every event at once).
+        self.STREAM_COALESCE_WINDOW = float(env.get("STREAM_COALESCE_WINDOW", "0"))
+        self.STREAM_COALESCE_BYTES = int(env.get("STREAM_COALESCE_BYTES", "16384"))
+        # Content-encodings offered to clients, in order of preference, e.g. "br,gzip"; "" disables.
+        self.RESPONSE_COMPRESSION = env.get("RESPONSE_COMPRESSION", "")
+        # JSON bodies smaller than this are sent uncompressed; streams are always compressed.
+        self.RESPONSE_COMPRESSION_MIN_BYTES = int(env.get("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+        # Retries only apply to connection errors, where the request was never sent.
+        self.UPSTREAM_CONNECT_RETRIES = int(env.get("UPSTREAM_CONNECT_RETRIES", "3"))
+        self.UPSTREAM_RETRY_BACKOFF = float(env.get("UPSTREAM_RETRY_BACKOFF", "0.2"))
+        # Connection cap for the async (ASGI) upstream client; each open stream holds one.
+        self.ASYNC_UPSTREAM_MAX_CONNECTIONS = int(env.get("ASYNC_UPSTREAM_MAX_CONNECTIONS", "2000"))
+
+        # Chat log pipeline (logs/chat_logs.txt)
+        self.CHAT_LOG_QUEUE_SIZE = int(env.get("CHAT_LOG_QUEUE_SIZE", "10000"))
+        # "drop" never waits on a full queue; "block" waits up to CHAT_LOG_BLOCK_TIMEOUT seconds, then drops.
+        self.CHAT_LOG_QUEUE_POLICY = env.get("CHAT_LOG_QUEUE_POLICY", "drop")
+        self.CHAT_LOG_BLOCK_TIMEOUT = float(env.get("CHAT_LOG_BLOCK_TIMEOUT", "0.05"))
+        self.CHAT_LOG_BATCH_SIZE = int(env.get("CHAT_LOG_BATCH_SIZE", "256"))
+        self.CHAT_LOG_FLUSH_INTERVAL = float(env.get("CHAT_LOG_FLUSH_INTERVAL", "0.5"))
+        # Rotation: by size in bytes and/or by time period in seconds (0 disables either).
+        self.CHAT_LOG_MAX_BYTES = int(env.get("CHAT_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.CHAT_LOG_ROTATE_SECONDS = int(env.get("CHAT_LOG_ROTATE_SECONDS", "0"))
+        self.CHAT_LOG_COMPRESS = env.get("CHAT_LOG_COMPRESS", "true").lower() in ("1", "true", "yes")
+        self.CHAT_LOG_BACKUP_COUNT = int(env.get("CHAT_LOG_BACKUP_COUNT", "30"))
+        # Indexed chat log store backing /api/chat-logs
+        self.CHAT_LOG_DB = env.get("CHAT_LOG_DB", "logs/chat_logs.db")
+        # Content-addressed store for large repeated request parts (system prompts, tools); "" disables it.
+        self.CHAT_LOG_BLOB_DIR = env.get("CHAT_LOG_BLOB_DIR", "logs/blobs")
+        self.CHAT_LOG_BLOB_MIN_BYTES = int(env.get("CHAT_LOG_BLOB_MIN_BYTES", "1024"))
+
+        # Server-side /chat conversations
+        self.CHAT_SESSION_DB = env.get("CHAT_SESSION_DB", "logs/chat_sessions.db")
+        # Conversations idle this long, or beyond the newest CHAT_SESSION_MAX, are evicted.
+        self.CHAT_SESSION_TTL = int(env.get("CHAT_SESSION_TTL", str(7 * 24 * 3600)))
+        self.CHAT_SESSION_MAX = int(env.get("CHAT_SESSION_MAX", "10000"))
+        # Estimated tokens of history sent with each turn; the oldest turns are dropped beyond it.
+        # Keep it below the model's context window minus room for the reply.
+        self.CHAT_CONTEXT_TOKENS = int(env.get("CHAT_CONTEXT_TOKENS", "12000"))
+
+        # Live /logs stream (server-sent events)
+        self.LOG_STREAM_POLL_INTERVAL = float(env.get("LOG_STREAM_POLL_INTERVAL", "1.0"))
+        # Streams end after this long; EventSource reconnects and resumes from Last-Event-ID.
+        self.LOG_STREAM_MAX_SECONDS = float(env.get("LOG_STREAM_MAX_SECONDS", "300"))
+
+        # /openai/v1/models cache
+        self.MODELS_CACHE_TTL = float(env.get("MODELS_CACHE_TTL", "300"))
+        # After the TTL, the stale list is served for this long while it refreshes in the background.
+        self.MODELS_CACHE_STALE_TTL = float(env.get("MODELS_CACHE_STALE_TTL", "3600"))
+        # Also list the models of TARGET_API_BASE_URL (override per request with ?merged=true|false).
+        self.MODELS_MERGED = env.get("MODELS_MERGED", "false").lower() in ("1", "true", "yes")
+
+        # Exact-match cache for non-streaming chat completions (opt-in)
+        self.COMPLETION_CACHE_ENABLED = env.get("COMPLETION_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.COMPLETION_CACHE_MAX_BYTES = int(env.get("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        # Optional on-disk tier shared by all workers; empty disables it.
+        self.COMPLETION_CACHE_DIR = env.get("COMPLETION_CACHE_DIR", "")
+        # Entry lifetime in seconds; 0 keeps entries until evicted.
+        self.COMPLETION_CACHE_TTL = float(env.get("COMPLETION_CACHE_TTL", "0"))
+
+        # Upstream routing
+        # JSON list of upstreams; defaults to a single upstream built from TARGET_API_BASE_URL/TARGET_API_KEY.
+        # e.g. [{"name": "groq", "base_url": "https://api.groq.com/openai/v1", "api_key": "...",
+        #        "models": ["deepseek-r1-distill-llama-70b"], "model_map": {}, "weight": 1}]
+        self.UPSTREAMS = env.get("UPSTREAMS", "")
+        # JSON map of requested model -> upstream model; "*" matches any model.
+        self.MODEL_ALIASES = env.get("MODEL_ALIASES", '{"*": "deepseek-r1-distill-llama-70b"}')
+        # JSON response transforms for every upstream (see src/transforms.py), e.g. {"extract_reasoning": true};
+        # an UPSTREAMS entry's own "transforms" override them key by key.
+        self.RESPONSE_TRANSFORMS = env.get("RESPONSE_TRANSFORMS", "")
+        # "least_outstanding" or "latency"
+        self.ROUTING_STRATEGY = env.get("ROUTING_STRATEGY", "least_outstanding")
+        # Consecutive failures that open an upstream's circuit, and how long it stays open.
+        self.CIRCUIT_FAILURE_THRESHOLD = int(env.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+        self.CIRCUIT_COOLDOWN = float(env.get("CIRCUIT_COOLDOWN", "30"))
+        # Concurrent dispatcher requests per upstream unless its UPSTREAMS entry sets "max_concurrency"; 0 is unlimited.
+        self.UPSTREAM_MAX_CONCURRENCY = int(env.get("UPSTREAM_MAX_CONCURRENCY", "8"))
+
+        # Hedged stream opens: if the chosen upstream hasn't sent its first byte after its
+        # HEDGE_PERCENTILE TTFT (at least HEDGE_MIN_DELAY seconds), the request is sent again
+        # to the next candidate (or the same upstream) and the first to answer wins.
+        self.HEDGE_ENABLED = env.get("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+        self.HEDGE_PERCENTILE = float(env.get("HEDGE_PERCENTILE", "95"))
+        self.HEDGE_MIN_DELAY = float(env.get("HEDGE_MIN_DELAY", "0.05"))
+        # TTFT samples an upstream needs before its streams are hedged.
+        self.HEDGE_MIN_SAMPLES = int(env.get("HEDGE_MIN_SAMPLES", "20"))
+        # Extra upstream requests hedging may add, as a fraction of streams opened.
+        self.HEDGE_BUDGET = float(env.get("HEDGE_BUDGET", "0.05"))
+
+        # Dispatcher for non-streaming completions
+        # Run every non-streaming chat completion through the dispatcher, not just bulk requests.
+        self.DISPATCHER_ENABLED = env.get("DISPATCHER_ENABLED", "false").lower() in ("1", "true", "yes")
+        # Threads per worker process; keep at or below UPSTREAM_POOL_MAXSIZE so connections are reused.
+        self.DISPATCHER_WORKERS = int(env.get("DISPATCHER_WORKERS", "16"))
+        # Most request lines accepted by one bulk request.
+        self.BULK_MAX_REQUESTS = int(env.get("BULK_MAX_REQUESTS", "5000"))
+
+        # Metrics
+        # Directory for per-process metric snapshots merged by /metrics; "" reports only the scraped worker.
+        self.METRICS_DIR = env.get("METRICS_DIR", "logs/metrics")
+        self.METRICS_FLUSH_INTERVAL = float(env.get("METRICS_FLUSH_INTERVAL", "2"))
+
+        # Request bodies
+        # Larger request bodies are rejected with 413 before they are read.
+        self.MAX_BODY_BYTES = int(env.get("MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+        # Picked up by Flask, which then enforces the limit on every route (including chunked uploads).
+        self.MAX_CONTENT_LENGTH = self.MAX_BODY_BYTES
+
+        # JSON backend: "auto" (orjson, else msgspec, else the standard library), "orjson", "msgspec" or "json".
+        self.JSON_CODEC = env.get("JSON_CODEC", "auto")
+
+        # API keys and admission control
+        # JSON list of API keys, each with optional limits (0 means unlimited); BEARER_TOKEN stays valid as key "default".
+        # e.g. [{"name": "ci", "key": "...", "max_concurrent": 4, "rpm": 60, "tpm": 200000}] ("key_env" reads the key from a variable)
+        self.API_KEYS = env.get("API_KEYS", "")
+        # Limits for keys that don't set their own, including BEARER_TOKEN.
+        self.API_KEY_MAX_CONCURRENT = int(env.get("API_KEY_MAX_CONCURRENT", "0"))
+        self.API_KEY_RPM = float(env.get("API_KEY_RPM", "0"))
+        self.API_KEY_TPM = float(env.get("API_KEY_TPM", "0"))
+        # Longest a request queues for its key before it is rejected with 429.
+        self.ADMISSION_MAX_WAIT = float(env.get("ADMISSION_MAX_WAIT", "10"))
+        # Quota state shared by all workers on this host.
+        self.QUOTA_FILE = env.get("QUOTA_FILE", "logs/quota.bin")
+
+        # Config reload
+        # Touched by POST /api/config/reload; every worker reloads when it (or .env) changes.
+        self.CONFIG_RELOAD_FILE = env.get("CONFIG_RELOAD_FILE", "logs/config-reload")
+        # How often workers check for those changes, in seconds; 0 turns the watcher off.
+        self.CONFIG_WATCH_INTERVAL = float(env.get("CONFIG_WATCH_INTERVAL", "5"))
+
+
+settings = Settings()
+
+_hooks = []
+_reload_lock = threading.Lock()
+_watcher_pid = None
+
+
+def on_reload(hook):
+    """Register hook(changed setting names) to run after a reload that changed something."""
+    _hooks.append(hook)
+    return hook
+
+
+def reload():
+    """Re-read settings in this process and run the reload hooks; returns the changed names."""
+    with _reload_lock:
+        # Raw variables count too: API_KEYS and UPSTREAMS can point at other variables.
+        before, before_env = settings.as_dict(), settings.env
+        settings.load()
+        after, after_env = settings.as_dict(), settings.env
+        changed = {name for name in before.keys() | after.keys() if before.get(name) != after.get(name)}
+        changed |= {name for name in before_env.keys() | after_env.keys() if before_env.get(name) != after_env.get(name)}
+        for hook in _hooks if changed else ():
+            try:
+                hook(changed)
+            except Exception:
+                logger.exception(f"Config reload hook {hook.__qualname__} failed")
+    if changed:
+        logger.info(f"Config reloaded, changed: {', '.join(sorted(changed))}")
+    return changed
+
+
+def request_reload():
+    """Reload this process now and signal every other worker through CONFIG_RELOAD_FILE."""
+    path = settings.CONFIG_RELOAD_FILE
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a"):
+            os.utime(path)
+    return reload()
+
+
+def _mtimes():
+    mtimes = []
+    for path in (find_dotenv(), settings.CONFIG_RELOAD_FILE):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns if path else None)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def _watch():
+    seen = _mtimes()
+    while settings.CONFIG_WATCH_INTERVAL > 0:
+        time.sleep(settings.CONFIG_WATCH_INTERVAL)
+        current = _mtimes()
+        if current != seen:
+            seen = current
+            reload()
+
 
-# By using override=True, variables from the .env file will take precedence
-# over system environment variables.
-load_dotenv(override=True)
+def _reset_after_fork():
+    # The parent's watcher may have held the lock at fork time; the child starts its own watcher.
+    global _reload_lock
+    _reload_lock = threading.Lock()
 
-# Generate a secret key with: python -c 'import secrets; print(secrets.token_hex(16))'
-SECRET_KEY = os.getenv("SECRET_KEY", "default-secret-key-for-development")
 
-# Token for web UI access
-ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
-# OpenAI/Target API Config
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-TARGET_API_KEY = os.getenv("TARGET_API_KEY")
-TARGET_API_BASE_URL = os.getenv("TARGET_API_BASE_URL")
 
-# Bearer token for securing API endpoints
-BEARER_TOKEN = os.getenv("BEARER_TOKEN")
\ No newline at end of file
+def start_watcher():
+    """Start this process's reload watcher once; forked workers start their own on first call."""
+    global _watcher_pid
+    if settings.CONFIG_WATCH_INTERVAL > 0 and _watcher_pid != os.getpid():
+        _watcher_pid = os.getpid()
+        threading.Thread(target=_watch, name="config-watch", daemon=True).start()
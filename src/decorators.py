@@ -1,31 +1,40 @@
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify, g, current_app
 
-from src.config import BEARER_TOKEN
+from src.admission import admission
 
 
-def bearer_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # The app context is now guaranteed to be available here
-        expected_token = BEARER_TOKEN
+def authenticate_bearer(auth_header):
+    """
+    Validate an Authorization header against the configured API keys (API_KEYS and BEARER_TOKEN).
+    Returns (ApiKey, None) when the token is valid, otherwise (None, (error body, status code)).
+    """
+    if not admission.keys:
+        # This error will now correctly report if the server config is missing
+        return None, ({"error": "BEARER_TOKEN is not configured on the server."}, 500)
+
+    if not auth_header:
+        return None, ({"error": "Authorization header is missing"}, 401)
 
-        if not expected_token:
-            # This error will now correctly report if the server config is missing
-            return jsonify({"error": "BEARER_TOKEN is not configured on the server."}), 500
+    parts = auth_header.split()
+    if parts[0].lower() != 'bearer' or len(parts) != 2:
+        return None, ({"error": "Authorization header must be in 'Bearer <token>' format"}, 401)
 
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return jsonify({"error": "Authorization header is missing"}), 401
+    api_key = admission.authenticate(parts[1])
+    if api_key is None:
+        return None, ({"error": "Invalid or expired token"}, 403)
 
-        parts = auth_header.split()
-        if parts[0].lower() != 'bearer' or len(parts) != 2:
-            return jsonify({"error": "Authorization header must be in 'Bearer <token>' format"}), 401
-        
-        token = parts[1]
+    return api_key, None
 
-        if token != expected_token:
-            return jsonify({"error": "Invalid or expired token"}), 403
 
+def bearer_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        api_key, error = authenticate_bearer(request.headers.get('Authorization'))
+        if error:
+            body, status = error
+            return jsonify(body), status
+
+        g.api_key = api_key
         return f(*args, **kwargs)
-    return decorated_function 
\ No newline at end of file
+    return decorated_function
@@ -0,0 +1,123 @@
+"""
+Targeted patches to top-level fields of a JSON object without re-serializing it.
+
+Request bodies from agent clients run to hundreds of kilobytes, almost all of it in
+"messages". To forward one with a different "model" or "stream", the top-level members
+are located by jumping between structural characters, skipping each string with a
+find() for its closing quote, and only the patched values are spliced. Anything
+unusual (duplicate keys, malformed input) falls back to a json round trip.
+"""
+import json
+import re
+
+_TOKEN = re.compile(rb'["{}\[\],]')
+_COLON = re.compile(rb"\s*:\s*")
+_WHITESPACE = b" \t\r\n"
+
+
+def _skip_back(body, index):
+    """Index just past the last non-whitespace byte before index (no slice copies)."""
+    while index > 0 and body[index - 1] in _WHITESPACE:
+        index -= 1
+    return index
+
+
+def _string_end(body, start):
+    """Index just past the string starting at start: memchr to each quote, then check escapes."""
+    pos = start + 1
+    while True:
+        end = body.find(b'"', pos)
+        if end < 0:
+            raise ValueError("unterminated string")
+        backslashes = 0
+        while body[end - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end + 1
+        pos = end + 1
+
+
+def top_level_members(body):
+    """
+    Return {key: (value_start, value_end)} for the members of the JSON object in body.
+    Raises ValueError if body is not a well-formed object or has duplicate top-level keys.
+    """
+    start = 0
+    while start < len(body) and body[start] in _WHITESPACE:
+        start += 1
+    if body[start:start + 1] != b"{":
+        raise ValueError("not a JSON object")
+    members = {}
+    depth = 0
+    current = None
+    pos = start
+    while True:
+        match = _TOKEN.search(body, pos)
+        if match is None:
+            raise ValueError("unterminated JSON object")
+        index = match.start()
+        char = body[index]
+        if char == 0x22:  # '"'
+            pos = _string_end(body, index)
+            if depth == 1 and current is None:
+                colon = _COLON.match(body, pos)
+                if colon is None:
+                    raise ValueError("expected ':' after key")
+                key = json.loads(body[index:pos])
+                if key in members:
+                    raise ValueError(f"duplicate key {key!r}")
+                current = (key, colon.end())
+                pos = colon.end()
+            continue
+        pos = index + 1
+        if char in b"{[":
+            depth += 1
+        elif char in b"}]":
+            depth -= 1
+            if depth == 0:
+                if current is not None:
+                    members[current[0]] = (current[1], _skip_back(body, index))
+                if body[pos:].strip():
+                    raise ValueError("trailing data after JSON object")
+                return members
+        elif depth == 1:  # ','
+            if current is None:
+                raise ValueError("unexpected ','")
+            members[current[0]] = (current[1], _skip_back(body, index))
+            current = None
+
+
+def patch_fields(body, fields):
+    """
+    Return body with each top-level key in fields set to the given value, inserting keys
+    that are absent. The rest of the document is passed through byte for byte.
+    """
+    try:
+        members = top_level_members(body)
+    except ValueError:
+        obj = json.loads(body)
+        obj.update(fields)
+        return json.dumps(obj).encode("utf-8")
+
+    edits = []
+    missing = []
+    for key, value in fields.items():
+        encoded = json.dumps(value).encode("utf-8")
+        if key in members:
+            value_start, value_end = members[key]
+            edits.append((value_start, value_end, encoded))
+        else:
+            missing.append(json.dumps(key).encode("utf-8") + b":" + encoded)
+    if missing:
+        close = body.rindex(b"}")
+        separator = b"," if members else b""
+        edits.append((close, close, separator + b",".join(missing)))
+
+    parts = []
+    pos = 0
+    for value_start, value_end, replacement in sorted(edits):
+        parts.append(body[pos:value_start])
+        parts.append(replacement)
+        pos = value_end
+    parts.append(body[pos:])
+    return b"".join(parts)
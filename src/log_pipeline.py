@@ -0,0 +1,276 @@
+"""
+Non-blocking chat log pipeline.
+
+Request threads only enqueue LogRecords; a background thread per process formats them,
+batches them and hands each batch to its sinks: the text log, which is appended with a
+single write per batch, and the indexed store in src/chat_store.py. Writers in different
+gunicorn workers coordinate rotation through an flock()ed sidecar lock file.
+"""
+import atexit
+import fcntl
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+from src import codec
+
+
+class LazyJSON:
+    """Defers encoding a log argument as JSON until the record is formatted off the request path."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        # Shallow copy so later top-level mutations (e.g. payload["model"]) don't leak into the log.
+        self.obj = dict(obj) if isinstance(obj, dict) else obj
+
+    def __str__(self):
+        return codec.dumps(self.obj).decode("utf-8")
+
+    def deduped(self, blobs):
+        """A LazyJSON whose large repeated parts are replaced by references into blobs."""
+        return LazyJSON(blobs.dedupe(self.obj))
+
+
+class RotatingFileSink:
+    """
+    Appends batches to a log file shared by several processes, rotating by size and/or
+    time period and optionally gzip-compressing rotated files.
+    """
+
+    def __init__(self, path, max_bytes=0, rotate_seconds=0, compress=False, backup_count=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.backup_count = backup_count
+        self.rotations = 0
+        self._fd = None
+        self._lock_fd = None
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _should_rotate(self, st, now):
+        if st.st_size == 0:
+            return False
+        if self.max_bytes and st.st_size >= self.max_bytes:
+            return True
+        if self.rotate_seconds and int(st.st_mtime // self.rotate_seconds) != int(now // self.rotate_seconds):
+            return True
+        return False
+
+    def write(self, data):
+        """Append one batch of bytes, rotating first if needed. Returns the rotated file path, if any."""
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        rotated = None
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            # Another worker may have rotated the file since we opened it.
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                st = None
+            if self._fd is None or st is None or os.fstat(self._fd).st_ino != st.st_ino:
+                self._open()
+                st = os.fstat(self._fd)
+            now = time.time()
+            if self._should_rotate(st, now):
+                stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{now % 1:.6f}"[1:]
+                rotated = f"{self.path}.{stamp}.{os.getpid()}"
+                os.rename(self.path, rotated)
+                self._open()
+            os.write(self._fd, data)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        if rotated:
+            self._finish_rotation(rotated)
+        return rotated
+
+    def write_batch(self, records, format):
+        lines = "\n".join(format(record) for record in records) + "\n"
+        if self.write(lines.encode("utf-8")):
+            self.rotations += 1
+
+    def _finish_rotation(self, rotated):
+        # Nobody writes to the renamed file any more, so this runs outside the lock.
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        if self.backup_count:
+            directory, base = os.path.split(self.path)
+            prefix = base + "."
+            backups = sorted(
+                name for name in os.listdir(directory or ".")
+                if name.startswith(prefix) and name != base + ".lock"
+            )
+            for name in backups[:-self.backup_count]:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        for fd in (self._fd, self._lock_fd):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._lock_fd = None
+
+
+class BatchingQueueHandler(logging.Handler):
+    """
+    Logging handler with a bounded queue and a background batch writer that hands each
+    batch to every sink's write_batch(records, format).
+
+    policy="drop" never waits when the queue is full; policy="block" waits up to
+    block_timeout seconds and then drops. Dropped records are counted in stats().
+    With a blob store, LazyJSON arguments are deduplicated into it before rendering.
+    """
+
+    def __init__(self, sinks, maxsize=10000, policy="drop", block_timeout=0.05,
+                 batch_size=256, flush_interval=0.5, blobs=None):
+        super().__init__()
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.sinks = list(sinks)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.blobs = blobs
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
+
+    def _reset(self):
+        # Called at init and in forked children: the parent's thread does not survive fork.
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "write_errors": 0,
+            "enqueue_seconds_total": 0.0,
+            "enqueue_seconds_max": 0.0,
+        }
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+                    self._thread.start()
+
+    def emit(self, record):
+        start = time.perf_counter()
+        self._ensure_thread()
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+            key = "enqueued"
+        except queue.Full:
+            key = "dropped"
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            stats = self._stats
+            stats[key] += 1
+            stats["enqueue_seconds_total"] += elapsed
+            if elapsed > stats["enqueue_seconds_max"]:
+                stats["enqueue_seconds_max"] = elapsed
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                batch.append(record)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        records = []
+        for record in batch:
+            try:
+                if self.blobs is not None and isinstance(record.args, tuple):
+                    record.args = tuple(
+                        arg.deduped(self.blobs) if isinstance(arg, LazyJSON) else arg for arg in record.args
+                    )
+                # Render the message once; every sink reuses it.
+                record.msg = record.getMessage()
+                record.args = None
+                records.append(record)
+            except Exception:
+                self.handleError(record)
+        if not records:
+            return
+        failed = 0
+        for sink in self.sinks:
+            try:
+                sink.write_batch(records, self.format)
+            except Exception:
+                failed += 1
+                # Reported like any handler failure (stderr unless logging.raiseExceptions is off).
+                self.handleError(records[0])
+        with self._stats_lock:
+            self._stats["write_errors"] += failed
+            # Written means stored by every sink; a batch any sink lost is only counted in write_errors.
+            if not failed:
+                self._stats["written"] += len(records)
+            self._stats["batches"] += 1
+
+    def stats(self):
+        """Counters for this process, including request-path enqueue latency."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        calls = stats["enqueued"] + stats["dropped"]
+        stats["enqueue_seconds_mean"] = stats["enqueue_seconds_total"] / calls if calls else 0.0
+        stats["rotations"] = sum(getattr(sink, "rotations", 0) for sink in self.sinks)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_maxsize"] = self.maxsize
+        if self.blobs is not None:
+            stats["blobs"] = dict(self.blobs.stats)
+        stats["policy"] = self.policy
+        stats["pid"] = os.getpid()
+        return stats
+
+    def close(self):
+        """Drain the queue and stop the writer thread."""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout=5)
+        self._thread = None
+        for sink in self.sinks:
+            sink.close()
+        super().close()
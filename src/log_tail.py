@@ -0,0 +1,103 @@
+"""Reverse-seek tail and offset-based follow for the application log shown on /logs."""
+import os
+import time
+
+_BLOCK_SIZE = 8192
+# Upper bound on bytes returned by a single read_new_lines() call.
+_MAX_READ = 1024 * 1024
+# Seconds between keep-alive comments while no lines arrive.
+KEEPALIVE_SECONDS = 15.0
+
+
+def tail_lines(path, num_lines=200, block_size=_BLOCK_SIZE):
+    """
+    Return (lines, offset): the last num_lines lines of path, read backwards in blocks
+    so only the end of the file is touched, and the byte offset of the end of file.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        blocks = []
+        newlines = 0
+        # One extra newline so the first returned line is complete.
+        while pos > 0 and newlines <= num_lines:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            block = f.read(size)
+            blocks.append(block)
+            newlines += block.count(b"\n")
+    data = b"".join(reversed(blocks))
+    lines = data.decode("utf-8", errors="replace").splitlines(keepends=True)
+    return lines[-num_lines:], end
+
+
+def read_new_lines(path, offset):
+    """
+    Return (lines, offset) for complete lines appended since offset. If the file shrank
+    (truncated or rotated), reading restarts from the beginning.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return [], 0
+    if size < offset:
+        offset = 0
+    if size == offset:
+        return [], offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(min(size - offset, _MAX_READ))
+    end = data.rfind(b"\n")
+    if end < 0:
+        if len(data) < _MAX_READ:
+            return [], offset
+        # A single oversized line: emit it in pieces rather than stalling.
+        end = len(data) - 1
+    data = data[:end + 1]
+    return data.decode("utf-8", errors="replace").splitlines(keepends=True), offset + len(data)
+
+
+def start_offset(path, resume=None):
+    """
+    Offset to follow from: the client's Last-Event-ID/offset if given, else the current end
+    of file. A malformed resume value is treated as absent.
+    """
+    if resume not in (None, ""):
+        try:
+            return max(int(resume), 0)
+        except ValueError:
+            pass
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def sse_event(lines, offset):
+    """Encode new lines as one SSE event whose id is the resume offset."""
+    payload = "".join("data: " + line.rstrip().replace("\r", "") + "\n" for line in lines)
+    return f"id: {offset}\n{payload}\n".encode("utf-8")
+
+
+def follow(path, offset, max_seconds, poll_interval, keepalive=KEEPALIVE_SECONDS):
+    """
+    The SSE stream of lines appended to path after offset, for up to max_seconds. Shared by
+    the sync and async routes: it yields the bytes to send, or None when the caller should
+    wait poll_interval seconds (time.sleep or asyncio.sleep) before resuming it.
+    """
+    yield b"retry: 2000\n\n"
+    deadline = time.monotonic() + max_seconds
+    idle = 0.0
+    while time.monotonic() < deadline:
+        lines, offset = read_new_lines(path, offset)
+        if lines:
+            idle = 0.0
+            yield sse_event(lines, offset)
+            continue
+        if idle >= keepalive:
+            # Comment line: keeps proxies from timing out and surfaces client disconnects.
+            idle = 0.0
+            yield b": keep-alive\n\n"
+        yield None
+        idle += poll_interval
@@ -0,0 +1,489 @@
+"""
+Low-overhead in-process metrics with Prometheus text exposition.
+
+Recording a sample is a lock, a dict lookup and an add (plus a bisect for histograms).
+Each process periodically writes a snapshot to METRICS_DIR/<pid>-<start>.json; /metrics
+merges the snapshots of all gunicorn workers. Counters and histograms from exited workers
+are folded into METRICS_DIR/accumulated.json, so totals stay monotonic without a file per
+dead worker; gauges only count live processes. The start time in the name keeps a worker
+that reuses a dead one's pid from overwriting its snapshot. gunicorn.conf.py clears
+METRICS_DIR when the server starts (see clear()) and starts each worker's flusher
+(start_flusher()); importing this module starts no thread and writes nothing.
+
+Modules with their own stats (connection pool, caches, log pipeline) register collector
+callbacks that are sampled into each snapshot.
+"""
+import bisect
+import fcntl
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+from src.config import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_ACCUMULATED = "accumulated.json"
+_LOCK = ".lock"
+
+_metrics = []
+_collectors = []
+# Start of this process (or fork), naming its snapshot file.
+_started = time.time()
+# Process running the flusher thread, if any; see start_flusher().
+_flusher_pid = None
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames), "samples": samples}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts with a final +Inf slot, then sum.
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self):
+        result = super().snapshot()
+        result["buckets"] = list(self.buckets)
+        return result
+
+
+def register_collector(collect):
+    """
+    Register collect() -> iterable of (name, type, help, labels dict, value), sampled into
+    every snapshot. Use it for stats a module already keeps rather than duplicating them.
+    """
+    _collectors.append(collect)
+
+
+# Request path
+HTTP_REQUESTS = Counter("bridgeai_http_requests_total", "Handled requests.", ("endpoint", "status"))
+HTTP_DURATION = Histogram("bridgeai_http_request_duration_seconds",
+                          "Time until the handler returned (streams: until headers).", ("endpoint",))
+HTTP_INFLIGHT = Gauge("bridgeai_http_inflight_requests", "Requests currently in a handler.", ("endpoint",))
+ERRORS = Counter("bridgeai_errors_total", "Errors by endpoint and exception type.", ("endpoint", "kind"))
+
+# Streams relayed to clients
+STREAMS_OPEN = Gauge("bridgeai_streams_open", "Streams currently being relayed.", ("endpoint",))
+STREAM_TTFT = Histogram("bridgeai_stream_ttft_seconds", "Time from request to the first chunk sent.", ("endpoint",))
+STREAM_DURATION = Histogram("bridgeai_stream_duration_seconds", "Total stream duration.", ("endpoint",))
+STREAM_CHUNKS = Counter("bridgeai_stream_chunks_total", "Chunks relayed.", ("endpoint",))
+STREAM_BYTES = Counter("bridgeai_stream_bytes_total", "Bytes relayed.", ("endpoint",))
+
+# Upstream calls
+UPSTREAM_CONNECT = Histogram("bridgeai_upstream_connect_seconds", "New upstream connection setup time.", ("host",))
+UPSTREAM_TTFT = Histogram("bridgeai_upstream_ttft_seconds", "Upstream time to first body byte.", ("upstream",))
+UPSTREAM_DURATION = Histogram("bridgeai_upstream_request_duration_seconds",
+                              "Upstream request duration, including streaming.", ("upstream",))
+UPSTREAM_FAILURES = Counter("bridgeai_upstream_failures_total", "Failed upstream attempts.", ("upstream",))
+HEDGES = Counter("bridgeai_hedge_streams_total", "Streams opened with hedging on, by outcome.", ("outcome",))
+SERVICE_CALLS = Histogram("bridgeai_service_call_seconds", "openai_service call latency.", ("call",))
+SERVICE_ERRORS = Counter("bridgeai_service_call_errors_total", "openai_service call failures.", ("call",))
+TOKENS = Counter("bridgeai_tokens_total", "Tokens reported by upstream usage.", ("kind",))
+
+
+def _status_of(result):
+    if isinstance(result, tuple):
+        return result[1] if len(result) > 1 and isinstance(result[1], int) else 200
+    return getattr(result, "status_code", 200)
+
+
+def instrumented(endpoint):
+    """View decorator: in-flight gauge, duration histogram and status/error counters."""
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                HTTP_INFLIGHT.inc(endpoint)
+                status = 500
+                try:
+                    result = await view(*args, **kwargs)
+                    status = _status_of(result)
+                    return result
+                except Exception as e:
+                    ERRORS.inc(endpoint, type(e).__name__)
+                    raise
+                finally:
+                    HTTP_INFLIGHT.dec(endpoint)
+                    HTTP_DURATION.observe(time.perf_counter() - started, endpoint)
+                    HTTP_REQUESTS.inc(endpoint, str(status))
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            HTTP_INFLIGHT.inc(endpoint)
+            status = 500
+            try:
+                result = view(*args, **kwargs)
+                status = _status_of(result)
+                return result
+            except Exception as e:
+                ERRORS.inc(endpoint, type(e).__name__)
+                raise
+            finally:
+                HTTP_INFLIGHT.dec(endpoint)
+                HTTP_DURATION.observe(time.perf_counter() - started, endpoint)
+                HTTP_REQUESTS.inc(endpoint, str(status))
+        return wrapper
+    return decorator
+
+
+def timed_call(name):
+    """Decorator for service calls: latency histogram and error counter, sync or async."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    SERVICE_ERRORS.inc(name)
+                    raise
+                finally:
+                    SERVICE_CALLS.observe(time.perf_counter() - started, name)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                SERVICE_ERRORS.inc(name)
+                raise
+            finally:
+                SERVICE_CALLS.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
+
+
+def track_stream(endpoint, chunks, started=None):
+    """Relay chunks while recording open streams, TTFT, duration, chunk and byte counts."""
+    started = started or time.perf_counter()
+    first = True
+    count = size = 0
+    STREAMS_OPEN.inc(endpoint)
+    try:
+        for chunk in chunks:
+            if first:
+                STREAM_TTFT.observe(time.perf_counter() - started, endpoint)
+                first = False
+            count += 1
+            size += len(chunk)
+            yield chunk
+    finally:
+        STREAMS_OPEN.dec(endpoint)
+        STREAM_DURATION.observe(time.perf_counter() - started, endpoint)
+        STREAM_CHUNKS.inc(endpoint, amount=count)
+        STREAM_BYTES.inc(endpoint, amount=size)
+
+
+async def atrack_stream(endpoint, chunks, started=None):
+    """Async variant of track_stream()."""
+    started = started or time.perf_counter()
+    first = True
+    count = size = 0
+    STREAMS_OPEN.inc(endpoint)
+    try:
+        async for chunk in chunks:
+            if first:
+                STREAM_TTFT.observe(time.perf_counter() - started, endpoint)
+                first = False
+            count += 1
+            size += len(chunk)
+            yield chunk
+    finally:
+        STREAMS_OPEN.dec(endpoint)
+        STREAM_DURATION.observe(time.perf_counter() - started, endpoint)
+        STREAM_CHUNKS.inc(endpoint, amount=count)
+        STREAM_BYTES.inc(endpoint, amount=size)
+
+
+def observe_usage(usage):
+    """Count tokens from an OpenAI-style usage object."""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            TOKENS.inc(kind.split("_")[0], amount=usage[kind])
+
+
+def httpx_trace(host):
+    """httpx "trace" request extension that records TCP (+TLS) connect time for host."""
+    marks = {}
+
+    async def trace(event, info):
+        if event == "connection.connect_tcp.started":
+            marks["started"] = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            marks["connected"] = time.perf_counter()
+        elif event.endswith("send_request_headers.started") and "connected" in marks:
+            # Only requests that opened a new connection get here with marks set.
+            UPSTREAM_CONNECT.observe(marks.pop("connected") - marks.pop("started"), host)
+    return trace
+
+
+def snapshot():
+    """This process's metrics plus collector samples, as written to METRICS_DIR."""
+    metrics = {metric.name: metric.snapshot() for metric in _metrics}
+    for collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception:
+            continue
+        for name, kind, help, labels, value in samples:
+            entry = metrics.setdefault(name, {"type": kind, "help": help, "labelnames": list(labels), "samples": []})
+            entry["samples"].append([[str(labels[label]) for label in entry["labelnames"]], value])
+    return {"pid": os.getpid(), "started": _started, "time": time.time(), "metrics": metrics}
+
+
+def _path(name):
+    return os.path.join(settings.METRICS_DIR, name)
+
+
+def _write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Write this process's snapshot to METRICS_DIR atomically."""
+    if not settings.METRICS_DIR:
+        return
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    _write(_path(f"{os.getpid()}-{int(_started * 1000)}.json"), snapshot())
+
+
+def clear():
+    """Remove the snapshots of a previous run from METRICS_DIR; call before workers start."""
+    if not settings.METRICS_DIR or not os.path.isdir(settings.METRICS_DIR):
+        return
+    for name in os.listdir(settings.METRICS_DIR):
+        if name.endswith((".json", ".json.tmp")) or name == _LOCK:
+            try:
+                os.remove(_path(name))
+            except FileNotFoundError:
+                pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _process_snapshots():
+    """{file name: snapshot} for the per-process files in METRICS_DIR."""
+    snapshots = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if name.endswith(".json") and name != _ACCUMULATED:
+            snap = _load(_path(name))
+            if snap is not None:
+                snapshots[name] = snap
+    return snapshots
+
+
+def _exited(snapshots):
+    """Names of the snapshots whose process has exited, or whose pid now belongs to a newer one."""
+    latest = {}
+    for name, snap in snapshots.items():
+        current = latest.get(snap["pid"])
+        if current is None or snap.get("started", 0) > snapshots[current].get("started", 0):
+            latest[snap["pid"]] = name
+    return [
+        name for name, snap in snapshots.items()
+        if latest[snap["pid"]] != name or snap["pid"] != os.getpid() and not _alive(snap["pid"])
+    ]
+
+
+def _fold(accumulated, snapshots):
+    """accumulated plus the counters and histograms of snapshots, in snapshot form."""
+    merged = _merge([(accumulated, False)] + [(snap, False) for snap in snapshots])
+    return {"metrics": {
+        name: dict(metric, samples=[[list(labels), value] for labels, value in metric["samples"].items()])
+        for name, metric in merged.items()
+    }}
+
+
+def _snapshots():
+    """(snapshot, alive) pairs: this process, the other workers and the accumulated exited ones."""
+    if not settings.METRICS_DIR:
+        return [(snapshot(), True)]
+    flush()
+    # One reader at a time, so an exited worker's snapshot is folded in exactly once.
+    with open(_path(_LOCK), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = _process_snapshots()
+        exited = _exited(snapshots)
+        accumulated = _load(_path(_ACCUMULATED)) or {"metrics": {}}
+        if exited:
+            accumulated = _fold(accumulated, [snapshots.pop(name) for name in exited])
+            _write(_path(_ACCUMULATED), accumulated)
+            for name in exited:
+                try:
+                    os.remove(_path(name))
+                except FileNotFoundError:
+                    pass
+    return [(snap, True) for snap in snapshots.values()] + [(accumulated, False)]
+
+
+def _merge(snapshots):
+    """Sum (snapshot, alive) pairs by metric and labels; gauges only from live processes."""
+    merged = {}
+    for snap, alive in snapshots:
+        for name, metric in snap["metrics"].items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            entry = merged.setdefault(name, dict(metric, samples={}))
+            samples = entry["samples"]
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["type"] == "histogram":
+                    current = samples.get(key)
+                    if current is None:
+                        samples[key] = [list(value[0]), value[1]]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                else:
+                    samples[key] = samples.get(key, 0) + value
+    return merged
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render():
+    """Prometheus text exposition (format 0.0.4) aggregated across workers."""
+    lines = []
+    for name, metric in sorted(_merge(_snapshots()).items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labelnames"]
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], value[0]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(names, labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, labels)} {value[1]}")
+                lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+            else:
+                lines.append(f"{name}{_labels(names, labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    """
+    Write this process's snapshot every METRICS_FLUSH_INTERVAL from now on. Called by
+    serving processes only (gunicorn's post_fork); once per process.
+    """
+    global _flusher_pid
+    if settings.METRICS_DIR and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def _reset_after_fork():
+    # Samples recorded before fork belong to the parent; its flusher thread did not survive.
+    global _started
+    _started = time.time()
+    for metric in _metrics:
+        metric._reset()
+    if _flusher_pid is not None:
+        start_flusher()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,297 @@
+"""
+Output stage for responses to clients: event coalescing and negotiated compression.
+
+Relayed streams produce one small "data: ..." event per upstream token, and written as-is
+each becomes its own write and, over the network, usually its own packet. acoalesce()
+joins the events that arrive within STREAM_COALESCE_WINDOW seconds into one write (at
+most STREAM_COALESCE_BYTES), on a timer so an event is never held longer than the window.
+Events are sent at once until the first one carrying a token, and whenever the stream has
+been idle for a window, so coalescing never delays the first token. It needs the event
+loop's timer, so only the ASGI routes coalesce; WSGI streams are written per event.
+
+RESPONSE_COMPRESSION lists the content-encodings offered ("br" needs the brotli package)
+in order of preference. Event streams and JSONL are compressed as they are written, each
+write flushed so the client can decode it straight away; JSON bodies are compressed when
+at least RESPONSE_COMPRESSION_MIN_BYTES long. CompressionMiddleware does this for the ASGI
+app, compress_response() for Flask responses.
+"""
+import asyncio
+import re
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from src.config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STREAMED_TYPES = ("text/event-stream", "application/jsonl")
+COMPRESSIBLE_TYPES = STREAMED_TYPES + ("application/json",)
+GZIP_LEVEL = 6
+# Brotli's higher qualities are too slow for compressing on the fly.
+BROTLI_QUALITY = 5
+
+# An event carrying (part of) the reply, as opposed to a role-only or empty first delta.
+_TOKEN = re.compile(rb'"(?:content|reasoning_content|arguments)"\s*:\s*"[^"]')
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding):
+    """The first RESPONSE_COMPRESSION encoding the Accept-Encoding header allows, or None."""
+    if not accept_encoding or not settings.RESPONSE_COMPRESSION:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in settings.RESPONSE_COMPRESSION.split(","):
+        encoding = encoding.strip()
+        if encoding in available_encodings() and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """data compressed in one go."""
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class StreamEncoder:
+    """Compresses a response written in pieces; each piece is flushed so it can be decoded on arrival."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def encode(self, data):
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _weak(etag):
+    # The compressed body is a different representation of the resource.
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+def encoded(chunks, encoder):
+    """Compress an iterable of response chunks; closing the result closes chunks."""
+    try:
+        for chunk in chunks:
+            data = encoder.encode(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response, accept_encoding):
+    """Flask after_request counterpart of CompressionMiddleware."""
+    if (
+        response.mimetype not in COMPRESSIBLE_TYPES
+        or "Content-Encoding" in response.headers
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+    ):
+        return response
+    if settings.RESPONSE_COMPRESSION:
+        response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = encoded(response.response, StreamEncoder(encoding))
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    if "ETag" in response.headers:
+        response.headers["ETag"] = _weak(response.headers["ETag"])
+    return response
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses for clients that accept it (see the module docstring)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RESPONSE_COMPRESSION:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        await self.app(scope, receive, _CompressingSend(send, encoding))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding):
+        self.send = send
+        self.encoding = encoding
+        self.start = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if self.passthrough:
+            await self.send(message)
+        elif message["type"] == "http.response.start":
+            self._on_start(message)
+            if self.passthrough:
+                await self.send(message)
+        elif message["type"] == "http.response.body":
+            await self._on_body(message)
+        else:
+            await self.send(message)
+
+    def _on_start(self, message):
+        headers = Headers(raw=message.get("headers", []))
+        media_type = headers.get("content-type", "").partition(";")[0].strip()
+        status = message["status"]
+        if (
+            media_type not in COMPRESSIBLE_TYPES
+            or "content-encoding" in headers
+            or status < 200
+            or status in (204, 304)
+        ):
+            self.passthrough = True
+            return
+        MutableHeaders(raw=message.setdefault("headers", [])).add_vary_header("Accept-Encoding")
+        if self.encoding is None:
+            self.passthrough = True
+            return
+        # Held until the first body message shows whether the response is streamed.
+        self.start = message
+
+    async def _on_body(self, message):
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+        if self.encoder is None:
+            headers = MutableHeaders(raw=self.start["headers"])
+            if not more:
+                # The whole body at once: only worth compressing if it's big enough.
+                if len(body) >= settings.RESPONSE_COMPRESSION_MIN_BYTES:
+                    body = compress(body, self.encoding)
+                    self._set_encoding(headers)
+                    headers["Content-Length"] = str(len(body))
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": body})
+                self.passthrough = True
+                return
+            self.encoder = StreamEncoder(self.encoding)
+            self._set_encoding(headers)
+            del headers["Content-Length"]
+            await self.send(self.start)
+        data = self.encoder.encode(body)
+        if not more:
+            data += self.encoder.finish()
+        if data or not more:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more})
+
+    def _set_encoding(self, headers):
+        headers["Content-Encoding"] = self.encoding
+        if "etag" in headers:
+            headers["ETag"] = _weak(headers["etag"])
+
+
+async def _next(chunks):
+    try:
+        return True, await chunks.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def acoalesce(chunks, window=None, max_bytes=None):
+    """
+    Join the events of an async stream into fewer, larger writes (see the module docstring).
+    window and max_bytes default to STREAM_COALESCE_WINDOW and STREAM_COALESCE_BYTES;
+    with no window the events are passed through one by one.
+    """
+    window = settings.STREAM_COALESCE_WINDOW if window is None else window
+    max_bytes = settings.STREAM_COALESCE_BYTES if max_bytes is None else max_bytes
+    if window <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    buffer = []
+    size = 0
+    deadline = None
+    last_flush = None
+    token_sent = False
+    pending = None
+    try:
+        while True:
+            if not buffer:
+                more, chunk = await (pending if pending is not None else _next(chunks))
+                pending = None
+            else:
+                # Wait for the next event only until the oldest buffered one is due.
+                if pending is None:
+                    pending = asyncio.ensure_future(_next(chunks))
+                timeout = deadline - loop.time()
+                if timeout > 0:
+                    await asyncio.wait((pending,), timeout=timeout)
+                if not pending.done():
+                    last_flush = loop.time()
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+                    continue
+                more, chunk = pending.result()
+                pending = None
+            if not more:
+                break
+            now = loop.time()
+            if not buffer and (not token_sent or now - last_flush >= window):
+                # Nothing to join it with yet: the first token, or the stream was idle.
+                token_sent = token_sent or _TOKEN.search(chunk) is not None
+                last_flush = now
+                yield chunk
+                continue
+            if not buffer:
+                deadline = now + window
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                last_flush = now
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.wait((pending,))
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
@@ -0,0 +1,354 @@
+"""
+Async (ASGI) handlers for the proxy endpoints and the live log stream.
+
+Streaming completions and log followers stay open for a long time, so these run on an
+event loop instead of tying up a sync worker each. The HTML pages
+stay on the Flask blueprint, mounted behind these routes in asgi.py.
+"""
+import asyncio
+import logging
+from functools import wraps
+from urllib.parse import quote
+
+from itsdangerous import BadSignature
+from starlette.background import BackgroundTask
+from starlette import responses
+from starlette.responses import RedirectResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from src import codec, metrics
+from src.admission import admission, estimate_tokens, Rejected
+from src.decorators import authenticate_bearer
+from src.routes.main import (
+    is_test_prompt,
+    completion_tokens,
+    accumulating,
+    record_stream,
+    log_cancelled,
+    timeout_event,
+    error_event,
+    chat_context,
+    session_saver,
+    CHAT_MODEL,
+    LOG_FILE,
+)
+from src.services import async_openai_service, bulk
+from src.services.models_cache import models_cache_for, not_modified
+from src.services.router import default_router
+from src.services.completion_cache import CACHE_HEADER, cache_key, cache_mode, completion_cache, replay_as_sse
+from src.services.openai_service import TEST_MODEL, TEST_MESSAGES, DEFAULT_TARGET_MODEL
+from src.sse import arelay
+from src.stream_assembly import CompletionAccumulator
+from src.stream_guard import StreamCancelled, StreamGuard
+from src.log_pipeline import LazyJSON
+from src.output import acoalesce
+from src.chat_store import conversation_key
+from src.log_tail import start_offset, follow
+from src.config import settings
+
+chat_logger = logging.getLogger("chat_logger")
+
+
+class JSONResponse(responses.JSONResponse):
+    """Starlette's JSONResponse, encoded with src.codec."""
+
+    def render(self, content):
+        return codec.dumps(content)
+
+
+def flask_session(flask_app, request):
+    """Decode the signed Flask session cookie so both stacks share one login."""
+    interface = flask_app.session_interface
+    serializer = interface.get_signing_serializer(flask_app)
+    value = request.cookies.get(interface.get_cookie_name(flask_app))
+    if serializer is None or not value:
+        return {}
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+    try:
+        return serializer.loads(value, max_age=max_age)
+    except BadSignature:
+        return {}
+
+
+def bearer_required(f):
+    @wraps(f)
+    async def decorated_function(request):
+        api_key, error = authenticate_bearer(request.headers.get("Authorization"))
+        if error:
+            body, status = error
+            return JSONResponse(body, status_code=status)
+        request.state.api_key = api_key
+        return await f(request)
+    return decorated_function
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(request):
+        if "authenticated" not in flask_session(request.app.state.flask_app, request):
+            return RedirectResponse(f"/login?next={quote(str(request.url), safe='')}", status_code=302)
+        return await f(request)
+    return decorated_function
+
+
+async def read_body(request, limit=None):
+    """
+    Read the request body into one buffer, or return None as soon as it is known to
+    exceed limit (MAX_BODY_BYTES by default): up front from Content-Length, otherwise
+    while reading.
+    """
+    limit = settings.MAX_BODY_BYTES if limit is None else limit
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        return None
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            return None
+    return body
+
+
+async def passthrough_stream(response):
+    """Relay an upstream response body unchanged, closing it when done."""
+    try:
+        async for chunk in response.aiter_bytes():
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+async def proxy_stream(payload, conversation=None, body=None, lease=None, on_reply=None, store_as=None):
+    """
+    Proxy the target API stream, re-framing each event as it arrives and passing it through
+    the upstream's response transforms.
+    Starlette cancels it when the client disconnects; STREAM_MAX_SECONDS cuts it off.
+    The reply is reassembled on the way through and accounted for by record_stream().
+    """
+    log_extra = {"conversation": conversation}
+    accumulator = CompletionAccumulator()
+    ai_source = None
+    guard = StreamGuard()
+    try:
+        upstream_stream = await async_openai_service.openai_chat_completion_for_chat_stream(payload, body)
+        try:
+            rewrite = accumulating(accumulator, upstream_stream.upstream.transforms.stream())
+            ai_source = f"AI ({upstream_stream.upstream.completions_url})"
+            chat_logger.info(f"{ai_source}: Streaming response initiated (proxy mode).", extra=log_extra)
+            async for event in arelay(guard.aiter(upstream_stream), rewrite):
+                guard.events += 1
+                yield event
+        finally:
+            await upstream_stream.aclose()
+    except StreamCancelled:
+        log_cancelled(guard, lease, log_extra)
+        if guard.reason == "max_duration":
+            yield timeout_event(guard)
+    except (asyncio.CancelledError, GeneratorExit):
+        guard.cancel("client_disconnect")
+        log_cancelled(guard, lease, log_extra)
+        raise
+    except Exception as e:
+        metrics.ERRORS.inc("proxy_stream", type(e).__name__)
+        chat_logger.error(f"Error during stream generation: {str(e)}", exc_info=True, extra=log_extra)
+        yield error_event("An error occurred during the stream.")
+    finally:
+        if ai_source is not None:
+            # It may store the completion on disk: keep that off the event loop.
+            await asyncio.to_thread(record_stream, accumulator, ai_source, lease, log_extra, store_as, on_reply)
+        # Starlette skips the response's background task when the client disconnects.
+        if lease is not None:
+            lease.release()
+
+
+async def follow_logs(offset):
+    """Async main.follow_logs(): an idle dashboard costs a sleeping task, not a worker."""
+    interval = settings.LOG_STREAM_POLL_INTERVAL
+    for event in follow(LOG_FILE, offset, settings.LOG_STREAM_MAX_SECONDS, interval):
+        if event is None:
+            await asyncio.sleep(interval)
+        else:
+            yield event
+
+
+@metrics.instrumented("chat_completions")
+@bearer_required
+async def chat_completions(request):
+    """Handle OpenAI chat completions"""
+    # Parse the body once; streaming requests forward these bytes rather than re-encoding them.
+    body = await read_body(request)
+    if body is None:
+        return JSONResponse({"error": f"Request body exceeds {settings.MAX_BODY_BYTES} bytes"}, status_code=413)
+    try:
+        request_data = codec.loads(body)
+    except ValueError:
+        return JSONResponse({"error": "Request body must be valid JSON"}, status_code=400)
+
+    try:
+        lease = await admission.aacquire(request.state.api_key, estimate_tokens(body))
+    except Rejected as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+    try:
+        messages = request_data.get("messages")
+        stream = request_data.get("stream", False)
+
+        if not messages:
+            return JSONResponse({"error": "messages is required"}, status_code=400)
+
+        conversation = request.headers.get("X-Conversation-Id") or conversation_key(messages)
+        log_extra = {"conversation": conversation}
+        chat_logger.info("user: %s", LazyJSON(request_data), extra=log_extra)
+
+        mode = cache_mode(request.headers)
+
+        if is_test_prompt(messages):
+            key = cache_key("openai", {"model": TEST_MODEL, "messages": TEST_MESSAGES})
+            if stream:
+                cached = await completion_cache.alookup(key, mode)
+                if cached is not None:
+                    lease.tokens = 0
+                    chat_logger.info("AI: Replaying cached response for test prompt.", extra=log_extra)
+                    return StreamingResponse(replay_as_sse(cached), media_type="text/event-stream",
+                                             headers={CACHE_HEADER: "HIT"})
+                chat_logger.info("AI: Streaming response initiated for test prompt.", extra=log_extra)
+                response = await async_openai_service.openai_chat_completion_stream()
+                response, lease = StreamingResponse(passthrough_stream(response), media_type="text/event-stream",
+                                                    background=BackgroundTask(lease.release)), None
+                return response
+            result, status = await completion_cache.acomplete(key, mode, async_openai_service.openai_chat_completion)
+            lease.tokens = completion_tokens(result, status)
+            chat_logger.info("AI: %s", LazyJSON(result), extra=log_extra)
+            return JSONResponse(result, headers={CACHE_HEADER: status})
+
+        payload = request_data
+        payload["model"] = default_router.resolve_model(payload.get("model")) or DEFAULT_TARGET_MODEL
+        # One key for both paths: a completion stored by either is replayable by the other.
+        key = cache_key(settings.TARGET_API_BASE_URL, payload)
+
+        if stream:
+            cached = await completion_cache.alookup(key, mode)
+            if cached is not None:
+                lease.tokens = 0
+                chat_logger.info("AI: Replaying cached response.", extra=log_extra)
+                return StreamingResponse(replay_as_sse(cached), media_type="text/event-stream",
+                                         headers={CACHE_HEADER: "HIT"})
+
+            chat_logger.info("AI: Streaming response initiated.", extra=log_extra)
+            store_as = key if mode != "bypass" else None
+            chunks = acoalesce(metrics.atrack_stream(
+                "chat_completions", proxy_stream(payload, conversation, body, lease, store_as=store_as)
+            ))
+            # The response now owns the lease and releases it once it has been sent.
+            response, lease = StreamingResponse(chunks, media_type="text/event-stream",
+                                                background=BackgroundTask(lease.release)), None
+            return response
+
+        completion, status = await completion_cache.acomplete(
+            key, mode, lambda: async_openai_service.openai_chat_completion_for_chat(payload)
+        )
+        lease.tokens = completion_tokens(completion, status)
+        ai_source = "AI (target /chat/completions)"
+        chat_logger.info("%s: %s", ai_source, LazyJSON(completion), extra=log_extra)
+        return JSONResponse(completion, headers={CACHE_HEADER: status})
+    except Exception as e:
+        metrics.ERRORS.inc("chat_completions", type(e).__name__)
+        chat_logger.error(f"Error in calling completion: {str(e)}", exc_info=True)
+        request.app.state.flask_app.logger.error(f"Error in OpenAI chat completion: {e}", exc_info=True)
+        return JSONResponse({"error": "An internal error has occurred."}, status_code=500)
+    finally:
+        if lease is not None:
+            lease.release()
+
+
+@metrics.instrumented("bulk_completions")
+@bearer_required
+async def bulk_completions(request):
+    """Run a JSONL file of chat completion requests, streaming back JSONL results as they finish"""
+    body = await read_body(request)
+    if body is None:
+        return JSONResponse({"error": f"Request body exceeds {settings.MAX_BODY_BYTES} bytes"}, status_code=413)
+    try:
+        items = bulk.parse_requests(body, settings.BULK_MAX_REQUESTS)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    try:
+        lease = await admission.aacquire(request.state.api_key, estimate_tokens(body))
+    except Rejected as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+
+    chat_logger.info(f"user: bulk request with {len(items)} completions")
+    return StreamingResponse(bulk.arun(items, lease), media_type="application/jsonl",
+                             background=BackgroundTask(lease.release))
+
+
+@metrics.instrumented("list_models")
+@bearer_required
+async def list_models(request):
+    """Handle OpenAI models list, served from a TTL cache with ETag revalidation"""
+    try:
+        cache = models_cache_for(request.query_params.get("merged"))
+        # Misses block on the (coalesced) upstream fetch, so run them off the event loop.
+        entry = cache.get_nowait() or await asyncio.to_thread(cache.get)
+        headers = {"ETag": entry.etag, "Cache-Control": f"private, max-age={cache.max_age(entry)}"}
+        if not_modified(entry, request.headers.get("If-None-Match")):
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+    except Exception as e:
+        metrics.ERRORS.inc("list_models", type(e).__name__)
+        request.app.state.flask_app.logger.error(f"Error fetching OpenAI models: {e}", exc_info=True)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@metrics.instrumented("chat_message")
+@login_required
+async def chat_message(request):
+    """Handle chat messages from the user and stream the response."""
+    body = await read_body(request)
+    if body is None:
+        return JSONResponse({"error": f"Request body exceeds {settings.MAX_BODY_BYTES} bytes"}, status_code=413)
+    try:
+        data = codec.loads(body)
+        user_input = data.get("message") or data.get("prompt")
+        if not user_input:
+            return JSONResponse({"error": "message or prompt is required"}, status_code=400)
+
+        # The session store is SQLite, so load it off the event loop (the reply is saved
+        # from record_stream(), which proxy_stream() already runs in a thread).
+        conversation, messages = await asyncio.to_thread(chat_context, data.get("conversation_id"), user_input)
+        chat_logger.info(f"user: {user_input}", extra={"conversation": conversation})
+
+        payload = {
+            "messages": messages,
+            "model": CHAT_MODEL
+        }
+        chunks = acoalesce(metrics.atrack_stream(
+            "chat_message", proxy_stream(payload, conversation, on_reply=session_saver(conversation, user_input))
+        ))
+        return StreamingResponse(chunks, media_type="text/event-stream", headers={"X-Conversation-Id": conversation})
+    except Exception as e:
+        metrics.ERRORS.inc("chat_message", type(e).__name__)
+        request.app.state.flask_app.logger.error(f"Error handling chat message: {e}", exc_info=True)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@login_required
+async def stream_logs(request):
+    """Server-sent events with lines appended to logs.txt, resumable via Last-Event-ID or ?offset="""
+    resume = request.headers.get("Last-Event-ID") or request.query_params.get("offset")
+    offset = start_offset(LOG_FILE, resume)
+    return StreamingResponse(
+        follow_logs(offset),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+routes = [
+    Route("/openai/v1/chat/completions", chat_completions, methods=["GET", "POST"]),
+    Route("/openai/v1/chat/completions/bulk", bulk_completions, methods=["POST"]),
+    Route("/openai/v1/models", list_models, methods=["GET"]),
+    Route("/chat/message", chat_message, methods=["POST"]),
+    Route("/api/logs/stream", stream_logs, methods=["GET"]),
+]
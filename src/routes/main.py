@@ -1,25 +1,54 @@
-import json
 import logging
-import re
+import sqlite3
+import time
 from functools import wraps
 from pathlib import Path
 
 import requests
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask import Blueprint, jsonify, render_template, request, url_for, redirect, flash, session, current_app, \
-    Response, stream_with_context
+    Response, stream_with_context, g
 
+from src import codec, config, metrics
+from src.admission import admission, estimate_tokens, Rejected
 from src.decorators import bearer_required
+from src.sse import relay
+from src.stream_guard import STREAMS_CANCELLED, StreamCancelled, StreamGuard
+from src.log_pipeline import BatchingQueueHandler, LazyJSON
+from src.chat_store import conversation_key, parse_time
+from src.chat_sessions import chat_sessions, fit_context, new_session_id, strip_reasoning
+from src.stream_assembly import CompletionAccumulator
+from src.log_tail import tail_lines, start_offset, follow
 from src.services.openai_service import (
     openai_chat_completion,
-    openai_list_models,
     openai_chat_completion_for_chat,
     openai_chat_completion_stream,
     openai_chat_completion_for_chat_stream,
+    TEST_MODEL,
+    TEST_MESSAGES,
+    DEFAULT_TARGET_MODEL,
 )
-from src.config import TARGET_API_BASE_URL, OPENAI_API_KEY
+from src.services import bulk
+from src.services.http_client import pool_stats
+from src.services.router import default_router
+from src.services.models_cache import models_cache_for, not_modified
+from src.services.completion_cache import CACHE_HEADER, cache_key, cache_mode, completion_cache, replay_as_sse
+from src.config import settings
 
 main_blueprint = Blueprint("main", __name__)
 chat_logger = logging.getLogger("chat_logger")
+LOG_FILE = "logs/logs.txt"
+# The sync follower holds a worker while it runs, so it ends early; EventSource resumes it.
+LOG_STREAM_SYNC_MAX_SECONDS = 30.0
+CHAT_SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful assistant."}
+CHAT_MODEL = "deepseek-r1-distill-llama-70b"
+
+
+def completion_tokens(completion, cache_status):
+    """Tokens a non-streaming completion cost upstream: none for a cache hit."""
+    if cache_status == "HIT":
+        return 0
+    return (completion.get("usage") or {}).get("total_tokens")
 
 # --- New Login Decorator ---
 def login_required(f):
@@ -31,41 +60,196 @@ def login_required(f):
     return decorated_function
 
 
-def get_last_logs(num_lines=200):
-    """Get the last N lines from logs.txt"""
+def is_test_prompt(messages):
+    """Return True for the client's connectivity test prompt, which is answered by OpenAI directly."""
+    return len(messages) >= 2 and messages[1].get("content") == "Test prompt using gpt-3.5-turbo"
+
+
+def accumulating(accumulator, transform):
+    """transform() that also folds each transformed event into accumulator."""
+    def rewrite(data):
+        data = transform(data)
+        accumulator.feed(data)
+        return data
+    return rewrite
+
+
+def record_stream(accumulator, ai_source, lease, log_extra, store_as=None, on_reply=None):
+    """
+    Account for a relayed stream once it has ended, even if cut short: one completion
+    record in the chat log, the reported token usage, and the reply for on_reply. A
+    complete reply is also stored in the completion cache under store_as, if given.
+    """
+    completion = accumulator.completion()
+    usage = accumulator.usage
+    metrics.observe_usage(usage)
+    if lease is not None and usage and usage.get("total_tokens") is not None:
+        lease.tokens = usage["total_tokens"]
+    chat_logger.info("%s: %s", ai_source, LazyJSON(completion), extra=log_extra)
+    if store_as is not None and accumulator.finished:
+        completion_cache.put(store_as, completion)
+    if on_reply is not None and accumulator.content:
+        on_reply(accumulator.content)
+
+
+def chat_context(session_id, user_input):
+    """
+    Return (session id, messages to send) for a /chat turn: the stored conversation plus
+    the new message, trimmed to CHAT_CONTEXT_TOKENS. Unknown or expired ids start a new one.
+    """
+    history = chat_sessions.load(session_id)
+    if history is None:
+        session_id, history = new_session_id(), []
+    context, _ = fit_context(history + [{"role": "user", "content": user_input}], settings.CHAT_CONTEXT_TOKENS)
+    return session_id, [CHAT_SYSTEM_MESSAGE] + context
+
+
+def session_saver(session_id, user_input):
+    """on_reply callback for proxy_stream() that stores the finished turn."""
+    def save(reply):
+        turn = [{"role": "user", "content": user_input}]
+        reply = strip_reasoning(reply)
+        if reply:
+            turn.append({"role": "assistant", "content": reply})
+        try:
+            chat_sessions.append(session_id, turn)
+        except sqlite3.Error as e:
+            chat_logger.error(f"Could not save chat session: {e}", extra={"conversation": session_id})
+    return save
+
+
+def log_cancelled(guard, lease, log_extra):
+    """Record a stream that was cut short, with the tokens streamed before it was."""
+    STREAMS_CANCELLED.inc(guard.reason)
+    if lease is not None and lease.tokens is None:
+        # No usage reported yet: charge the prompt estimate plus about a token per event.
+        lease.tokens = lease.estimate + guard.events
+    chat_logger.info(
+        f"AI: Stream cancelled ({guard.reason}) after {guard.elapsed:.1f}s, "
+        f"~{guard.events} completion tokens streamed.",
+        extra=log_extra,
+    )
+
+
+def error_event(message):
+    return b"data: " + codec.dumps({"error": {"message": message}}) + b"\n\n"
+
+
+def timeout_event(guard):
+    return error_event(f"Stream exceeded {guard.max_seconds:g} seconds.")
+
+
+def stream_response(chunks, lease, headers=None):
+    """An SSE response that holds lease until the client has read it all or gone away."""
+    response = Response(stream_with_context(chunks), mimetype="text/event-stream", headers=headers)
+    response.call_on_close(lease.release)
+    return response
+
+
+def proxy_stream(payload, conversation=None, body=None, lease=None, on_reply=None, store_as=None):
+    """
+    Proxy the target API stream, re-framing each event as it arrives and passing it through
+    the upstream's response transforms.
+    body, if given, is the client's original request, forwarded with model/stream patched.
+    lease, if given, is credited with the token usage the upstream reports and released at the end.
+    Once the upstream stream is open, it is closed as soon as the client goes away or
+    STREAM_MAX_SECONDS passes. The reply is reassembled on the way through; see record_stream() for what happens at the end.
+    """
+    log_extra = {"conversation": conversation}
+    accumulator = CompletionAccumulator()
+    upstream_stream = None
+    ai_source = None
+    # Under gunicorn the watchdog can see the client hang up even while we wait on the upstream.
+    # It can only interrupt reads once guard.abort is set: opening the stream is bounded by the
+    # upstream connect/read timeouts alone, and a cancellation meanwhile applies at the first chunk.
+    guard = StreamGuard(request.environ.get("gunicorn.socket"))
+    guard.watch()
     try:
-        with open("logs/logs.txt", "r") as f:
-            lines = f.readlines()
-            return lines[-num_lines:] if len(lines) > num_lines else lines
-    except FileNotFoundError:
-        return ["No log file found."]
+        upstream_stream = openai_chat_completion_for_chat_stream(payload, body)
+        guard.abort = upstream_stream.abort
+        rewrite = accumulating(accumulator, upstream_stream.upstream.transforms.stream())
+        ai_source = f"AI ({upstream_stream.upstream.completions_url})"
+        chat_logger.info(f"{ai_source}: Streaming response initiated (proxy mode).", extra=log_extra)
+        for event in relay(guard.iter(upstream_stream), rewrite):
+            guard.events += 1
+            yield event
+    except StreamCancelled:
+        log_cancelled(guard, lease, log_extra)
+        if guard.reason == "max_duration":
+            yield timeout_event(guard)
+    except GeneratorExit:
+        # The server closed the response early: the client went away.
+        guard.cancel("client_disconnect")
+        log_cancelled(guard, lease, log_extra)
+        raise
     except Exception as e:
-        return [f"Error reading log file: {str(e)}"]
+        metrics.ERRORS.inc("proxy_stream", type(e).__name__)
+        chat_logger.error(f"Error during stream generation: {str(e)}", exc_info=True, extra=log_extra)
+        yield error_event("An error occurred during the stream.")
+    finally:
+        guard.close()
+        if upstream_stream is not None:
+            upstream_stream.close()
+        if ai_source is not None:
+            record_stream(accumulator, ai_source, lease, log_extra, store_as, on_reply)
+        if lease is not None:
+            lease.release()
 
 
-def parse_chat_logs():
-    """Parse chat_logs.txt and return a list of structured log entries."""
-    log_entries = []
-    log_pattern = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (.*?): (.*)")
+def get_last_logs(num_lines=200):
+    """Get the last N lines from logs.txt and the byte offset to follow it from"""
     try:
-        with open("logs/chat_logs.txt", "r") as f:
-            for line in f:
-                match = log_pattern.match(line.strip())
-                if match:
-                    timestamp, source, message = match.groups()
-                    role = "user" if "user" in source.lower() else "assistant"
-                    log_entries.append({
-                        "timestamp": timestamp,
-                        "role": role,
-                        "source": source,
-                        "message": message
-                    })
+        return tail_lines(LOG_FILE, num_lines)
     except FileNotFoundError:
-        return [{"timestamp": "", "role": "system", "source": "System", "message": "Chat log file not found."}]
+        return ["No log file found."], 0
     except Exception as e:
-        return [{"timestamp": "", "role": "system", "source": "System", "message": f"Error reading chat log file: {e}"}]
+        return [f"Error reading log file: {str(e)}"], 0
+
+
+def follow_logs(offset):
+    """
+    Yield SSE events for lines appended to logs.txt after offset. Each call ties up a worker,
+    so it stops after LOG_STREAM_SYNC_MAX_SECONDS and the browser reconnects from the last
+    event id; the ASGI route follows for the full LOG_STREAM_MAX_SECONDS.
+    """
+    interval = settings.LOG_STREAM_POLL_INTERVAL
+    max_seconds = min(settings.LOG_STREAM_MAX_SECONDS, LOG_STREAM_SYNC_MAX_SECONDS)
+    for event in follow(LOG_FILE, offset, max_seconds, interval):
+        if event is None:
+            time.sleep(interval)
+        else:
+            yield event
 
-    return log_entries
+
+def _time_arg(args, name):
+    try:
+        return parse_time(args.get(name))
+    except ValueError:
+        raise ValueError(f"{name} must be epoch seconds or an ISO 8601 timestamp")
+
+
+def query_chat_logs(args):
+    """
+    Query the indexed chat log store with /api/chat-logs query parameters.
+    Raises ValueError, with a message for the client, if a parameter is malformed.
+    """
+    store = current_app.extensions["chat_log_store"]
+    try:
+        limit = min(max(int(args.get("limit", 100)), 1), 500)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    cursor = args.get("cursor")
+    if cursor and not cursor.isdigit():
+        raise ValueError("cursor must be a next_cursor value")
+    return store.query(
+        cursor=cursor,
+        limit=limit,
+        since=_time_arg(args, "since"),
+        until=_time_arg(args, "until"),
+        role=args.get("role"),
+        conversation=args.get("conversation"),
+        q=args.get("q"),
+    )
 
 
 @main_blueprint.route("/")
@@ -99,92 +283,138 @@ def logout():
 
 
 @main_blueprint.route("/openai/v1/chat/completions", methods=["GET", "POST"])
+@metrics.instrumented("chat_completions")
 @bearer_required
 def chat_completions():
     """Handle OpenAI chat completions"""
+    # Parse the body once; streaming requests forward these bytes rather than re-encoding them.
+    try:
+        body = request.get_data()
+        request_data = codec.loads(body)
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Request body exceeds {settings.MAX_BODY_BYTES} bytes"}), 413
+    except ValueError:
+        return jsonify({"error": "Request body must be valid JSON"}), 400
+
+    try:
+        lease = admission.acquire(g.api_key, estimate_tokens(body))
+    except Rejected as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
     try:
-        request_data = request.json
         messages = request_data.get("messages")
         stream = request_data.get("stream", False)
 
         if not messages:
             return jsonify({"error": "messages is required"}), 400
 
-        chat_logger.info(f"user: {json.dumps(request_data)}")
+        conversation = request.headers.get("X-Conversation-Id") or conversation_key(messages)
+        log_extra = {"conversation": conversation}
+        chat_logger.info("user: %s", LazyJSON(request_data), extra=log_extra)
 
         def stream_generator(response_iterator):
-            for chunk in response_iterator:
-                yield chunk + b'\\n'
+            try:
+                for chunk in response_iterator:
+                    yield chunk + b'\\n'
+            finally:
+                response_iterator.close()
 
-        if len(messages) >= 2 and messages[1].get("content") == "Test prompt using gpt-3.5-turbo":
+        mode = cache_mode(request.headers)
+
+        if is_test_prompt(messages):
+            key = cache_key("openai", {"model": TEST_MODEL, "messages": TEST_MESSAGES})
             if stream:
-                chat_logger.info("AI: Streaming response initiated for test prompt.")
+                cached = completion_cache.lookup(key, mode)
+                if cached is not None:
+                    lease.tokens = 0
+                    chat_logger.info("AI: Replaying cached response for test prompt.", extra=log_extra)
+                    return Response(replay_as_sse(cached), mimetype="text/event-stream", headers={CACHE_HEADER: "HIT"})
+                chat_logger.info("AI: Streaming response initiated for test prompt.", extra=log_extra)
                 streamer = openai_chat_completion_stream()
-                return Response(stream_with_context(stream_generator(streamer)), mimetype="text/event-stream")
+                response, lease = stream_response(stream_generator(streamer), lease), None
+                return response
             else:
-                result = openai_chat_completion()
-                chat_logger.info(f"AI: {json.dumps(result)}")
-                return jsonify(result)
-
-        if True:
-            chat_logger.info("AI: Streaming response initiated.")
-            payload = request_data
-
-            payload["model"] = "deepseek-r1-distill-llama-70b"
-
-            def generate_stream():
-                """Proxy the stream directly, yielding each chunk as it arrives."""
-                try:
-                    response = openai_chat_completion_for_chat_stream(payload)
-                    ai_source = f"AI ({TARGET_API_BASE_URL}/chat/completions)"
-                    chat_logger.info(f"{ai_source}: Streaming response initiated (proxy mode).")
-                    buffer = b""
-                    for chunk in response.iter_content(chunk_size=None):
-                        buffer = buffer + chunk
-                        index = buffer.find(b"\n\n")
-                        while index > -1:
-                            line = buffer[6:index]
-                            if line.find(b"[DONE]") > -1:
-                                yield b"data: " + line + b"\n\n"
-                                break
-                            json_chunk = json.loads(line)
-                            json_chunk["model"] = "gpt-4o-mini"
-                            if "x_groq" in json_chunk:
-                                del json_chunk["x_groq"]
-                            new_chunk = "data: " + json.dumps(json_chunk) + "\n\n"
-                            binary_chunk = bytes(new_chunk, "UTF-8")
-                            print("chunk:", binary_chunk)
-                            buffer = buffer[index + 2:]
-                            index = buffer.find(b"\n\n")
-                            yield binary_chunk
-                        # yield chunk
-                    pass
-                except Exception as e:
-                    chat_logger.error(f"Error during stream generation: {str(e)}", exc_info=True)
-                    error_message = json.dumps({"error": {"message": "An error occurred during the stream."}})
-                    yield f"data: {error_message}\\n\\n".encode('utf-8')
-
-            return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
-
-        completion = openai_chat_completion_for_chat(messages)
-        ai_source = f"AI ({TARGET_API_BASE_URL}/chat/completions)"
-        chat_logger.info(f"{ai_source}: {json.dumps(completion)}")
-
-        return jsonify(completion)
+                result, status = completion_cache.complete(key, mode, openai_chat_completion)
+                lease.tokens = completion_tokens(result, status)
+                chat_logger.info("AI: %s", LazyJSON(result), extra=log_extra)
+                return jsonify(result), 200, {CACHE_HEADER: status}
+
+        payload = request_data
+        payload["model"] = default_router.resolve_model(payload.get("model")) or DEFAULT_TARGET_MODEL
+        # One key for both paths: a completion stored by either is replayable by the other.
+        key = cache_key(settings.TARGET_API_BASE_URL, payload)
+
+        if stream:
+            cached = completion_cache.lookup(key, mode)
+            if cached is not None:
+                lease.tokens = 0
+                chat_logger.info("AI: Replaying cached response.", extra=log_extra)
+                return Response(replay_as_sse(cached), mimetype="text/event-stream", headers={CACHE_HEADER: "HIT"})
+
+            chat_logger.info("AI: Streaming response initiated.", extra=log_extra)
+            store_as = key if mode != "bypass" else None
+            chunks = metrics.track_stream(
+                "chat_completions", proxy_stream(payload, conversation, body, lease, store_as=store_as)
+            )
+            # The response now owns the lease and releases it when it closes.
+            response, lease = stream_response(chunks, lease), None
+            return response
+
+        completion, status = completion_cache.complete(key, mode, lambda: openai_chat_completion_for_chat(payload))
+        lease.tokens = completion_tokens(completion, status)
+        ai_source = "AI (target /chat/completions)"
+        chat_logger.info("%s: %s", ai_source, LazyJSON(completion), extra=log_extra)
+
+        return jsonify(completion), 200, {CACHE_HEADER: status}
     except Exception as e:
+        metrics.ERRORS.inc("chat_completions", type(e).__name__)
         chat_logger.error(f"Error in calling completion: {str(e)}", exc_info=True)
         current_app.logger.error(f"Error in OpenAI chat completion: {e}", exc_info=True)
         return jsonify({"error": "An internal error has occurred."}), 500
+    finally:
+        if lease is not None:
+            lease.release()
+
+
+@main_blueprint.route("/openai/v1/chat/completions/bulk", methods=["POST"])
+@metrics.instrumented("bulk_completions")
+@bearer_required
+def bulk_completions():
+    """Run a JSONL file of chat completion requests, streaming back JSONL results as they finish"""
+    try:
+        body = request.get_data()
+        items = bulk.parse_requests(body, settings.BULK_MAX_REQUESTS)
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Request body exceeds {settings.MAX_BODY_BYTES} bytes"}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # The whole file is admitted once, with the tokens of all its lines.
+    try:
+        lease = admission.acquire(g.api_key, estimate_tokens(body))
+    except Rejected as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+    chat_logger.info(f"user: bulk request with {len(items)} completions")
+    response = Response(stream_with_context(bulk.run(items, lease)), mimetype="application/jsonl")
+    response.call_on_close(lease.release)
+    return response
 
 
 @main_blueprint.route("/openai/v1/models", methods=["GET"])
+@metrics.instrumented("list_models")
 @bearer_required
 def list_models():
-    """Handle OpenAI models list"""
+    """Handle OpenAI models list, served from a TTL cache with ETag revalidation"""
     try:
-        result = openai_list_models()
-        return jsonify(result)
+        cache = models_cache_for(request.args.get("merged"))
+        entry = cache.get()
+        headers = {"ETag": entry.etag, "Cache-Control": f"private, max-age={cache.max_age(entry)}"}
+        if not_modified(entry, request.headers.get("If-None-Match")):
+            return Response(status=304, headers=headers)
+        return Response(entry.body, mimetype="application/json", headers=headers)
     except Exception as e:
+        metrics.ERRORS.inc("list_models", type(e).__name__)
         current_app.logger.error(f"Error fetching OpenAI models: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
@@ -196,7 +426,18 @@ def chat_page():
     return render_template("chat.html")
 
 
+@main_blueprint.route("/chat/history", methods=["GET"])
+@login_required
+def chat_history():
+    """The stored messages of a /chat conversation, for redrawing the page"""
+    messages = chat_sessions.load(request.args.get("conversation_id"))
+    if messages is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify({"conversation_id": request.args.get("conversation_id"), "messages": messages})
+
+
 @main_blueprint.route("/chat/message", methods=["POST"])
+@metrics.instrumented("chat_message")
 @login_required
 def chat_message():
     """Handle chat messages from the user and stream the response."""
@@ -206,53 +447,23 @@ def chat_message():
         if not user_input:
             return jsonify({"error": "message or prompt is required"}), 400
 
-        chat_logger.info(f"user: {user_input}")
-
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": user_input},
-        ]
+        # Only the new message comes from the browser; the history is kept server-side.
+        conversation, messages = chat_context(data.get("conversation_id"), user_input)
+        chat_logger.info(f"user: {user_input}", extra={"conversation": conversation})
         
         payload = {
             "messages": messages,
-            "model": "deepseek-r1-distill-llama-70b"
+            "model": CHAT_MODEL
         }
 
-        def generate_stream():
-            """Proxy the stream directly, yielding each chunk as it arrives."""
-            try:
-                response = openai_chat_completion_for_chat_stream(payload)
-                ai_source = f"AI ({TARGET_API_BASE_URL}/chat/completions)"
-                chat_logger.info(f"{ai_source}: Streaming response initiated (proxy mode).")
-                buffer = b""
-                for chunk in response.iter_content(chunk_size=None):
-                    buffer = buffer + chunk
-                    index = buffer.find(b"\n\n")
-                    while index > -1:
-                        line = buffer[6:index]
-                        if line.find(b"[DONE]") > -1:
-                            yield b"data: " + line + b"\n\n"
-                            break
-                        json_chunk = json.loads(line)
-                        json_chunk["model"] = "gpt-4o-mini"
-                        if "x_groq" in json_chunk:
-                            del json_chunk["x_groq"]
-                        new_chunk = "data: " + json.dumps(json_chunk) + "\n\n"
-                        binary_chunk = bytes(new_chunk, "UTF-8")
-                        print("chunk:", binary_chunk)
-                        buffer = buffer[index+2:]
-                        index = buffer.find(b"\n\n")
-                        yield binary_chunk
-                    # yield chunk
-                pass
-            except Exception as e:
-                chat_logger.error(f"Error during stream generation: {str(e)}", exc_info=True)
-                error_message = json.dumps({"error": {"message": "An error occurred during the stream."}})
-                yield f"data: {error_message}\\n\\n".encode('utf-8')
-
-        return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
+        chunks = metrics.track_stream(
+            "chat_message", proxy_stream(payload, conversation, on_reply=session_saver(conversation, user_input))
+        )
+        return Response(stream_with_context(chunks), mimetype='text/event-stream',
+                        headers={"X-Conversation-Id": conversation})
 
     except Exception as e:
+        metrics.ERRORS.inc("chat_message", type(e).__name__)
         current_app.logger.error(f"Error handling chat message: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
@@ -269,13 +480,78 @@ def logs_page():
 def get_logs():
     """API endpoint to get log data"""
     try:
-        logs = get_last_logs(200)
-        return jsonify({"logs": logs})
+        logs, offset = get_last_logs(200)
+        return jsonify({"logs": logs, "offset": offset})
     except Exception as e:
         current_app.logger.error(f"Error fetching logs: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@main_blueprint.route("/api/logs/stream", methods=["GET"])
+@login_required
+def stream_logs():
+    """Server-sent events with lines appended to logs.txt, resumable via Last-Event-ID or ?offset="""
+    resume = request.headers.get("Last-Event-ID") or request.args.get("offset")
+    offset = start_offset(LOG_FILE, resume)
+    return Response(
+        stream_with_context(follow_logs(offset)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@main_blueprint.route("/metrics", methods=["GET"])
+@bearer_required
+def get_metrics():
+    """Prometheus text exposition of request, stream, upstream and cache metrics across workers"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@main_blueprint.route("/api/pool-stats", methods=["GET"])
+@login_required
+def get_pool_stats():
+    """API endpoint to get upstream connection pool hit/miss counters"""
+    return jsonify(pool_stats())
+
+
+@main_blueprint.route("/api/upstreams", methods=["GET"])
+@login_required
+def get_upstreams():
+    """API endpoint to get per-upstream health, load and latency stats"""
+    return jsonify(default_router.stats())
+
+
+@main_blueprint.route("/api/api-keys", methods=["GET"])
+@login_required
+def get_api_keys():
+    """API endpoint to get per-key in-flight requests, queue depth and remaining quota"""
+    return jsonify(admission.stats())
+
+
+@main_blueprint.route("/api/config/reload", methods=["POST"])
+@login_required
+def reload_config():
+    """API endpoint to re-read the environment and .env; other workers follow within CONFIG_WATCH_INTERVAL"""
+    return jsonify({"changed": sorted(config.request_reload())})
+
+
+@main_blueprint.route("/api/chat-log-stats", methods=["GET"])
+@login_required
+def get_chat_log_stats():
+    """API endpoint to get chat log pipeline counters (queue depth, drops, enqueue latency)"""
+    for handler in chat_logger.handlers:
+        if isinstance(handler, BatchingQueueHandler):
+            return jsonify(handler.stats())
+    return jsonify({"error": "Chat log pipeline is not configured."}), 404
+
+
+@main_blueprint.route("/api/completion-cache-stats", methods=["GET"])
+@login_required
+def get_completion_cache_stats():
+    """API endpoint to get completion cache hit/miss counters"""
+    return jsonify(completion_cache.stats())
+
+
 @main_blueprint.route("/chat-logs", methods=["GET"])
 @login_required
 def chat_logs_page():
@@ -286,10 +562,15 @@ def chat_logs_page():
 @main_blueprint.route("/api/chat-logs", methods=["GET"])
 @login_required
 def get_chat_logs():
-    """API endpoint to get parsed chat log data"""
+    """
+    API endpoint to page through chat logs, newest first.
+    Query parameters: cursor, limit, since, until (epoch seconds or ISO 8601), role, conversation, q.
+    """
     try:
-        logs = parse_chat_logs()
-        return jsonify({"logs": logs})
+        logs, next_cursor = query_chat_logs(request.args)
+        return jsonify({"logs": logs, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error fetching chat logs: {e}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to fetch chat logs"}), 500
\ No newline at end of file
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+
+from src import config
+from src.config import settings
+
+_client = None
+_client_pid = None
+# Clients replaced on reload, as (client, pid, time it may be closed). Requests already
+# running on one keep its connections, and none outlives STREAM_MAX_SECONDS plus a read
+# timeout; httpx doesn't close a client's pool when it is garbage collected.
+_retired = []
+_retired_lock = threading.Lock()
+# aclose() tasks in flight, referenced so they aren't garbage collected half-way.
+_closing = set()
+
+
+def _build_client():
+    limits = httpx.Limits(
+        max_connections=settings.ASYNC_UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.UPSTREAM_POOL_MAXSIZE,
+    )
+    timeout = httpx.Timeout(settings.UPSTREAM_READ_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+    # httpx transport retries only cover connection failures.
+    transport = httpx.AsyncHTTPTransport(retries=settings.UPSTREAM_CONNECT_RETRIES, limits=limits)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def get_client():
+    """Return the pooled async client for this process, creating a fresh one after a fork."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        _client = _build_client()
+        _client_pid = pid
+    if _retired:
+        _close_retired()
+    return _client
+
+
+def _take_retired(due_by=None):
+    """Remove and return this process's retired clients that may be closed by due_by (all if None)."""
+    pid = os.getpid()
+    with _retired_lock:
+        # Clients inherited over a fork belong to the parent's event loop; just forget them.
+        _retired[:] = [entry for entry in _retired if entry[1] == pid]
+        due = [entry for entry in _retired if due_by is None or entry[2] <= due_by]
+        _retired[:] = [entry for entry in _retired if entry not in due]
+    return [client for client, _, _ in due]
+
+
+def _close_retired():
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    for client in _take_retired(time.monotonic()):
+        task = loop.create_task(client.aclose())
+        _closing.add(task)
+        task.add_done_callback(_closing.discard)
+
+
+@config.on_reload
+def _apply_settings(changed):
+    # New requests get a client built from the new settings; the old one is closed by a
+    # later get_client() once the requests it may still be serving are over.
+    global _client
+    if changed & {"UPSTREAM_POOL_MAXSIZE", "UPSTREAM_CONNECT_TIMEOUT", "UPSTREAM_READ_TIMEOUT",
+                  "UPSTREAM_CONNECT_RETRIES", "ASYNC_UPSTREAM_MAX_CONNECTIONS"}:
+        with _retired_lock:
+            if _client is not None:
+                due = time.monotonic() + settings.STREAM_MAX_SECONDS + settings.UPSTREAM_READ_TIMEOUT
+                _retired.append((_client, _client_pid, due))
+            _client = None
+
+
+async def aclose():
+    """Close the client's pooled connections, and any retired clients', e.g. on ASGI lifespan shutdown."""
+    global _client, _client_pid
+    for client in _take_retired():
+        await client.aclose()
+    if _client is not None and _client_pid == os.getpid():
+        await _client.aclose()
+    _client = None
+    _client_pid = None
@@ -0,0 +1,83 @@
+"""Async counterparts of openai_service for the ASGI serving mode."""
+import asyncio
+
+from src import codec, metrics
+from src.services import hedging, router
+from src.services.async_http_client import get_client
+from src.services.dispatcher import dispatcher
+from src.services.openai_service import TEST_MODEL, TEST_MESSAGES, DEFAULT_TARGET_MODEL
+from src.config import settings
+
+
+async def _open_stream(url, headers, payload):
+    """Send a streaming POST and return the open response; the caller must aclose() it."""
+    client = get_client()
+    request = client.build_request("POST", url, headers=headers, content=codec.dumps(payload))
+    response = await client.send(request, stream=True)
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+@metrics.timed_call("openai_chat_completion")
+async def openai_chat_completion():
+    """Make OpenAI chat completion request"""
+    url = "https://api.openai.com/v1/chat/completions"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+    }
+    data = {"messages": TEST_MESSAGES, "model": TEST_MODEL}
+    response = await get_client().post(url, headers=headers, content=codec.dumps(data))
+    response.raise_for_status()
+    return codec.loads(response.content)
+
+
+@metrics.timed_call("openai_chat_completion_for_chat")
+async def openai_chat_completion_for_chat(payload: dict):
+    """
+    Make the client's chat completion request to the target API and bring the response into
+    OpenAI's shape; see openai_service.openai_chat_completion_for_chat().
+    """
+    data = dict(payload, stream=False)
+    if not data.get("model"):
+        data["model"] = DEFAULT_TARGET_MODEL
+    if settings.DISPATCHER_ENABLED:
+        upstream, result = await asyncio.wrap_future(dispatcher.submit(data))
+    else:
+        upstream, result = await router.acomplete(data)
+    metrics.observe_usage(result.get("usage"))
+    return upstream.transforms.completion(result)
+
+
+@metrics.timed_call("openai_chat_completion_stream")
+async def openai_chat_completion_stream():
+    """
+    Make OpenAI chat completion streaming request.
+    Returns the open response; the caller must aclose() it.
+    """
+    url = "https://api.openai.com/v1/chat/completions"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+    }
+    data = {"messages": TEST_MESSAGES, "model": TEST_MODEL, "stream": True}
+    return await _open_stream(url, headers, data)
+
+
+@metrics.timed_call("openai_chat_completion_for_chat_stream")
+async def openai_chat_completion_for_chat_stream(payload: dict, body: bytes = None):
+    """
+    Make a streaming chat completion request to the target API, failing over between upstreams
+    and hedging a slow start when settings.HEDGE_ENABLED is set.
+    Returns a router.AsyncUpstreamStream; the caller must aclose() it.
+    """
+    payload["stream"] = True
+    if not payload.get("model"):
+        payload["model"] = DEFAULT_TARGET_MODEL
+
+    if settings.HEDGE_ENABLED:
+        return await hedging.aopen_stream(payload, body)
+    return await router.aopen_stream(payload, body)
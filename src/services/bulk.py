@@ -0,0 +1,119 @@
+"""
+Bulk chat completions: a JSONL file of requests in, JSONL results out as they finish.
+
+Input lines follow the OpenAI batch API ({"custom_id", "method", "url", "body"}); a bare
+request body is accepted too, with its line number as custom_id. Every line runs
+non-streaming through the dispatcher, and results use the batch API's output shape:
+{"id", "custom_id", "response": {"status_code", "body"}, "error"}.
+"""
+import asyncio
+import uuid
+from concurrent.futures import as_completed
+
+import requests
+
+from src import codec, metrics
+from src.services.dispatcher import dispatcher
+from src.services.openai_service import DEFAULT_TARGET_MODEL
+from src.services.router import default_router
+
+
+def parse_requests(body, max_requests):
+    """Return [(custom_id, payload)] for the JSONL in body; raises ValueError naming the bad line."""
+    items = []
+    seen = set()
+    for number, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            entry = codec.loads(line)
+        except ValueError:
+            raise ValueError(f"line {number}: not valid JSON")
+        if not isinstance(entry, dict):
+            raise ValueError(f"line {number}: expected a JSON object")
+
+        if "body" in entry:
+            url = entry.get("url") or "/v1/chat/completions"
+            if not url.rstrip("/").endswith("/chat/completions"):
+                raise ValueError(f"line {number}: only /v1/chat/completions is supported, got {url!r}")
+            payload, custom_id = entry["body"], str(entry.get("custom_id", number))
+        else:
+            payload, custom_id = entry, str(number)
+        if not isinstance(payload, dict) or not payload.get("messages"):
+            raise ValueError(f"line {number}: messages is required")
+        if custom_id in seen:
+            raise ValueError(f"line {number}: duplicate custom_id {custom_id!r}")
+        seen.add(custom_id)
+
+        payload = {k: v for k, v in payload.items() if k not in ("stream", "stream_options")}
+        # Same fallback as a single completion, so a line without a model never goes out as null.
+        payload["model"] = default_router.resolve_model(payload.get("model")) or DEFAULT_TARGET_MODEL
+        items.append((custom_id, payload))
+        if len(items) > max_requests:
+            raise ValueError(f"more than {max_requests} requests")
+    if not items:
+        raise ValueError("no requests")
+    return items
+
+
+def result_line(custom_id, future):
+    """Return (JSONL output line, total tokens used) for a finished dispatcher future."""
+    response = error = None
+    tokens = 0
+    try:
+        upstream, result = future.result()
+        metrics.observe_usage(result.get("usage"))
+        tokens = (result.get("usage") or {}).get("total_tokens") or 0
+        response = {"status_code": 200, "body": upstream.transforms.completion(result)}
+    except requests.HTTPError as e:
+        # The upstream answered, just not with a completion: pass its status and body on.
+        try:
+            body = e.response.json()
+        except ValueError:
+            body = {"error": {"message": e.response.text}}
+        response = {"status_code": e.response.status_code, "body": body}
+    except Exception as e:
+        metrics.ERRORS.inc("bulk_completions", type(e).__name__)
+        error = {"code": type(e).__name__, "message": str(e)}
+    line = {"id": f"bulk_req_{uuid.uuid4().hex}", "custom_id": custom_id, "response": response, "error": error}
+    return codec.dumps(line) + b"\n", tokens
+
+
+def run(items, lease=None):
+    """
+    Dispatch every item and yield its result line as soon as it finishes.
+    lease, if given, is credited with the tokens used and released at the end.
+    """
+    futures = {dispatcher.submit(payload): custom_id for custom_id, payload in items}
+    tokens = 0
+    try:
+        for future in as_completed(futures):
+            line, used = result_line(futures[future], future)
+            tokens += used
+            yield line
+    finally:
+        # The client went away (or we're done): drop whatever hasn't started.
+        for future in futures:
+            future.cancel()
+        if lease is not None:
+            lease.tokens = tokens
+            lease.release()
+
+
+async def arun(items, lease=None):
+    """Async twin of run()."""
+    pending = {asyncio.wrap_future(dispatcher.submit(payload)): custom_id for custom_id, payload in items}
+    tokens = 0
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                line, used = result_line(pending.pop(future), future)
+                tokens += used
+                yield line
+    finally:
+        for future in pending:
+            future.cancel()
+        if lease is not None:
+            lease.tokens = tokens
+            lease.release()
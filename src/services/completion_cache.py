@@ -0,0 +1,291 @@
+"""
+Opt-in exact-match cache for chat completions.
+
+Entries are keyed on a canonical hash of the upstream, model, messages and sampling
+parameters. A per-process LRU tier with a byte budget sits in front of an optional
+on-disk tier shared by all workers. Clients can skip the lookup with
+"Cache-Control: no-cache", or skip the cache entirely with "Cache-Control: no-store"
+or "X-BridgeAI-Cache: bypass".
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src import codec, config, metrics
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_HEADER = "X-BridgeAI-Cache"
+
+# Request fields that change the completion; everything else (stream, user, ...) is ignored.
+KEY_FIELDS = (
+    "model", "messages", "temperature", "top_p", "n", "max_tokens", "max_completion_tokens",
+    "stop", "seed", "presence_penalty", "frequency_penalty", "logit_bias", "logprobs",
+    "top_logprobs", "tools", "tool_choice", "response_format", "reasoning_effort",
+)
+
+
+def cache_key(upstream, body):
+    """Canonical SHA-256 over the upstream and the completion-relevant request fields."""
+    # Always the stdlib encoder: keys on disk must not depend on the JSON_CODEC in use.
+    canonical = {field: body[field] for field in KEY_FIELDS if body.get(field) is not None}
+    canonical["upstream"] = upstream
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def cache_mode(headers):
+    """Map request headers to "use", "refresh" (skip lookup, still store) or "bypass"."""
+    if not settings.COMPLETION_CACHE_ENABLED:
+        return "bypass"
+    if headers.get(CACHE_HEADER, "").lower() == "bypass":
+        return "bypass"
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return "bypass"
+    if "no-cache" in cache_control:
+        return "refresh"
+    return "use"
+
+
+class CompletionCache:
+    def __init__(self, max_bytes=None, disk_dir=None, ttl=None):
+        self.configure(max_bytes, disk_dir, ttl)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0,
+            "disk_errors": 0,
+        }
+
+    def configure(self, max_bytes=None, disk_dir=None, ttl=None):
+        """Apply limits, falling back to the COMPLETION_CACHE_* settings; entries are kept."""
+        self.max_bytes = settings.COMPLETION_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.disk_dir = (settings.COMPLETION_CACHE_DIR if disk_dir is None else disk_dir) or None
+        self.ttl = settings.COMPLETION_CACHE_TTL if ttl is None else ttl
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _expired(self, stored_at):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        """Return a fresh copy of the cached completion, or None."""
+        body = self._memory_get(key)
+        if body is None and self.disk_dir:
+            body = self._disk_get(key)
+        return self._loaded(body)
+
+    async def aget(self, key):
+        """get() with the disk tier read in a thread, off the event loop."""
+        body = self._memory_get(key)
+        if body is None and self.disk_dir:
+            body = await asyncio.to_thread(self._disk_get, key)
+        return self._loaded(body)
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            body, stored_at = entry
+            if self._expired(stored_at):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return body
+
+    def _disk_get(self, key):
+        try:
+            path = self._disk_path(key)
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                return None
+            with open(path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        self._remember(key, body, stored_at)
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        return body
+
+    def _loaded(self, body):
+        if body is not None:
+            try:
+                return codec.loads(body)
+            except ValueError:
+                pass
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key, completion):
+        body = self._store(key, completion)
+        if self.disk_dir:
+            self._disk_put(key, body)
+
+    async def aput(self, key, completion):
+        """put() with the disk tier written in a thread, off the event loop."""
+        body = self._store(key, completion)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, body)
+
+    def _store(self, key, completion):
+        body = codec.dumps(completion)
+        self._remember(key, body, time.time())
+        with self._lock:
+            self._stats["stores"] += 1
+        return body
+
+    def _disk_put(self, key, body):
+        """Write an entry to the disk tier. Failures are logged and counted, never raised:
+        the completion has already been paid for and is still returned to the client."""
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(body)
+            # Atomic publish: other workers see either no entry or the complete one.
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write completion cache entry {path}: {e}")
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _remember(self, key, body, stored_at):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (body, stored_at)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(old_body)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["memory_bytes"] = self._bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["enabled"] = settings.COMPLETION_CACHE_ENABLED
+        stats["pid"] = os.getpid()
+        return stats
+
+    def complete(self, key, mode, compute):
+        """
+        Return (completion, status) where status is "HIT", "MISS" or "BYPASS" for the
+        X-BridgeAI-Cache response header. compute() is called on anything but a hit.
+        """
+        if mode == "use":
+            cached = self.get(key)
+            if cached is not None:
+                return cached, "HIT"
+        if mode == "bypass":
+            self.record_bypass()
+            return compute(), "BYPASS"
+        completion = compute()
+        self.put(key, completion)
+        return completion, "MISS"
+
+    async def acomplete(self, key, mode, compute):
+        """complete() for a coroutine function compute, keeping disk access off the event loop."""
+        if mode == "use":
+            cached = await self.aget(key)
+            if cached is not None:
+                return cached, "HIT"
+        if mode == "bypass":
+            self.record_bypass()
+            return await compute(), "BYPASS"
+        completion = await compute()
+        await self.aput(key, completion)
+        return completion, "MISS"
+
+    def lookup(self, key, mode):
+        """Cache lookup for stream replay; None unless mode is "use" and the key is cached."""
+        return self.get(key) if mode == "use" else None
+
+    async def alookup(self, key, mode):
+        """lookup() for the event loop."""
+        return await self.aget(key) if mode == "use" else None
+
+
+def replay_as_sse(completion):
+    """Render a cached chat.completion as a chat.completion.chunk event stream."""
+    base = {
+        "id": completion.get("id"),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created"),
+        "model": completion.get("model"),
+        "system_fingerprint": completion.get("system_fingerprint"),
+    }
+    for choice in completion.get("choices") or []:
+        message = choice.get("message") or {}
+        index = choice.get("index", 0)
+        delta = {"role": message.get("role", "assistant"), "content": message.get("content") or ""}
+        if message.get("reasoning_content"):
+            delta["reasoning_content"] = message["reasoning_content"]
+        if message.get("tool_calls"):
+            delta["tool_calls"] = [dict(call, index=i) for i, call in enumerate(message["tool_calls"])]
+        chunk = dict(base, choices=[{"index": index, "delta": delta, "finish_reason": None}])
+        yield b"data: " + codec.dumps(chunk) + b"\n\n"
+        chunk = dict(base, choices=[{"index": index, "delta": {}, "finish_reason": choice.get("finish_reason")}])
+        yield b"data: " + codec.dumps(chunk) + b"\n\n"
+    if completion.get("usage"):
+        chunk = dict(base, choices=[], usage=completion["usage"])
+        yield b"data: " + codec.dumps(chunk) + b"\n\n"
+    yield b"data: [DONE]\n\n"
+
+
+completion_cache = CompletionCache()
+
+
+@config.on_reload
+def _apply_settings(changed):
+    completion_cache.configure()
+
+
+def _collect_completion_cache():
+    stats = completion_cache.stats()
+    for name in ("memory_hits", "disk_hits", "misses", "bypassed", "stores", "evictions", "disk_errors"):
+        yield ("bridgeai_completion_cache_events_total", "counter", "Completion cache lookups and stores.",
+               {"event": name}, stats[name])
+    yield ("bridgeai_completion_cache_bytes", "gauge", "Bytes held in the in-memory completion cache.",
+           {}, stats["memory_bytes"])
+
+
+metrics.register_collector(_collect_completion_cache)
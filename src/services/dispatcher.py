@@ -0,0 +1,119 @@
+"""
+Dispatcher for non-streaming chat completions.
+
+Completions are queued onto a bounded thread pool and sent over the shared keep-alive
+connection pool, at most Upstream.max_concurrency at a time per upstream. A burst of
+small completions from an offline job is then multiplexed over a few connections
+instead of each request thread making its own upstream call. Used by the bulk endpoint
+and, with DISPATCHER_ENABLED, by every non-streaming completion. Limits are per worker
+process.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src import metrics
+from src.services import router as routing
+from src.config import settings
+
+# Re-check the candidates this often while every upstream is at its cap (circuits change too).
+_CAPACITY_POLL = 1.0
+
+
+class Dispatcher:
+    def __init__(self, router, workers=None):
+        self.router = router
+        self.workers = workers or settings.DISPATCHER_WORKERS
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # Pool threads don't survive a fork; children start their own on first use.
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._capacity = threading.Condition(self._lock)
+        self._active = {}
+        self._queued = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="dispatch")
+            return self._executor
+
+    def submit(self, payload):
+        """Queue a non-streaming completion; the Future resolves to (upstream, response JSON)."""
+        executor = self._pool()
+        with self._lock:
+            self._queued += 1
+        future = executor.submit(self._run, payload)
+        future.add_done_callback(self._cancelled)
+        return future
+
+    def _cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def _claim(self, model, tried):
+        """Block until an untried candidate has a free slot and take it; None if none are left."""
+        with self._capacity:
+            while True:
+                candidates = [u for u in self.router.candidates(model) if u.name not in tried]
+                if not candidates:
+                    self._queued -= 1
+                    return None
+                for upstream in candidates:
+                    active = self._active.get(upstream.name, 0)
+                    if not upstream.max_concurrency or active < upstream.max_concurrency:
+                        self._active[upstream.name] = active + 1
+                        self._queued -= 1
+                        return upstream
+                self._capacity.wait(_CAPACITY_POLL)
+
+    def _release(self, upstream, requeue=False):
+        with self._capacity:
+            self._active[upstream.name] -= 1
+            if requeue:
+                self._queued += 1
+            self._capacity.notify()
+
+    def _run(self, payload):
+        model = payload.get("model")
+        tried = set()
+        errors = []
+        while True:
+            upstream = self._claim(model, tried)
+            if upstream is None:
+                raise routing.NoUpstreamAvailable(
+                    f"No upstream available for model {model!r}: {'; '.join(errors) or 'none configured'}"
+                )
+            requeue = False
+            try:
+                return routing.complete(payload, self.router, [upstream])
+            except routing.NoUpstreamAvailable as e:
+                # Failed over: back in the queue for the next candidate.
+                tried.add(upstream.name)
+                errors.append(str(e))
+                requeue = True
+            finally:
+                self._release(upstream, requeue)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "queued": self._queued, "active": dict(self._active)}
+
+
+dispatcher = Dispatcher(routing.default_router)
+
+
+def _collect_dispatcher():
+    stats = dispatcher.stats()
+    yield ("bridgeai_dispatcher_queued", "gauge", "Completions waiting for a dispatcher slot.", {}, stats["queued"])
+    for name, active in stats["active"].items():
+        yield ("bridgeai_dispatcher_active", "gauge", "Dispatcher completions in flight per upstream.",
+               {"upstream": name}, active)
+
+
+metrics.register_collector(_collect_dispatcher)
@@ -0,0 +1,216 @@
+"""
+Hedged stream opens, to cut the tail of time to first token (HEDGE_ENABLED).
+
+The stream is opened on the best candidate as usual. If no body byte has arrived after
+that upstream's HEDGE_PERCENTILE TTFT, the same request is sent to the next candidate
+(or again to the same upstream if it is the only one). Whichever produces its first
+chunk first is returned; the other request is cancelled at once, closing its connection
+so the upstream stops generating. Each attempt still fails over like a plain open.
+
+Hedges are paid for out of a budget that grows by HEDGE_BUDGET per stream opened, so
+they add at most that fraction of extra upstream requests (with short bursts of up to
+_BURST). Outcomes are counted in bridgeai_hedge_streams_total:
+
+  unmeasured  the upstream has fewer than HEDGE_MIN_SAMPLES TTFTs, so no hedge delay
+  fast        the first request answered (or failed) within the delay
+  budget      the delay passed but the budget was spent
+  primary     a hedge was sent and the first request still won
+  hedge       a hedge was sent and won
+  failed      a hedge was sent and both requests failed
+"""
+import asyncio
+import os
+import queue
+import threading
+
+from src import metrics
+from src.services import router as routing
+from src.config import settings
+
+# Most hedges the budget saves up.
+_BURST = 10.0
+
+
+class HedgeBudget:
+    """A token bucket: each stream opened earns ratio of a hedge, each hedge spends one."""
+
+    def __init__(self, burst=_BURST):
+        self.burst = burst
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self.tokens = self.burst
+
+    def earn(self, ratio):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + ratio)
+
+    def spend(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+budget = HedgeBudget()
+
+
+def hedge_delay(router, upstream):
+    """Seconds to wait for upstream's first byte before hedging, or None if it isn't measured yet."""
+    ttft = router.ttft_percentile(upstream, settings.HEDGE_PERCENTILE, settings.HEDGE_MIN_SAMPLES)
+    return None if ttft is None else max(ttft, settings.HEDGE_MIN_DELAY)
+
+
+def _plan(router, payload):
+    """(candidates, hedge candidates, delay); delay is None when the stream can't be hedged."""
+    candidates = router.candidates(payload.get("model"))
+    if not candidates:
+        return candidates, None, None
+    budget.earn(settings.HEDGE_BUDGET)
+    delay = hedge_delay(router, candidates[0])
+    if delay is None:
+        metrics.HEDGES.inc("unmeasured")
+    # The hedge starts on the next candidate, coming back to the first one last.
+    return candidates, candidates[1:] + candidates[:1], delay
+
+
+class _Attempt(threading.Thread):
+    """One request of a hedged open, run on its own thread; results go to the shared queue."""
+
+    def __init__(self, results, name, router, upstreams, payload, body):
+        super().__init__(name=f"hedge-{name}", daemon=True)
+        self.results = results
+        self.router = router
+        self.upstreams = upstreams
+        self.payload = payload
+        self.body = body
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._response = None
+        self._stream = None
+        self.start()
+
+    def run(self):
+        try:
+            stream = routing.open_stream(self.payload, self.body, self.router, self.upstreams, attempt=self)
+        except Exception as e:
+            self.results.put((self, e))
+            return
+        with self._lock:
+            if not self.cancelled:
+                self._stream = stream
+                self.results.put((self, None))
+                return
+        stream.close()
+
+    def watch(self, response):
+        """Called by open_stream() with each upstream response as soon as it is open."""
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled
+        if cancelled:
+            routing.abort_response(response)
+
+    def result(self):
+        return self._stream
+
+    def cancel(self):
+        """Stop this attempt: close its stream if it has one, else cut off the request in flight."""
+        with self._lock:
+            self.cancelled = True
+            response, stream = self._response, self._stream
+        if stream is not None:
+            stream.close()
+        elif response is not None:
+            routing.abort_response(response)
+
+
+def open_stream(payload, body=None, router=None):
+    """router.open_stream() with a hedge sent once the first upstream is slower than usual."""
+    router = router or routing.default_router
+    candidates, hedge_candidates, delay = _plan(router, payload)
+    if delay is None:
+        return routing.open_stream(payload, body, router, candidates)
+
+    results = queue.Queue()
+    primary = _Attempt(results, "primary", router, candidates, payload, body)
+    try:
+        attempt, error = results.get(timeout=delay)
+    except queue.Empty:
+        pass
+    else:
+        metrics.HEDGES.inc("fast")
+        if error is not None:
+            raise error
+        return attempt.result()
+
+    if not budget.spend():
+        metrics.HEDGES.inc("budget")
+        attempt, error = results.get()
+        if error is not None:
+            raise error
+        return attempt.result()
+
+    hedge = _Attempt(results, "hedge", router, hedge_candidates, payload, body)
+    errors = {}
+    while len(errors) < 2:
+        attempt, error = results.get()
+        if error is None:
+            winner, loser = (primary, hedge) if attempt is primary else (hedge, primary)
+            loser.cancel()
+            metrics.HEDGES.inc("primary" if winner is primary else "hedge")
+            return winner.result()
+        errors[attempt] = error
+    metrics.HEDGES.inc("failed")
+    raise errors[primary]
+
+
+async def aopen_stream(payload, body=None, router=None):
+    """Async counterpart of open_stream(), racing the two opens as tasks."""
+    router = router or routing.default_router
+    candidates, hedge_candidates, delay = _plan(router, payload)
+    if delay is None:
+        return await routing.aopen_stream(payload, body, router, candidates)
+
+    primary = asyncio.ensure_future(routing.aopen_stream(payload, body, router, candidates))
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            metrics.HEDGES.inc("fast")
+            return primary.result()
+        if not budget.spend():
+            metrics.HEDGES.inc("budget")
+            pending = set()
+            return await primary
+
+        hedge = asyncio.ensure_future(routing.aopen_stream(payload, body, router, hedge_candidates))
+        pending = {primary, hedge}
+        errors = {}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # Anything else that finished in the same step is a loser too.
+                    pending |= done - {task}
+                    metrics.HEDGES.inc("primary" if task is primary else "hedge")
+                    return task.result()
+                errors[task] = task.exception()
+        metrics.HEDGES.inc("failed")
+        raise errors[primary]
+    finally:
+        # The loser, or both opens if we were cancelled ourselves.
+        for task in pending:
+            await _discard(task)
+
+
+async def _discard(task):
+    task.cancel()
+    # wait() rather than await, so our own cancellation isn't mistaken for the task's.
+    await asyncio.wait((task,))
+    if not task.cancelled() and task.exception() is None:
+        await task.result().aclose()
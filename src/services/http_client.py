@@ -0,0 +1,182 @@
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from src import config, metrics
+from src.config import settings
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+_stats_lock = threading.Lock()
+_pool_stats = {}
+
+
+def _count(host, key):
+    with _stats_lock:
+        stats = _pool_stats.setdefault(host, {"hits": 0, "misses": 0})
+        stats[key] += 1
+
+
+class _CountingPoolMixin:
+    """Counts connection checkouts served from the pool (hits) vs. new connections (misses)."""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        # _new_conn() already counted a miss if the pool was empty.
+        if getattr(conn, "_bridge_counted", False):
+            _count(self.host, "hits")
+        conn._bridge_counted = True
+        return conn
+
+    def _new_conn(self):
+        _count(self.host, "misses")
+        conn = super()._new_conn()
+        connect = conn.connect
+        host = self.host
+
+        def timed_connect():
+            started = time.perf_counter()
+            connect()
+            metrics.UPSTREAM_CONNECT.observe(time.perf_counter() - started, host)
+
+        conn.connect = timed_connect
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter with keep-alive sockets, connect-only retries and pool hit/miss counters."""
+
+    def __init__(self, pool_maxsize=None):
+        retries = Retry(
+            total=settings.UPSTREAM_CONNECT_RETRIES,
+            connect=settings.UPSTREAM_CONNECT_RETRIES,
+            read=0,
+            status=0,
+            other=0,
+            redirect=False,
+            allowed_methods=None,
+            backoff_factor=settings.UPSTREAM_RETRY_BACKOFF,
+            raise_on_status=False,
+        )
+        super().__init__(pool_connections=4, pool_maxsize=pool_maxsize or settings.UPSTREAM_POOL_MAXSIZE,
+                         max_retries=retries)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def _parse_pool_sizes(value):
+    """Parse "prefix=size,prefix=size" into a dict."""
+    sizes = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        prefix, size = item.rsplit("=", 1)
+        sizes[prefix.strip().rstrip("/") + "/"] = int(size)
+    return sizes
+
+
+def _build_session():
+    session = requests.Session()
+    default_adapter = PooledAdapter()
+    session.mount("https://", default_adapter)
+    session.mount("http://", default_adapter)
+    for prefix, size in _parse_pool_sizes(settings.UPSTREAM_POOL_SIZES).items():
+        session.mount(prefix, PooledAdapter(pool_maxsize=size))
+    return session
+
+
+def get_session():
+    """Return the pooled session for this process, creating a fresh one after a fork."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def _reset_after_fork():
+    # Sockets inherited from the parent are shared with it; drop them without closing.
+    global _lock, _stats_lock, _session, _session_pid
+    _lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _session = None
+    _session_pid = None
+    _pool_stats.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@config.on_reload
+def _apply_settings(changed):
+    # Requests already in flight finish on the old session; new ones get the new pool sizes.
+    global _session
+    if changed & {"UPSTREAM_POOL_MAXSIZE", "UPSTREAM_POOL_SIZES", "UPSTREAM_CONNECT_RETRIES", "UPSTREAM_RETRY_BACKOFF"}:
+        with _lock:
+            _session = None
+
+
+def request(method, url, **kwargs):
+    """Send a request through the pooled session with the configured timeouts."""
+    kwargs.setdefault("timeout", (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def pool_stats():
+    """Return pool hit/miss counters per upstream host for this process."""
+    with _stats_lock:
+        hosts = {host: dict(stats) for host, stats in _pool_stats.items()}
+    return {
+        "pid": os.getpid(),
+        "hits": sum(s["hits"] for s in hosts.values()),
+        "misses": sum(s["misses"] for s in hosts.values()),
+        "hosts": hosts,
+    }
+
+
+def _collect_pool_stats():
+    for host, stats in pool_stats()["hosts"].items():
+        for result in ("hits", "misses"):
+            yield ("bridgeai_upstream_pool_checkouts_total", "counter",
+                   "Upstream connection checkouts served from the pool (hits) or newly opened (misses).",
+                   {"host": host, "result": result}, stats[result])
+
+
+metrics.register_collector(_collect_pool_stats)
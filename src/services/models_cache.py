@@ -0,0 +1,150 @@
+"""
+TTL cache for /openai/v1/models with stale-while-revalidate and request coalescing.
+
+The serialized body and its ETag are cached, so a hit costs no upstream call and no
+JSON encoding. Concurrent misses share one upstream fetch.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from src import codec, config, metrics
+from src.services.openai_service import openai_list_models, target_list_models
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+CachedModels = namedtuple("CachedModels", ["body", "etag", "fetched_at"])
+
+
+class ModelsCache:
+    def __init__(self, fetch, ttl=None, stale_ttl=None):
+        self.fetch = fetch
+        self.ttl = settings.MODELS_CACHE_TTL if ttl is None else ttl
+        self.stale_ttl = settings.MODELS_CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        self._entry = None
+        self._reset_locks()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_locks)
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "fetches": 0, "errors": 0}
+
+    def _reset_locks(self):
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._error = None
+
+    def max_age(self, entry):
+        """Seconds until entry is due for refresh, for Cache-Control."""
+        return max(int(self.ttl - (time.monotonic() - entry.fetched_at)), 0)
+
+    def get_nowait(self):
+        """
+        Return the cached entry if it is fresh, or stale within the grace period (which
+        triggers a background refresh). Returns None when the caller has to wait for a fetch.
+        """
+        entry = self._entry
+        if entry is None:
+            return None
+        age = time.monotonic() - entry.fetched_at
+        if age < self.ttl:
+            self.stats["hits"] += 1
+            return entry
+        if age < self.ttl + self.stale_ttl:
+            self.stats["stale_hits"] += 1
+            self._start_fetch(background=True)
+            return entry
+        return None
+
+    def get(self):
+        """Return the cached entry, fetching it (at most once across concurrent callers) if needed."""
+        entry = self.get_nowait()
+        if entry is not None:
+            return entry
+        self.stats["misses"] += 1
+        event = self._start_fetch(background=False)
+        event.wait()
+        if self._entry is None:
+            raise RuntimeError(f"Fetching models failed: {self._error}") from self._error
+        return self._entry
+
+    def _start_fetch(self, background):
+        with self._lock:
+            event = self._inflight
+            if event is not None:
+                return event
+            event = self._inflight = threading.Event()
+        if background:
+            threading.Thread(target=self._fetch, args=(event,), name="models-refresh", daemon=True).start()
+        else:
+            self._fetch(event)
+        return event
+
+    def _fetch(self, event):
+        try:
+            self.stats["fetches"] += 1
+            body = codec.dumps(self.fetch())
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            self._entry = CachedModels(body, etag, time.monotonic())
+            self._error = None
+        except Exception as e:
+            # A stale entry, if any, keeps being served until the grace period ends.
+            self.stats["errors"] += 1
+            self._error = e
+            logger.error(f"Error refreshing models list: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._inflight = None
+            event.set()
+
+
+def merged_models():
+    """OpenAI models followed by target API models not already listed."""
+    result = openai_list_models()
+    seen = {model.get("id") for model in result.get("data", [])}
+    try:
+        target = target_list_models()
+    except Exception as e:
+        logger.error(f"Error fetching target models: {e}", exc_info=True)
+        return result
+    result["data"] = result.get("data", []) + [
+        model for model in target.get("data", []) if model.get("id") not in seen
+    ]
+    return result
+
+
+openai_models_cache = ModelsCache(openai_list_models)
+merged_models_cache = ModelsCache(merged_models)
+
+
+@config.on_reload
+def _apply_settings(changed):
+    for cache in (openai_models_cache, merged_models_cache):
+        cache.ttl = settings.MODELS_CACHE_TTL
+        cache.stale_ttl = settings.MODELS_CACHE_STALE_TTL
+
+
+def _collect_models_cache():
+    for name, cache in (("openai", openai_models_cache), ("merged", merged_models_cache)):
+        for event, value in cache.stats.items():
+            yield ("bridgeai_models_cache_events_total", "counter", "Models cache hits, misses and fetches.",
+                   {"cache": name, "event": event}, value)
+
+
+metrics.register_collector(_collect_models_cache)
+
+
+def models_cache_for(merged_param):
+    """Pick the cache for a ?merged= query value, defaulting to MODELS_MERGED."""
+    merged = settings.MODELS_MERGED if merged_param is None else merged_param.lower() in ("1", "true", "yes")
+    return merged_models_cache if merged else openai_models_cache
+
+
+def not_modified(entry, if_none_match):
+    """True if the client's If-None-Match header matches the entry's ETag."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or entry.etag in tags
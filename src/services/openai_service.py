@@ -1,123 +1,108 @@
 import os
-import requests
-from src.config import (
-    OPENAI_API_KEY,
-    TARGET_API_KEY,
-    TARGET_API_BASE_URL,
-)
+from src import codec, metrics
+from src.services import hedging, http_client, router
+from src.services.dispatcher import dispatcher
+from src.config import settings
 
+TEST_MODEL = "gpt-4o-mini"
+TEST_MESSAGES = [
+    {"role": "system", "content": "You are a test assistant."},
+    {"role": "user", "content": "Testing. Just say hi and nothing else."},
+]
+DEFAULT_TARGET_MODEL = "llama-3.3-70b-versatile"
 
+
+@metrics.timed_call("openai_list_models")
 def openai_list_models():
     """Get OpenAI models list"""
     url = "https://api.openai.com/v1/models"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
-    response = requests.get(url, headers=headers)
+    headers = {"Authorization": f"Bearer {settings.OPENAI_API_KEY}"}
+    response = http_client.get(url, headers=headers)
+    response.raise_for_status()
+    return codec.loads(response.content)
+
+
+@metrics.timed_call("target_list_models")
+def target_list_models():
+    """Get the target API models list"""
+    url = f"{settings.TARGET_API_BASE_URL}/models"
+    headers = {"Authorization": f"Bearer {settings.TARGET_API_KEY}"}
+    response = http_client.get(url, headers=headers)
     response.raise_for_status()
-    return response.json()
+    return codec.loads(response.content)
 
 
+@metrics.timed_call("openai_chat_completion")
 def openai_chat_completion():
     """Make OpenAI chat completion request"""
     url = "https://api.openai.com/v1/chat/completions"
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
     }
-    messages = [
-        {"role": "system", "content": "You are a test assistant."},
-        {"role": "user", "content": "Testing. Just say hi and nothing else."},
-    ]
-    data = {"messages": messages, "model": "gpt-4o-mini"}
-    response = requests.post(url, headers=headers, json=data)
+    data = {"messages": TEST_MESSAGES, "model": TEST_MODEL}
+    response = http_client.post(url, headers=headers, data=codec.dumps(data))
     response.raise_for_status()
-    return response.json()
+    return codec.loads(response.content)
 
 
-def openai_chat_completion_for_chat(messages: list):
+@metrics.timed_call("openai_chat_completion_for_chat")
+def openai_chat_completion_for_chat(payload: dict):
     """
-    Make chat completion request to the target API and format the response to resemble OpenAI's.
+    Make the client's chat completion request (payload, model already resolved through the
+    router's aliases) to the target API and bring the response into OpenAI's shape with the
+    upstream's transform chain. The request is routed to the best available upstream serving
+    the model, through the dispatcher when settings.DISPATCHER_ENABLED is set.
     """
-    url = f"{TARGET_API_BASE_URL}/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {TARGET_API_KEY}",
-    }
-    data = {"messages": messages, "model": "llama-3.3-70b-versatile"}
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    
-    # Get the original response from the target API
-    original_response = response.json()
-
-    # Create a new, formatted response that mimics the OpenAI structure
-    formatted_response = {
-        "id": original_response.get("id"),
-        "object": "chat.completion",
-        "created": original_response.get("created"),
-        "model": original_response.get("model"),
-        "choices": original_response.get("choices"),
-        "system_fingerprint": original_response.get("system_fingerprint")
-    }
-
-    # Re-format the usage object to match OpenAI's standard
-    if "usage" in original_response and original_response["usage"]:
-        original_usage = original_response["usage"]
-        formatted_response["usage"] = {
-            "prompt_tokens": original_usage.get("prompt_tokens"),
-            "completion_tokens": original_usage.get("completion_tokens"),
-            "total_tokens": original_usage.get("total_tokens")
-        }
+    data = dict(payload, stream=False)
+    if not data.get("model"):
+        data["model"] = DEFAULT_TARGET_MODEL
+    if settings.DISPATCHER_ENABLED:
+        upstream, result = dispatcher.submit(data).result()
     else:
-        formatted_response["usage"] = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0
-        }
-        
-    return formatted_response 
+        upstream, result = router.complete(data)
+    metrics.observe_usage(result.get("usage"))
+    return upstream.transforms.completion(result)
 
 
+@metrics.timed_call("openai_chat_completion_stream")
 def openai_chat_completion_stream():
-    """Make OpenAI chat completion streaming request"""
+    """
+    Make OpenAI chat completion streaming request.
+    Returns a generator of the response lines; close() it to close the response early.
+    """
     url = "https://api.openai.com/v1/chat/completions"
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
     }
-    messages = [
-        {"role": "system", "content": "You are a test assistant."},
-        {"role": "user", "content": "Testing. Just say hi and nothing else."},
-    ]
-    data = {"messages": messages, "model": "gpt-4o-mini", "stream": True}
-    response = requests.post(url, headers=headers, json=data, stream=True)
+    data = {"messages": TEST_MESSAGES, "model": TEST_MODEL, "stream": True}
+    response = http_client.post(url, headers=headers, data=codec.dumps(data), stream=True)
     response.raise_for_status()
-    return response.iter_lines()
+    return _lines(response)
+
+
+def _lines(response):
+    """Iterate a streaming response's lines; closing the generator closes the response."""
+    try:
+        yield from response.iter_lines()
+    finally:
+        response.close()
 
 
-def openai_chat_completion_for_chat_stream(payload: dict):
+@metrics.timed_call("openai_chat_completion_for_chat_stream")
+def openai_chat_completion_for_chat_stream(payload: dict, body: bytes = None):
     """
-    Make a streaming chat completion request to the target API.
-    Returns the raw response object for manual stream handling.
+    Make a streaming chat completion request to the target API, failing over between
+    upstreams until one starts streaming, and hedging a slow start when settings.HEDGE_ENABLED
+    is set. When body holds the client's original request bytes, they are forwarded with only
+    model/stream patched instead of re-serializing payload.
+    Returns a router.UpstreamStream: iterate it for the body chunks, close() it when done.
     """
-    url = f"{TARGET_API_BASE_URL}/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {TARGET_API_KEY}",
-    }
-
     payload["stream"] = True
-    if "model" not in payload:
-        payload["model"] = "llama-3.3-70b-versatile"
-
-    # url = "https://api.openai.com/v1/chat/completions"
-    # headers = {
-    #     "Content-Type": "application/json",
-    #     "Authorization": f"Bearer {OPENAI_API_KEY}",
-    # }
-    # payload["model"] = "gpt-4o-mini"
-
+    if not payload.get("model"):
+        payload["model"] = DEFAULT_TARGET_MODEL
 
-
-    response = requests.post(url, headers=headers, json=payload, stream=True)
-    response.raise_for_status()
-    return response 
\ No newline at end of file
+    if settings.HEDGE_ENABLED:
+        return hedging.open_stream(payload, body)
+    return router.open_stream(payload, body)
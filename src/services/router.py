@@ -0,0 +1,558 @@
+"""
+Routes chat completions across several OpenAI-compatible upstreams.
+
+Upstreams are picked by least outstanding requests or by latency-weighted load, skipping
+any whose circuit is open after repeated failures. A failed connect, a retryable status
+or an error before the first body byte moves the request to the next candidate, so
+failover is invisible to the client.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+from src import codec, config, metrics
+from src.json_patch import patch_fields
+from src.transforms import TransformChain
+from src.services import http_client
+from src.services.async_http_client import get_client
+from src.config import settings
+
+# Statuses that say "try another upstream" rather than "your request is wrong".
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Top-level fields the proxy may override when forwarding a client's original body.
+PATCHED_FIELDS = ("model", "stream")
+# Weight of the newest sample in the latency moving averages.
+_EWMA_ALPHA = 0.2
+
+
+class NoUpstreamAvailable(Exception):
+    pass
+
+
+class RetryableUpstreamError(Exception):
+    pass
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class Upstream:
+    def __init__(self, name, base_url, api_key, models=None, model_map=None, weight=1.0, max_concurrency=0,
+                 transforms=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.models = set(models) if models else None
+        self.model_map = model_map or {}
+        self.weight = float(weight)
+        # Cap on concurrent requests from the dispatcher (0: unlimited).
+        self.max_concurrency = int(max_concurrency)
+        # Response transform chain, compiled once here rather than per response.
+        self.transforms = transforms or TransformChain()
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.ttft_ewma = None
+        self.duration_ewma = None
+        self.ttfts = deque(maxlen=512)
+
+    @property
+    def host(self):
+        return urlsplit(self.base_url).hostname
+
+    @property
+    def completions_url(self):
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def headers(self):
+        return {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+
+    def serves(self, model):
+        return self.models is None or model in self.models or model in self.model_map
+
+    def prepare(self, payload):
+        """Payload with the model renamed for this upstream, if it uses a different id."""
+        model = payload.get("model")
+        if model in self.model_map:
+            return dict(payload, model=self.model_map[model])
+        return payload
+
+    def encode(self, payload, body=None):
+        """
+        Request bytes for this upstream. Given the client's original body, only the fields
+        the proxy overrides are patched into it; otherwise payload is serialized.
+        """
+        payload = self.prepare(payload)
+        if body is None:
+            return codec.dumps(payload)
+        return patch_fields(body, {key: payload[key] for key in PATCHED_FIELDS if key in payload})
+
+    def circuit_state(self, now):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at < settings.CIRCUIT_COOLDOWN:
+            return "open"
+        return "half_open"
+
+    def update_from(self, other):
+        """Take other's configuration, keeping this upstream's counters and health."""
+        for field in ("base_url", "api_key", "models", "model_map", "weight", "max_concurrency", "transforms"):
+            setattr(self, field, getattr(other, field))
+
+    def stats(self, now):
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "circuit": self.circuit_state(now),
+            "outstanding": self.outstanding,
+            "max_concurrency": self.max_concurrency or None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ttft_ewma_ms": self.ttft_ewma * 1000 if self.ttft_ewma is not None else None,
+            "ttft_p50_ms": _ms(_percentile(self.ttfts, 50)),
+            "ttft_p95_ms": _ms(_percentile(self.ttfts, 95)),
+            "ttft_p99_ms": _ms(_percentile(self.ttfts, 99)),
+            "duration_ewma_ms": self.duration_ewma * 1000 if self.duration_ewma is not None else None,
+        }
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+def _ewma(current, sample):
+    return sample if current is None else current + _EWMA_ALPHA * (sample - current)
+
+
+class Router:
+    def __init__(self, upstreams, aliases=None, strategy="least_outstanding"):
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.upstreams = upstreams
+        self.aliases = aliases or {}
+        self.strategy = strategy
+        self._lock = threading.Lock()
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def reconfigure(self, upstreams, aliases=None, strategy="least_outstanding"):
+        """
+        Switch to a new upstream list. Upstreams that keep their name keep their object,
+        so requests in flight on them are still accounted for.
+        """
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        with self._lock:
+            current = {upstream.name: upstream for upstream in self.upstreams}
+            merged = []
+            for upstream in upstreams:
+                existing = current.get(upstream.name)
+                if existing is not None:
+                    existing.update_from(upstream)
+                    upstream = existing
+                merged.append(upstream)
+            self.upstreams = merged
+            self.aliases = aliases or {}
+            self.strategy = strategy
+
+    def resolve_model(self, requested):
+        return self.aliases.get(requested) or self.aliases.get("*") or requested
+
+    def _load(self, upstream):
+        if self.strategy == "latency":
+            # Expected wait: typical TTFT scaled by queue depth. Unmeasured upstreams get probed first.
+            return (upstream.ttft_ewma or 0.0) * (upstream.outstanding + 1) / upstream.weight
+        return upstream.outstanding / upstream.weight
+
+    def candidates(self, model):
+        """Upstreams able to serve model, best first; open circuits are skipped."""
+        now = time.monotonic()
+        with self._lock:
+            usable = [
+                u for u in self.upstreams
+                if u.serves(model) and (
+                    u.circuit_state(now) == "closed"
+                    or (u.circuit_state(now) == "half_open" and not u.trial_in_flight)
+                )
+            ]
+            return sorted(usable, key=lambda u: (self._load(u), u.ttft_ewma or 0.0))
+
+    def begin(self, upstream):
+        """Count a request starting on upstream; returns True if it is the half-open circuit's trial."""
+        with self._lock:
+            upstream.outstanding += 1
+            upstream.requests += 1
+            trial = upstream.circuit_state(time.monotonic()) == "half_open" and not upstream.trial_in_flight
+            if trial:
+                upstream.trial_in_flight = True
+            return trial
+
+    def ttft_percentile(self, upstream, pct, min_samples=1):
+        """The upstream's recent TTFT at percentile pct, or None with fewer than min_samples."""
+        with self._lock:
+            samples = list(upstream.ttfts)
+        return _percentile(samples, pct) if len(samples) >= min_samples else None
+
+    def first_byte(self, upstream, ttft):
+        metrics.UPSTREAM_TTFT.observe(ttft, upstream.name)
+        with self._lock:
+            upstream.ttft_ewma = _ewma(upstream.ttft_ewma, ttft)
+            upstream.ttfts.append(ttft)
+
+    def end(self, upstream, ok, duration=None, trial=False):
+        """Settle a request begin() counted; trial is what begin() returned for it."""
+        if not ok:
+            metrics.UPSTREAM_FAILURES.inc(upstream.name)
+        elif duration is not None:
+            metrics.UPSTREAM_DURATION.observe(duration, upstream.name)
+        with self._lock:
+            upstream.outstanding -= 1
+            if trial:
+                # Only the trial's own outcome may let the next one through.
+                upstream.trial_in_flight = False
+            if ok:
+                upstream.consecutive_failures = 0
+                upstream.opened_at = None
+                if duration is not None:
+                    upstream.duration_ewma = _ewma(upstream.duration_ewma, duration)
+            else:
+                upstream.failures += 1
+                upstream.consecutive_failures += 1
+                if upstream.opened_at is not None or upstream.consecutive_failures >= settings.CIRCUIT_FAILURE_THRESHOLD:
+                    # (Re)open: either the threshold was hit or the half-open trial failed.
+                    upstream.opened_at = time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "aliases": self.aliases,
+                "pid": os.getpid(),
+                "upstreams": [u.stats(now) for u in self.upstreams],
+            }
+
+
+def _check_status(status_code, upstream):
+    if status_code in RETRYABLE_STATUSES:
+        raise RetryableUpstreamError(f"{upstream.name} returned HTTP {status_code}")
+
+
+class UpstreamStream:
+    """
+    An upstream streaming response whose first chunk has already been read. Iterating
+    yields the body; the router's bookkeeping is settled when iteration ends or close() is called.
+    """
+
+    def __init__(self, router, upstream, response, chunks, first, started, trial=False):
+        self.router = router
+        self.upstream = upstream
+        self.response = response
+        self._chunks = chunks
+        self._first = first
+        self._started = started
+        self._trial = trial
+        self._done = False
+        self._aborted = False
+
+    def __iter__(self):
+        # Stopping early (GeneratorExit) is the consumer's choice, not an upstream failure.
+        try:
+            if self._first:
+                yield self._first
+            yield from self._chunks
+        except Exception:
+            # A read failing because abort() cut the connection isn't the upstream's fault either.
+            self._finish(self._aborted)
+            raise
+        finally:
+            self._finish(True)
+
+    def _finish(self, ok):
+        if not self._done:
+            self._done = True
+            self.response.close()
+            self.router.end(self.upstream, ok, time.monotonic() - self._started, self._trial)
+
+    def close(self):
+        # Closed early (e.g. client went away): not the upstream's fault.
+        self._finish(True)
+
+    def abort(self):
+        """
+        Cut the upstream connection from another thread (the stream watchdog): a read
+        blocked on it fails at once. The iterating thread still has to close().
+        """
+        self._aborted = True
+        abort_response(self.response)
+
+
+def abort_response(response):
+    """Shut down a requests response's socket, so a read blocked on it in another thread fails."""
+    sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+    if sock is not None:
+        try:
+            # Plain socket shutdown: it wakes the blocked reader, TLS or not.
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class AsyncUpstreamStream(UpstreamStream):
+    async def __aiter__(self):
+        try:
+            if self._first:
+                yield self._first
+            async for chunk in self._chunks:
+                yield chunk
+        except Exception:
+            await self._afinish(False)
+            raise
+        finally:
+            await self._afinish(True)
+
+    async def _afinish(self, ok):
+        if not self._done:
+            self._done = True
+            try:
+                await self.response.aclose()
+            finally:
+                # Runs even if a cancelled task (client disconnect) is cancelled again while closing.
+                self.router.end(self.upstream, ok, time.monotonic() - self._started, self._trial)
+
+    async def aclose(self):
+        await self._afinish(True)
+
+
+FAILOVER_ERRORS = (requests.ConnectionError, requests.Timeout, RetryableUpstreamError, StopIteration)
+ASYNC_FAILOVER_ERRORS = (httpx.TransportError, RetryableUpstreamError, StopAsyncIteration)
+
+
+def open_stream(payload, body=None, router=None, upstreams=None, attempt=None):
+    """
+    Open a streaming completion on the best available upstream, failing over until one
+    produces its first body chunk. Returns an UpstreamStream. If body (the client's
+    original request bytes) is given, it is forwarded with only model/stream patched.
+    upstreams, if given, replaces the router's candidate list. attempt, if given, is the
+    hedging attempt making this call: each response is passed to attempt.watch() as soon
+    as it is open, and once attempt.cancelled is set no further upstream is tried.
+    """
+    router = router or default_router
+    model = payload.get("model")
+    errors = []
+    for upstream in upstreams or router.candidates(model):
+        if attempt is not None and attempt.cancelled:
+            break
+        started = time.monotonic()
+        trial = router.begin(upstream)
+        response = None
+        try:
+            response = http_client.post(
+                upstream.completions_url, headers=upstream.headers, data=upstream.encode(payload, body), stream=True
+            )
+            if attempt is not None:
+                attempt.watch(response)
+            _check_status(response.status_code, upstream)
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=None)
+            first = next(chunks)
+        except FAILOVER_ERRORS as e:
+            if response is not None:
+                response.close()
+            # A hedging attempt that lost is cut off on purpose: not the upstream's fault.
+            router.end(upstream, ok=attempt is not None and attempt.cancelled, trial=trial)
+            errors.append(f"{upstream.name}: {e or type(e).__name__}")
+            continue
+        except BaseException:
+            # 4xx and the like: the request itself is at fault, so don't fail over.
+            if response is not None:
+                response.close()
+            router.end(upstream, ok=True, trial=trial)
+            raise
+        router.first_byte(upstream, time.monotonic() - started)
+        return UpstreamStream(router, upstream, response, chunks, first, started, trial)
+    raise NoUpstreamAvailable(f"No upstream available for model {model!r}: {'; '.join(errors) or 'none configured'}")
+
+
+async def aopen_stream(payload, body=None, router=None, upstreams=None):
+    """
+    Async counterpart of open_stream(); returns an AsyncUpstreamStream. Cancelling the
+    task cancels the open without counting it against the upstream.
+    """
+    router = router or default_router
+    model = payload.get("model")
+    client = get_client()
+    errors = []
+    for upstream in upstreams or router.candidates(model):
+        started = time.monotonic()
+        trial = router.begin(upstream)
+        response = None
+        try:
+            request = client.build_request(
+                "POST", upstream.completions_url, headers=upstream.headers, content=upstream.encode(payload, body),
+                extensions={"trace": metrics.httpx_trace(upstream.host)},
+            )
+            response = await client.send(request, stream=True)
+            _check_status(response.status_code, upstream)
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            chunks = response.aiter_bytes()
+            first = await chunks.__anext__()
+        except ASYNC_FAILOVER_ERRORS as e:
+            if response is not None:
+                await response.aclose()
+            router.end(upstream, ok=False, trial=trial)
+            errors.append(f"{upstream.name}: {e or type(e).__name__}")
+            continue
+        except BaseException:
+            # As in open_stream(), plus cancellation (client gone, or a hedge that lost).
+            try:
+                if response is not None:
+                    await response.aclose()
+            finally:
+                router.end(upstream, ok=True, trial=trial)
+            raise
+        router.first_byte(upstream, time.monotonic() - started)
+        return AsyncUpstreamStream(router, upstream, response, chunks, first, started, trial)
+    raise NoUpstreamAvailable(f"No upstream available for model {model!r}: {'; '.join(errors) or 'none configured'}")
+
+
+def complete(payload, router=None, upstreams=None):
+    """
+    Non-streaming completion with the same failover rules. Returns (upstream, response JSON).
+    upstreams, if given, replaces the router's candidate list.
+    """
+    router = router or default_router
+    model = payload.get("model")
+    errors = []
+    for upstream in upstreams or router.candidates(model):
+        started = time.monotonic()
+        trial = router.begin(upstream)
+        try:
+            response = http_client.post(upstream.completions_url, headers=upstream.headers, data=upstream.encode(payload))
+            _check_status(response.status_code, upstream)
+            response.raise_for_status()
+            result = codec.loads(response.content)
+        except FAILOVER_ERRORS as e:
+            router.end(upstream, ok=False, trial=trial)
+            errors.append(f"{upstream.name}: {e or type(e).__name__}")
+            continue
+        except Exception:
+            router.end(upstream, ok=True, trial=trial)
+            raise
+        elapsed = time.monotonic() - started
+        router.first_byte(upstream, elapsed)
+        router.end(upstream, ok=True, duration=elapsed, trial=trial)
+        return upstream, result
+    raise NoUpstreamAvailable(f"No upstream available for model {model!r}: {'; '.join(errors) or 'none configured'}")
+
+
+async def acomplete(payload, router=None):
+    """Async counterpart of complete()."""
+    router = router or default_router
+    model = payload.get("model")
+    client = get_client()
+    errors = []
+    for upstream in router.candidates(model):
+        started = time.monotonic()
+        trial = router.begin(upstream)
+        try:
+            response = await client.post(
+                upstream.completions_url, headers=upstream.headers, content=upstream.encode(payload),
+                extensions={"trace": metrics.httpx_trace(upstream.host)},
+            )
+            _check_status(response.status_code, upstream)
+            response.raise_for_status()
+            result = codec.loads(response.content)
+        except ASYNC_FAILOVER_ERRORS as e:
+            router.end(upstream, ok=False, trial=trial)
+            errors.append(f"{upstream.name}: {e or type(e).__name__}")
+            continue
+        except Exception:
+            router.end(upstream, ok=True, trial=trial)
+            raise
+        elapsed = time.monotonic() - started
+        router.first_byte(upstream, elapsed)
+        router.end(upstream, ok=True, duration=elapsed, trial=trial)
+        return upstream, result
+    raise NoUpstreamAvailable(f"No upstream available for model {model!r}: {'; '.join(errors) or 'none configured'}")
+
+
+def router_settings():
+    """(upstreams, aliases, strategy) from UPSTREAMS, or TARGET_API_BASE_URL as the only upstream."""
+    transforms = json.loads(settings.RESPONSE_TRANSFORMS) if settings.RESPONSE_TRANSFORMS else {}
+    if settings.UPSTREAMS:
+        upstreams = [
+            Upstream(
+                name=u.get("name") or u["base_url"],
+                base_url=u["base_url"],
+                api_key=u.get("api_key") or (settings.get(u["api_key_env"]) if u.get("api_key_env") else None),
+                models=u.get("models"),
+                model_map=u.get("model_map"),
+                weight=u.get("weight", 1.0),
+                max_concurrency=u.get("max_concurrency", settings.UPSTREAM_MAX_CONCURRENCY),
+                transforms=TransformChain.from_specs(transforms, u.get("transforms")),
+            )
+            for u in json.loads(settings.UPSTREAMS)
+        ]
+    elif settings.TARGET_API_BASE_URL:
+        upstreams = [Upstream("target", settings.TARGET_API_BASE_URL, settings.TARGET_API_KEY,
+                              max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+                              transforms=TransformChain(transforms))]
+    else:
+        upstreams = []
+    aliases = json.loads(settings.MODEL_ALIASES) if settings.MODEL_ALIASES else {}
+    return upstreams, aliases, settings.ROUTING_STRATEGY
+
+
+def build_router():
+    return Router(*router_settings())
+
+
+default_router = build_router()
+
+
+def _reset_after_fork():
+    # One hook for the shared router; a per-instance hook would keep every Router alive.
+    default_router._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@config.on_reload
+def _apply_settings(changed):
+    # Any change may touch an upstream's api_key_env variable, so always rebuild; it's cheap.
+    default_router.reconfigure(*router_settings())
+
+
+def _collect_router():
+    stats = default_router.stats()
+    for upstream in stats["upstreams"]:
+        labels = {"upstream": upstream["name"]}
+        yield ("bridgeai_upstream_outstanding", "gauge", "In-flight requests per upstream.",
+               labels, upstream["outstanding"])
+        yield ("bridgeai_upstream_circuit_open", "gauge", "1 while the upstream's circuit is open.",
+               labels, 1 if upstream["circuit"] == "open" else 0)
+
+
+metrics.register_collector(_collect_router)
@@ -0,0 +1,229 @@
+import json
+import re
+
+from src import codec
+
+DONE = b"[DONE]"
+
+# Compact the parser buffer once the consumed prefix is at least this large.
+_COMPACT_THRESHOLD = 64 * 1024
+
+_json_decoder = json.JSONDecoder()
+
+
+class SSEParser:
+    """
+    Incremental Server-Sent Events parser.
+
+    Bytes are appended to a single bytearray and events are sliced out through a
+    memoryview at an advancing offset, so the unconsumed tail is never re-copied.
+    Accepts "\\n", "\\r\\n" and "\\r" line endings and joins multi-line "data:" fields.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._scan = 0
+        self._skip_lf = False
+
+    def feed(self, chunk):
+        """Append a chunk of bytes and return the data payloads of every completed event."""
+        if self._skip_lf:
+            # The previous chunk ended in "\r", already taken as a line end: this "\n" completes it.
+            self._skip_lf = False
+            if chunk.startswith(b"\n"):
+                chunk = chunk[1:]
+        if b"\r" in chunk:
+            self._skip_lf = chunk.endswith(b"\r")
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        buf = self._buf
+        buf += chunk
+        pos = self._pos
+        events = []
+        # Resume the boundary search where the previous feed stopped.
+        end = buf.find(b"\n\n", self._scan)
+        if end < 0:
+            self._scan = max(pos, len(buf) - 1)
+            return events
+
+        view = memoryview(buf)
+        try:
+            while end >= 0:
+                data = self._event_data(buf, view, pos, end)
+                if data is not None:
+                    events.append(data)
+                pos = end + 2
+                end = buf.find(b"\n\n", pos)
+        finally:
+            view.release()
+
+        if pos >= _COMPACT_THRESHOLD or pos == len(buf):
+            del buf[:pos]
+            pos = 0
+        self._pos = pos
+        self._scan = max(pos, len(buf) - 1)
+        return events
+
+    @staticmethod
+    def _event_data(buf, view, start, end):
+        # Fast path: a single "data: " line.
+        if buf.startswith(b"data: ", start) and buf.find(b"\n", start, end) < 0:
+            return bytes(view[start + 6:end])
+
+        data_lines = []
+        for line in bytes(view[start:end]).split(b"\n"):
+            if not line or line.startswith(b":"):
+                continue
+            field, _, value = line.partition(b":")
+            if field != b"data":
+                continue
+            if value.startswith(b" "):
+                value = value[1:]
+            data_lines.append(value)
+        if not data_lines:
+            return None
+        return b"\n".join(data_lines)
+
+    def events(self, chunks):
+        """Yield event payloads from an iterable of byte chunks."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+
+def _escaped(data, index):
+    """Return True if the byte at index is preceded by an odd number of backslashes."""
+    count = 0
+    index -= 1
+    while index >= 0 and data[index] == 0x5C:
+        count += 1
+        index -= 1
+    return count % 2 == 1
+
+
+def _top_level_key(data, pattern):
+    """
+    Locate the only top-level occurrence of a key in a JSON object.
+
+    Returns the regex match, None if the key is absent, or False if the position
+    is ambiguous and the caller should fall back to a full JSON round trip.
+    """
+    found = None
+    for match in pattern.finditer(data):
+        start = match.start()
+        if _escaped(data, start):
+            continue
+        if found is not None:
+            return False
+        found = match
+    if found is None:
+        return None
+    prefix = data[:found.start()]
+    if b"\\" in prefix or prefix.count(b"{") - prefix.count(b"}") != 1:
+        return False
+    return found
+
+
+class ChunkRewriter:
+    """
+    Rewrites chat-completion chunk JSON: replaces top-level string fields and drops
+    top-level fields by splicing bytes, falling back to json when that is not safe.
+    """
+
+    def __init__(self, set_fields=None, drop_fields=()):
+        self.set_fields = dict(set_fields or {})
+        self.drop_fields = tuple(drop_fields)
+        self._set = [
+            (
+                re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*"(?:[^"\\]|\\.)*"'),
+                b'"' + key.encode() + b'":' + json.dumps(value).encode(),
+            )
+            for key, value in self.set_fields.items()
+        ]
+        self._drop = [
+            (key.encode(), re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:'))
+            for key in self.drop_fields
+        ]
+        self.fast = 0
+        self.fallback = 0
+
+    def __call__(self, data):
+        result = self._splice(data)
+        if result is None:
+            self.fallback += 1
+            return self._round_trip(data)
+        self.fast += 1
+        return result
+
+    def _splice(self, data):
+        data = bytes(data)
+        for pattern, replacement in self._set:
+            match = _top_level_key(data, pattern)
+            if not match:
+                return None
+            data = data[:match.start()] + replacement + data[match.end():]
+        for key, pattern in self._drop:
+            if key not in data:
+                continue
+            match = _top_level_key(data, pattern)
+            if match is None:
+                continue
+            if match is False:
+                return None
+            data = self._drop_member(data, match)
+            if data is None:
+                return None
+        return data
+
+    @staticmethod
+    def _drop_member(data, match):
+        value_start = match.end()
+        try:
+            text = data[value_start:].decode("utf-8")
+            stripped = text.lstrip()
+            _, length = _json_decoder.raw_decode(stripped)
+        except ValueError:
+            return None
+        consumed = len(text) - len(stripped) + length
+        value_end = value_start + len(text[:consumed].encode("utf-8"))
+
+        start = match.start()
+        head = data[:start].rstrip()
+        if head.endswith(b","):
+            return head[:-1] + data[value_end:]
+        tail = data[value_end:].lstrip()
+        if tail.startswith(b","):
+            return data[:start] + tail[1:].lstrip()
+        return data[:start] + data[value_end:]
+
+    def _round_trip(self, data):
+        json_chunk = codec.loads(data)
+        json_chunk.update(self.set_fields)
+        for key in self.drop_fields:
+            json_chunk.pop(key, None)
+        return codec.dumps(json_chunk)
+
+
+def relay(chunks, rewrite):
+    """
+    Re-frame an upstream SSE byte stream, yielding one rewritten "data: ...\\n\\n"
+    event at a time and stopping after the "[DONE]" sentinel.
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        for data in parser.feed(chunk):
+            if data.strip() == DONE:
+                yield b"data: [DONE]\n\n"
+                return
+            yield b"data: " + rewrite(data) + b"\n\n"
+
+
+async def arelay(chunks, rewrite):
+    """Async variant of relay() for an async iterable of byte chunks."""
+    parser = SSEParser()
+    async for chunk in chunks:
+        for data in parser.feed(chunk):
+            if data.strip() == DONE:
+                yield b"data: [DONE]\n\n"
+                return
+            yield b"data: " + rewrite(data) + b"\n\n"
@@ -0,0 +1,134 @@
+"""
+Rebuilds a chat.completion from the chunks of a streamed one, as they are relayed.
+
+Each event is parsed once and folded into per-choice state: content, reasoning and tool
+call arguments are kept as lists of fragments and joined only at the end, so the cost per
+chunk doesn't grow with the length of the reply and the raw events are never kept. Usage
+comes from the final chunk, either top-level (stream_options.include_usage) or inside
+Groq's x_groq.
+"""
+from src import codec
+
+
+class _Choice:
+    __slots__ = ("role", "content", "reasoning", "refusal", "tool_calls", "finish_reason")
+
+    def __init__(self):
+        self.role = None
+        self.content = []
+        self.reasoning = []
+        self.refusal = []
+        self.tool_calls = {}
+        self.finish_reason = None
+
+    def feed(self, delta):
+        if delta.get("role"):
+            self.role = delta["role"]
+        if delta.get("content"):
+            self.content.append(delta["content"])
+        # Groq sends reasoning as "reasoning", DeepSeek-style APIs as "reasoning_content".
+        reasoning = delta.get("reasoning") or delta.get("reasoning_content")
+        if reasoning:
+            self.reasoning.append(reasoning)
+        if delta.get("refusal"):
+            self.refusal.append(delta["refusal"])
+        for call in delta.get("tool_calls") or ():
+            state = self.tool_calls.get(call.get("index", 0))
+            if state is None:
+                state = self.tool_calls[call.get("index", 0)] = {"id": None, "type": "function", "name": None,
+                                                                 "arguments": []}
+            function = call.get("function") or {}
+            if call.get("id"):
+                state["id"] = call["id"]
+            if call.get("type"):
+                state["type"] = call["type"]
+            if function.get("name"):
+                state["name"] = function["name"]
+            if function.get("arguments"):
+                state["arguments"].append(function["arguments"])
+
+    def message(self):
+        message = {"role": self.role or "assistant", "content": "".join(self.content)}
+        if self.reasoning:
+            message["reasoning_content"] = "".join(self.reasoning)
+        if self.refusal:
+            message["refusal"] = "".join(self.refusal)
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {"id": call["id"], "type": call["type"],
+                 "function": {"name": call["name"], "arguments": "".join(call["arguments"])}}
+                for _, call in sorted(self.tool_calls.items())
+            ]
+        return message
+
+
+class CompletionAccumulator:
+    """Feed it each event's data as relayed; completion() is the chat.completion streamed so far."""
+
+    def __init__(self):
+        self.id = None
+        self.created = None
+        self.model = None
+        self.system_fingerprint = None
+        self.usage = None
+        self.error = None
+        self.events = 0
+        self.invalid = 0
+        self._choices = {}
+
+    def feed(self, data):
+        self.events += 1
+        try:
+            chunk = codec.decode_chunk(data)
+        except ValueError:
+            self.invalid += 1
+            return
+        if self.id is None:
+            self.id = chunk.get("id")
+            self.created = chunk.get("created")
+            self.model = chunk.get("model")
+        if chunk.get("system_fingerprint"):
+            self.system_fingerprint = chunk["system_fingerprint"]
+        if chunk.get("error"):
+            self.error = chunk["error"]
+        usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+        if usage:
+            self.usage = usage
+        for choice in chunk.get("choices") or ():
+            index = choice.get("index", 0)
+            state = self._choices.get(index)
+            if state is None:
+                state = self._choices[index] = _Choice()
+            state.feed(choice.get("delta") or {})
+            if choice.get("finish_reason"):
+                state.finish_reason = choice["finish_reason"]
+
+    @property
+    def finished(self):
+        """True once every choice has a finish_reason, i.e. the reply is complete."""
+        return bool(self._choices) and self.error is None and all(
+            choice.finish_reason is not None for choice in self._choices.values()
+        )
+
+    @property
+    def content(self):
+        """The first choice's text so far."""
+        choice = self._choices.get(0)
+        return "".join(choice.content) if choice is not None else ""
+
+    def completion(self):
+        completion = {
+            "id": self.id,
+            "object": "chat.completion",
+            "created": self.created,
+            "model": self.model,
+            "system_fingerprint": self.system_fingerprint,
+            "choices": [
+                {"index": index, "message": choice.message(), "finish_reason": choice.finish_reason}
+                for index, choice in sorted(self._choices.items())
+            ],
+            "usage": self.usage,
+        }
+        if self.error is not None:
+            completion["error"] = self.error
+        return completion
@@ -0,0 +1,187 @@
+"""
+Cancellation for proxied completion streams.
+
+A stream is cut short when its client goes away or it runs past STREAM_MAX_SECONDS,
+so a disconnected Cursor or browser tab doesn't keep a worker reading tokens nobody
+will see. The deadline is checked on every upstream chunk. Under gunicorn a watchdog
+thread per process also polls each stream's client socket and the deadlines every
+_CHECK_INTERVAL, and aborts the upstream connection of a cancelled stream so a read
+blocked on it fails at once instead of at the next chunk or the read timeout. There is
+no connection to abort while the stream is still being opened: that phase is bounded
+only by the upstream connect and read timeouts.
+
+On the event loop, Starlette already cancels the response task when the client
+disconnects; the deadline cancels the task too, but only while it is waiting on the
+upstream, never while it is sending to the client.
+"""
+import asyncio
+import os
+import select
+import socket
+import threading
+import time
+
+from src import metrics
+from src.config import settings
+
+_CHECK_INTERVAL = 0.5
+
+STREAMS_CANCELLED = metrics.Counter("bridgeai_streams_cancelled_total", "Proxied streams cut short.", ("reason",))
+
+_watched = set()
+_lock = threading.Lock()
+_watchdog_pid = None
+
+
+class StreamCancelled(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Stream cancelled: {reason}")
+        self.reason = reason
+
+
+def client_gone(sock):
+    """True if the peer has closed sock. Never blocks; pipelined request bytes count as alive."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class StreamGuard:
+    """
+    Watches one stream. Iterate the upstream chunks through iter()/aiter(); once the
+    stream is cancelled they raise StreamCancelled. abort, if set, is called from the
+    watchdog thread to interrupt a read blocked on the upstream. events is the count of
+    events relayed so far, for the partial token count of a cancelled stream.
+    """
+
+    def __init__(self, client_socket=None, max_seconds=None):
+        max_seconds = settings.STREAM_MAX_SECONDS if max_seconds is None else max_seconds
+        self.started = time.monotonic()
+        self.max_seconds = max_seconds
+        self.deadline = self.started + max_seconds if max_seconds > 0 else None
+        self.client_socket = client_socket
+        self.reason = None
+        self.events = 0
+        self.abort = None
+        self._task = None
+        self._reading = False
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def cancel(self, reason):
+        """Mark the stream cancelled (the first reason wins) and interrupt a blocked upstream read."""
+        if self.reason is not None:
+            return
+        self.reason = reason
+        if self.abort is not None:
+            self.abort()
+        if self._task is not None and self._reading:
+            self._task.cancel()
+
+    def check(self):
+        if self.reason is not None:
+            return
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("max_duration")
+        elif self.client_socket is not None and client_gone(self.client_socket):
+            self.cancel("client_disconnect")
+
+    def watch(self):
+        """Have the watchdog check this stream until close()."""
+        if self.deadline is None and self.client_socket is None:
+            return
+        _start_watchdog()
+        with _lock:
+            _watched.add(self)
+
+    def close(self):
+        with _lock:
+            _watched.discard(self)
+
+    def iter(self, chunks):
+        """Yield chunks until the stream ends or is cancelled."""
+        deadline = self.deadline
+        try:
+            for chunk in chunks:
+                if deadline is not None and self.reason is None and time.monotonic() > deadline:
+                    self.reason = "max_duration"
+                if self.reason is not None:
+                    raise StreamCancelled(self.reason)
+                yield chunk
+        except StreamCancelled:
+            raise
+        except Exception:
+            # The watchdog aborted the upstream under us.
+            if self.reason is None:
+                raise
+            raise StreamCancelled(self.reason) from None
+
+    async def aiter(self, chunks):
+        """
+        Async iter(). The deadline cancels the task waiting on the upstream, which need not
+        be the one that started iterating (acoalesce() reads ahead in a task of its own).
+        """
+        timer = None
+        if self.deadline is not None:
+            timer = asyncio.get_running_loop().call_later(self.max_seconds, self.cancel, "max_duration")
+        chunks = chunks.__aiter__()
+        try:
+            while True:
+                if self.reason is not None:
+                    raise StreamCancelled(self.reason)
+                self._task = asyncio.current_task()
+                self._reading = True
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    if self.reason is None:
+                        raise
+                    self._task.uncancel()
+                    raise StreamCancelled(self.reason) from None
+                finally:
+                    self._reading = False
+                yield chunk
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+
+def _watch():
+    while True:
+        time.sleep(_CHECK_INTERVAL)
+        with _lock:
+            guards = list(_watched)
+        for guard in guards:
+            try:
+                guard.check()
+            except Exception:
+                pass
+
+
+def _start_watchdog():
+    global _watchdog_pid
+    with _lock:
+        if _watchdog_pid != os.getpid():
+            _watchdog_pid = os.getpid()
+            threading.Thread(target=_watch, name="stream-watchdog", daemon=True).start()
+
+
+def _reset_after_fork():
+    # The parent's watchdog and streams stay with the parent; the child starts its own on first use.
+    global _lock
+    _lock = threading.Lock()
+    _watched.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,228 @@
+"""
+Per-upstream response transforms: bring a provider's completions into OpenAI's shape.
+
+A chain is compiled once per upstream when the router is configured, from the
+upstream's "transforms" entry in UPSTREAMS on top of RESPONSE_TRANSFORMS:
+
+  set                top-level fields to overwrite, e.g. {"model": "gpt-4o-mini"}
+  drop               top-level fields to remove, e.g. ["x_groq"]
+  rename             message (and stream delta) fields to rename, e.g. {"reasoning": "reasoning_content"}
+  extract_reasoning  move a leading <think>...</think> block (deepseek-r1) out of the
+                     content into reasoning_content
+  normalize_usage    report usage as prompt/completion/total tokens, lifting Groq's
+                     x_groq.usage to the top level of the stream chunk that carries it
+
+The same chain applies to non-streaming completions (completion()) and to streams
+(stream(), one per stream since reasoning extraction spans chunks). In a stream, set and
+drop are spliced into the event bytes; an event is only decoded when it may need one of
+the other transforms: it contains a renamed field or "usage", or the reply hasn't got
+past its reasoning yet.
+"""
+import re
+
+from src import codec
+from src.sse import ChunkRewriter
+
+DEFAULT_TRANSFORMS = {
+    "set": {"model": "gpt-4o-mini"},
+    "drop": ["x_groq"],
+    "rename": {},
+    "extract_reasoning": False,
+    "normalize_usage": True,
+}
+
+REASONING_FIELD = "reasoning_content"
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+# Top-level fields of a chat.completion; anything else a provider adds is left out.
+COMPLETION_FIELDS = ("id", "created", "model", "choices", "system_fingerprint")
+
+_OPEN, _CLOSE = "<think>", "</think>"
+_LEADING_THINK = re.compile(r"\s*<think>(.*?)(?:</think>\s*|$)", re.DOTALL)
+
+
+def _partial_tag(text, tag):
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+def normalize_usage(usage):
+    return {field: usage.get(field) for field in USAGE_FIELDS}
+
+
+class TransformChain:
+    def __init__(self, spec=None):
+        spec = dict(DEFAULT_TRANSFORMS, **(spec or {}))
+        unknown = spec.keys() - DEFAULT_TRANSFORMS.keys()
+        if unknown:
+            raise ValueError(f"Unknown response transforms: {', '.join(sorted(unknown))}")
+        self.set_fields = dict(spec["set"] or {})
+        self.drop_fields = tuple(spec["drop"] or ())
+        self.renames = dict(spec["rename"] or {})
+        self.extract_reasoning = bool(spec["extract_reasoning"])
+        self.normalize_usage = bool(spec["normalize_usage"])
+        self._rewriter = ChunkRewriter(self.set_fields, self.drop_fields)
+        # Bytes that send an event down the decoding path.
+        needles = [b'"' + key.encode() + b'"' for key in self.renames]
+        if self.normalize_usage:
+            needles.append(b'"usage"')
+        self._needles = tuple(needles)
+
+    @classmethod
+    def from_specs(cls, *specs):
+        """A chain from specs layered left to right (later ones override earlier keys)."""
+        merged = {}
+        for spec in specs:
+            merged.update(spec or {})
+        return cls(merged)
+
+    def stream(self):
+        """A transform for the events of one stream: event data bytes in, bytes out."""
+        return StreamTransform(self)
+
+    def completion(self, result):
+        """A non-streaming completion in OpenAI's shape."""
+        completion = {"object": "chat.completion"}
+        completion.update((field, result.get(field)) for field in COMPLETION_FIELDS)
+        choices = []
+        for choice in result.get("choices") or ():
+            choice = dict(choice)
+            message = self._rename(dict(choice.get("message") or {}))
+            if self.extract_reasoning and isinstance(message.get("content"), str):
+                match = _LEADING_THINK.match(message["content"])
+                if match:
+                    message[REASONING_FIELD] = match.group(1).strip()
+                    message["content"] = message["content"][match.end():]
+            choice["message"] = message
+            choices.append(choice)
+        completion["choices"] = choices
+        usage = result.get("usage")
+        if self.normalize_usage:
+            usage = normalize_usage(usage or {field: 0 for field in USAGE_FIELDS})
+        completion["usage"] = usage
+        completion.update(self.set_fields)
+        for field in self.drop_fields:
+            completion.pop(field, None)
+        return completion
+
+    def _rename(self, fields):
+        for old, new in self.renames.items():
+            if old in fields:
+                fields[new] = fields.pop(old)
+        return fields
+
+
+class _Reasoning:
+    """Splits one choice's streamed content into reasoning and reply at the <think> tags."""
+
+    __slots__ = ("phase", "carry")
+
+    def __init__(self):
+        self.phase = "start"
+        self.carry = ""
+
+    def split(self, text):
+        """Return (reasoning, content) for the next piece of streamed content."""
+        text = self.carry + text
+        self.carry = ""
+        reasoning = ""
+        if self.phase == "start":
+            stripped = text.lstrip()
+            if stripped.startswith(_OPEN):
+                self.phase = "thinking"
+                text = stripped[len(_OPEN):]
+            elif not stripped or _OPEN.startswith(stripped):
+                # Not enough content yet to tell whether the reply opens with <think>.
+                self.carry = text
+                return "", ""
+            else:
+                self.phase = "done"
+                return "", text
+        if self.phase == "thinking":
+            end = text.find(_CLOSE)
+            if end < 0:
+                keep = _partial_tag(text, _CLOSE)
+                if keep:
+                    self.carry = text[-keep:]
+                    text = text[:-keep]
+                return text, ""
+            reasoning, text = text[:end], text[end + len(_CLOSE):]
+            self.phase = "after"
+        if self.phase == "after":
+            # The whitespace the model puts between </think> and the reply.
+            text = text.lstrip()
+            if text:
+                self.phase = "done"
+        return reasoning, text
+
+    def flush(self):
+        """(reasoning, content) still held back when the choice finishes."""
+        carry, self.carry = self.carry, ""
+        thinking = self.phase == "thinking"
+        self.phase = "done"
+        return (carry, "") if thinking else ("", carry)
+
+
+class StreamTransform:
+    """TransformChain.stream(): keeps the per-stream state reasoning extraction needs."""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self._splice = chain._rewriter
+        self._needles = chain._needles
+        self._reasoning = {}
+        # Decode every event until each choice is past its reasoning.
+        self._pending = chain.extract_reasoning
+
+    def __call__(self, data):
+        if not self._pending:
+            for needle in self._needles:
+                if needle in data:
+                    break
+            else:
+                return self._splice(data)
+        try:
+            chunk = codec.loads(data)
+        except ValueError:
+            return self._splice(data)
+        if not isinstance(chunk, dict):
+            return self._splice(data)
+
+        chain = self.chain
+        if chain.normalize_usage:
+            usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+            if usage:
+                chunk["usage"] = normalize_usage(usage)
+        for choice in chunk.get("choices") or ():
+            delta = choice.get("delta")
+            if isinstance(delta, dict):
+                chain._rename(delta)
+                if chain.extract_reasoning:
+                    self._extract(choice, delta)
+        if chain.extract_reasoning:
+            self._pending = not self._reasoning or any(
+                state.phase != "done" for state in self._reasoning.values()
+            )
+        chunk.update(chain.set_fields)
+        for field in chain.drop_fields:
+            chunk.pop(field, None)
+        return codec.dumps(chunk)
+
+    def _extract(self, choice, delta):
+        state = self._reasoning.get(choice.get("index", 0))
+        if state is None:
+            state = self._reasoning[choice.get("index", 0)] = _Reasoning()
+        if state.phase == "done":
+            return
+        text = delta.get("content")
+        reasoning, content = state.split(text) if isinstance(text, str) and text else ("", "")
+        if choice.get("finish_reason"):
+            held_reasoning, held_content = state.flush()
+            reasoning += held_reasoning
+            content += held_content
+        if isinstance(text, str) or content:
+            delta["content"] = content
+        if reasoning:
+            delta[REASONING_FIELD] = delta.get(REASONING_FIELD, "") + reasoning
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from src.admission import Admission, ApiKey, Rejected
+
+
+def make_admission(tmp_path, *keys, max_wait=0.1):
+    return Admission(list(keys), store_path=str(tmp_path / "quota.bin"), max_wait=max_wait)
+
+
+def test_busy_key_does_not_hold_up_others(tmp_path):
+    busy = ApiKey("busy", "t1", max_concurrent=1)
+    other = ApiKey("other", "t2", max_concurrent=1)
+    admission = make_admission(tmp_path, busy, other)
+    lease = admission.acquire(busy)
+    with pytest.raises(Rejected):
+        admission.acquire(busy)
+    admission.acquire(other).release()
+    lease.release()
+
+
+def test_waiters_are_admitted_in_arrival_order(tmp_path):
+    key = ApiKey("a", "t", max_concurrent=1)
+    admission = make_admission(tmp_path, key, max_wait=5)
+    lease = admission.acquire(key)
+    order = []
+
+    def wait(name):
+        admitted = admission.acquire(key)
+        order.append(name)
+        time.sleep(0.1)
+        admitted.release()
+
+    waiters = []
+    for name in ("first", "second", "third"):
+        waiters.append(threading.Thread(target=wait, args=(name,)))
+        waiters[-1].start()
+        time.sleep(0.05)
+    lease.release()
+    for waiter in waiters:
+        waiter.join()
+    assert order == ["first", "second", "third"]
+
+
+def test_retry_after_from_request_rate(tmp_path):
+    key = ApiKey("a", "t", rpm=6)
+    admission = make_admission(tmp_path, key)
+    for _ in range(6):
+        admission.acquire(key).release()
+    with pytest.raises(Rejected) as rejected:
+        admission.acquire(key)
+    assert rejected.value.retry_after == 10
+
+
+def test_retry_after_for_concurrency_cap(tmp_path):
+    key = ApiKey("a", "t", max_concurrent=1)
+    admission = make_admission(tmp_path, key)
+    lease = admission.acquire(key)
+    with pytest.raises(Rejected) as rejected:
+        admission.acquire(key)
+    assert rejected.value.retry_after == 1
+    lease.release()
+
+
+def test_release_is_idempotent(tmp_path):
+    key = ApiKey("a", "t", max_concurrent=2, tpm=1000)
+    admission = make_admission(tmp_path, key)
+    first = admission.acquire(key, estimate=100)
+    second = admission.acquire(key, estimate=100)
+    first.tokens = 10
+    first.release()
+    first.release()
+    stats = admission.stats()["a"]
+    assert stats["in_flight"] == 1
+    assert stats["tokens_available"] == pytest.approx(890, abs=1)
+    second.release()
+    assert admission.stats()["a"]["in_flight"] == 0
+
+
+def test_reload_keeps_store_unless_keys_change(tmp_path):
+    admission = make_admission(tmp_path, ApiKey("a", "t", max_concurrent=1))
+    key = admission.authenticate("t")
+    lease = admission.acquire(key)
+    store = lease.store
+
+    admission.configure([ApiKey("a", "t", max_concurrent=1)], str(tmp_path / "quota.bin"), 0.1)
+    assert admission.authenticate("t") is key
+    with pytest.raises(Rejected):
+        admission.acquire(key)
+
+    admission.configure([ApiKey("a", "t", max_concurrent=2)], str(tmp_path / "quota.bin"), 0.1)
+    assert not store.closed
+    lease.release()
+    assert store.closed
+    lease.release()
@@ -0,0 +1,38 @@
+import asyncio
+
+from src.config import settings
+from src.services import async_http_client
+
+
+def reload_pool():
+    async_http_client._apply_settings({"UPSTREAM_POOL_MAXSIZE"})
+
+
+def test_reload_closes_the_old_client_once_due(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_MAX_SECONDS", 0.0)
+    monkeypatch.setattr(settings, "UPSTREAM_READ_TIMEOUT", 0.0)
+
+    async def main():
+        old = async_http_client.get_client()
+        reload_pool()
+        new = async_http_client.get_client()
+        await asyncio.sleep(0.01)
+        assert new is not old
+        assert old.is_closed and not new.is_closed
+        await async_http_client.aclose()
+
+    asyncio.run(main())
+
+
+def test_old_client_serves_running_requests_until_due(monkeypatch):
+    async def main():
+        old = async_http_client.get_client()
+        reload_pool()
+        async_http_client.get_client()
+        await asyncio.sleep(0.01)
+        assert not old.is_closed
+        await async_http_client.aclose()
+        assert old.is_closed
+        assert async_http_client._retired == []
+
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+from src.services import bulk
+from src.services.openai_service import DEFAULT_TARGET_MODEL
+
+LINES = b"\n".join([
+    b'{"messages": [{"role": "user", "content": "a"}]}',
+    b'{"custom_id": "b", "body": {"model": "m", "messages": [{"role": "user", "content": "b"}], "stream": true}}',
+])
+
+
+def test_line_without_model_gets_the_default(monkeypatch):
+    monkeypatch.setattr(bulk.default_router, "aliases", {})
+    items = bulk.parse_requests(LINES, 10)
+    assert [(custom_id, payload["model"]) for custom_id, payload in items] == [("1", DEFAULT_TARGET_MODEL), ("b", "m")]
+    assert "stream" not in items[1][1]
+
+
+def test_line_without_model_uses_the_wildcard_alias(monkeypatch):
+    monkeypatch.setattr(bulk.default_router, "aliases", {"*": "routed"})
+    items = bulk.parse_requests(LINES, 10)
+    assert [payload["model"] for _, payload in items] == ["routed", "routed"]
@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+from src.services.completion_cache import CompletionCache
+
+COMPLETION = {"id": "c", "choices": [{"message": {"role": "assistant", "content": "hi"}}]}
+
+
+def unwritable_cache(tmp_path):
+    cache = CompletionCache(max_bytes=1 << 20, disk_dir=str(tmp_path / "cache"), ttl=60)
+    # The disk tier's directory went away and can't be recreated: a file is in the way.
+    (tmp_path / "cache").rmdir()
+    (tmp_path / "cache").write_text("")
+    return cache
+
+
+def test_disk_failure_still_returns_the_completion(tmp_path):
+    cache = unwritable_cache(tmp_path)
+    completion, status = cache.complete("k", "use", lambda: COMPLETION)
+    assert completion == COMPLETION and status == "MISS"
+    assert cache.stats()["disk_errors"] == 1
+    assert cache.get("k") == COMPLETION
+
+
+def test_async_disk_failure_still_returns_the_completion(tmp_path):
+    cache = unwritable_cache(tmp_path)
+
+    async def compute():
+        return COMPLETION
+
+    completion, status = asyncio.run(cache.acomplete("k", "use", compute))
+    assert completion == COMPLETION and status == "MISS"
+    assert cache.stats()["disk_errors"] == 1
+
+
+def test_failed_write_leaves_no_temporary_file(tmp_path, monkeypatch):
+    cache = CompletionCache(max_bytes=1 << 20, disk_dir=str(tmp_path), ttl=60)
+
+    def fail(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(os, "replace", fail)
+    cache.put("k", COMPLETION)
+    assert cache.stats()["disk_errors"] == 1
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names]
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from src.json_patch import patch_fields, top_level_members
+
+
+def test_patches_only_top_level_members():
+    body = (b'{"messages": [{"role": "user", "content": "say \\"model\\": 1", "model": "nested"}],\n'
+            b' "model" : "llama", "stream": false}')
+    patched = patch_fields(body, {"model": "gpt-4o-mini", "stream": True})
+    assert patched == (b'{"messages": [{"role": "user", "content": "say \\"model\\": 1", "model": "nested"}],\n'
+                       b' "model" : "gpt-4o-mini", "stream": true}')
+
+
+def test_rest_of_the_body_is_kept_byte_for_byte():
+    body = '{"messages":[{"content":"caf\\u00e9 \\\\ \\" ☃ \\ud83d\\ude00"}],"model":"m"}'.encode("utf-8")
+    patched = patch_fields(body, {"model": "x"})
+    assert patched == body.replace(b'"m"}', b'"x"}')
+    assert json.loads(patched)["messages"] == json.loads(body)["messages"]
+
+
+def test_strings_ending_in_backslashes():
+    body = b'{"a": "\\\\", "b": "x\\\\\\"y", "model": "m"}'
+    members = top_level_members(body)
+    assert set(members) == {"a", "b", "model"}
+    assert json.loads(patch_fields(body, {"model": "é\""})) == {"a": "\\", "b": 'x\\"y', "model": "é\""}
+
+
+def test_unicode_key_and_escaped_key():
+    body = '{"m\\u006fdel": "a", "é": {"model": 1}}'.encode("utf-8")
+    assert json.loads(patch_fields(body, {"model": "b"})) == {"model": "b", "é": {"model": 1}}
+
+
+def test_missing_keys_are_appended():
+    assert json.loads(patch_fields(b'{"messages": []}', {"stream": True})) == {"messages": [], "stream": True}
+    assert patch_fields(b"{ }", {"stream": False}) == b'{ "stream":false}'
+
+
+def test_duplicate_keys_fall_back_to_a_round_trip():
+    with pytest.raises(ValueError):
+        top_level_members(b'{"model": "a", "model": "b"}')
+    assert json.loads(patch_fields(b'{"model": "a", "model": "b"}', {"model": "c"})) == {"model": "c"}
+
+
+@pytest.mark.parametrize("body", [b"[1]", b'{"a": 1', b'{"a" 1}', b'{"a": 1} x'])
+def test_malformed_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        top_level_members(body)
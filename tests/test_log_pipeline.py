@@ -0,0 +1,47 @@
+import logging
+
+from src.log_pipeline import BatchingQueueHandler
+
+
+class ListSink:
+    def __init__(self):
+        self.lines = []
+
+    def write_batch(self, records, format):
+        self.lines.extend(format(record) for record in records)
+
+    def close(self):
+        pass
+
+
+class FailingSink(ListSink):
+    def write_batch(self, records, format):
+        raise OSError("disk full")
+
+
+def log_through(*sinks):
+    handler = BatchingQueueHandler(sinks, flush_interval=0.01)
+    logger = logging.getLogger(f"test_log_pipeline.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    logger.info("one %s", 1)
+    logger.info("two")
+    handler.close()
+    return handler.stats()
+
+
+def test_written_counts_records_every_sink_stored():
+    sink = ListSink()
+    stats = log_through(sink)
+    assert sink.lines == ["one 1", "two"]
+    assert stats["written"] == 2 and stats["write_errors"] == 0
+
+
+def test_failed_sink_is_not_counted_as_written(capsys):
+    sink = ListSink()
+    stats = log_through(FailingSink(), sink)
+    assert sink.lines == ["one 1", "two"]
+    assert stats["written"] == 0
+    assert stats["write_errors"] >= 1
+    assert "disk full" in capsys.readouterr().err
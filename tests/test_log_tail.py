@@ -0,0 +1,21 @@
+from src.log_tail import follow, start_offset
+
+
+def test_start_offset_falls_back_to_end_of_file(tmp_path):
+    path = tmp_path / "logs.txt"
+    path.write_bytes(b"a\nb\n")
+    assert start_offset(str(path), "2") == 2
+    assert start_offset(str(path), "-5") == 0
+    assert start_offset(str(path), "abc") == 4
+    assert start_offset(str(path)) == 4
+
+
+def test_follow_yields_new_lines_then_waits(tmp_path):
+    path = tmp_path / "logs.txt"
+    path.write_bytes(b"a\n")
+    events = follow(str(path), 0, max_seconds=5, poll_interval=1, keepalive=2)
+    assert next(events) == b"retry: 2000\n\n"
+    assert b"data: a" in next(events)
+    assert next(events) is None
+    assert next(events) is None
+    assert next(events) == b": keep-alive\n\n"
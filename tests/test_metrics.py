@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src import metrics
+from src.config import settings
+
+COUNTER = metrics.Counter("test_folded_total", "Test counter.", ("kind",))
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(directory, pid, started, value):
+    snap = {"pid": pid, "started": started, "time": started, "metrics": {
+        "test_folded_total": {"type": "counter", "help": "Test counter.", "labelnames": ["kind"],
+                              "samples": [[["a"], value]]},
+        "bridgeai_streams_open": {"type": "gauge", "help": "Streams.", "labelnames": ["endpoint"],
+                                  "samples": [[["x"], 7]]},
+    }}
+    (directory / f"{pid}-{int(started * 1000)}.json").write_text(json.dumps(snap))
+
+
+def folded_total():
+    return metrics._merge(metrics._snapshots())["test_folded_total"]["samples"][("a",)]
+
+
+def test_exited_workers_are_folded_once(metrics_dir):
+    COUNTER.inc("a", amount=1)
+    write_snapshot(metrics_dir, exited_pid(), 1.0, 10)
+    write_snapshot(metrics_dir, exited_pid(), 2.0, 100)
+    assert folded_total() == 111
+    assert folded_total() == 111
+    names = sorted(os.listdir(metrics_dir))
+    assert names == sorted([".lock", "accumulated.json", f"{os.getpid()}-{int(metrics._started * 1000)}.json"])
+    merged = metrics._merge(metrics._snapshots())
+    assert ("x",) not in merged.get("bridgeai_streams_open", {"samples": {}})["samples"]
+
+
+def test_reused_pid_keeps_the_old_snapshot(metrics_dir):
+    COUNTER.inc("a", amount=1)
+    before = folded_total()
+    # An earlier process that had this process's pid.
+    write_snapshot(metrics_dir, os.getpid(), metrics._started - 60, 5)
+    assert folded_total() == before + 5
+
+
+def test_clear_removes_previous_run(metrics_dir):
+    write_snapshot(metrics_dir, exited_pid(), 1.0, 10)
+    folded_total()
+    (metrics_dir / "keep.txt").write_text("")
+    metrics.clear()
+    assert os.listdir(metrics_dir) == ["keep.txt"]
+
+
+def test_import_starts_no_flusher():
+    code = "import threading, src.metrics; print([t.name for t in threading.enumerate()])"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert "metrics-flush" not in output
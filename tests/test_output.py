@@ -0,0 +1,73 @@
+import asyncio
+
+from src.config import settings
+from src.output import acoalesce
+from src.routes import async_api
+from src.transforms import TransformChain
+
+
+class FakeUpstream:
+    transforms = TransformChain()
+    completions_url = "http://upstream.test/chat/completions"
+
+
+class FakeStream:
+    """An upstream stream that sends a token every interval seconds and never ends."""
+
+    upstream = FakeUpstream()
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.closed = False
+
+    async def __aiter__(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            yield b'data: {"choices":[{"index":0,"delta":{"content":"x"}}]}\n\n'
+
+    async def aclose(self):
+        self.closed = True
+
+
+def run_proxy_stream(monkeypatch, window, max_seconds=0.3):
+    stream = FakeStream(0.02)
+
+    async def open_stream(payload, body=None):
+        return stream
+
+    monkeypatch.setattr(settings, "STREAM_MAX_SECONDS", max_seconds)
+    monkeypatch.setattr(async_api.async_openai_service, "openai_chat_completion_for_chat_stream", open_stream)
+
+    async def consume():
+        chunks = acoalesce(async_api.proxy_stream({"messages": []}), window, 16384)
+        return [chunk async for chunk in chunks]
+
+    return asyncio.run(asyncio.wait_for(consume(), 5)), stream
+
+
+def test_max_duration_without_coalescing(monkeypatch):
+    writes, stream = run_proxy_stream(monkeypatch, window=0)
+    assert b"Stream exceeded" in writes[-1]
+    assert stream.closed
+
+
+def test_max_duration_while_coalescing(monkeypatch):
+    # The deadline hits while acoalesce() reads ahead in its own task.
+    writes, stream = run_proxy_stream(monkeypatch, window=0.1)
+    assert b"Stream exceeded" in writes[-1]
+    assert stream.closed
+    assert len(writes) < sum(write.count(b"data: ") for write in writes)
+
+
+def test_first_token_is_not_delayed():
+    async def events():
+        yield b'data: {"choices":[{"delta":{"role":"assistant","content":""}}]}\n\n'
+        for _ in range(5):
+            yield b'data: {"choices":[{"delta":{"content":"x"}}]}\n\n'
+
+    async def consume():
+        return [chunk async for chunk in acoalesce(events(), 10, 16384)]
+
+    writes = asyncio.run(consume())
+    # The role-only event and the first token each go out alone; the rest are joined.
+    assert [write.count(b"data: ") for write in writes] == [1, 1, 4]
@@ -0,0 +1,39 @@
+import gc
+import time
+import weakref
+
+from src.config import settings
+from src.services.router import Router, Upstream
+
+
+def half_open(upstream):
+    upstream.opened_at = time.monotonic() - settings.CIRCUIT_COOLDOWN - 1
+
+
+def test_one_trial_at_a_time_while_half_open():
+    upstream = Upstream("u", "http://upstream.test", "key")
+    router = Router([upstream])
+    assert router.begin(upstream) is False  # started while the circuit was closed
+
+    half_open(upstream)
+    assert router.begin(upstream) is True
+    assert router.begin(upstream) is False
+    assert router.candidates("m") == []
+
+    # The request from before the circuit opened fails, and the cooldown passes again.
+    router.end(upstream, ok=False)
+    half_open(upstream)
+    assert router.candidates("m") == []
+
+    router.end(upstream, ok=False)
+    router.end(upstream, ok=False, trial=True)
+    half_open(upstream)
+    assert router.candidates("m") == [upstream]
+
+
+def test_routers_are_not_kept_alive():
+    router = Router([])
+    ref = weakref.ref(router)
+    del router
+    gc.collect()
+    assert ref() is None
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from src.sse import ChunkRewriter, SSEParser, relay
+
+STREAM = (
+    b': keep-alive\r\n\r\n'
+    b'data: {"id": "a", "choices": []}\r\n\r\n'
+    b'event: message\r\nid: 7\r\ndata: {"x":\r\ndata:  1}\r\n\r\n'
+    b'retry: 2000\r\n\r\n'
+    b'data: [DONE]\r\n\r\n'
+)
+EVENTS = [b'{"id": "a", "choices": []}', b'{"x":\n 1}', b'[DONE]']
+
+
+def feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+def test_whole_stream():
+    assert feed_all(SSEParser(), [STREAM]) == EVENTS
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_events_split_across_chunks(size):
+    chunks = [STREAM[i:i + size] for i in range(0, len(STREAM), size)]
+    assert feed_all(SSEParser(), chunks) == EVENTS
+
+
+def test_crlf_pair_split_between_chunks():
+    parser = SSEParser()
+    assert parser.feed(b"data: 1\r\n\r") == [b"1"]
+    # The "\n" completing the pair must not count as another line end.
+    assert parser.feed(b"\ndata: 2\r") == []
+    assert parser.feed(b"\n\r\n") == [b"2"]
+    assert parser.feed(b"\ndata: 3\n\n") == [b"3"]
+
+
+def test_bare_cr_line_endings():
+    parser = SSEParser()
+    assert parser.feed(b"data: 1\r\r") == [b"1"]
+    assert parser.feed(b"data: 2\r") == []
+    # A stream ending in a bare "\r" still completes its last event.
+    assert parser.feed(b"\r") == [b"2"]
+
+
+def test_comments_and_keep_alives_yield_nothing():
+    parser = SSEParser()
+    assert parser.feed(b": ping\n\n:\n\n") == []
+    assert parser.feed(b": comment\ndata: kept\n\n") == [b"kept"]
+
+
+def test_relay_stops_after_done():
+    chunks = [b'data: {"a": 1}\n\ndata: [DONE]\n\ndata: {"late": 1}\n\n']
+    assert list(relay(chunks, lambda data: data)) == [b'data: {"a": 1}\n\n', b"data: [DONE]\n\n"]
+
+
+def test_rewriter_ignores_key_inside_a_string():
+    rewrite = ChunkRewriter({"model": "gpt-4o-mini"})
+    data = b'{"id":"c","model":"llama","choices":[{"delta":{"content":"\\"model\\": \\"x\\""}}]}'
+    result = rewrite(data)
+    assert rewrite.fast == 1
+    assert json.loads(result) == {"id": "c", "model": "gpt-4o-mini",
+                                  "choices": [{"delta": {"content": '"model": "x"'}}]}
+
+
+def test_rewriter_drops_member_with_nested_objects():
+    rewrite = ChunkRewriter(drop_fields=["x_groq"])
+    data = b'{"id":"c","x_groq":{"id":"q","usage":{"total_tokens":3}},"choices":[]}'
+    assert rewrite(data) == b'{"id":"c","choices":[]}'
+    assert rewrite.fast == 1
+
+
+def test_rewriter_falls_back_when_key_is_also_nested():
+    rewrite = ChunkRewriter({"model": "gpt-4o-mini"})
+    data = b'{"choices":[{"model":"nested"}],"model":"llama"}'
+    assert json.loads(rewrite(data)) == {"choices": [{"model": "nested"}], "model": "gpt-4o-mini"}
+    assert rewrite.fallback == 1
+
+
+def test_rewriter_falls_back_after_escapes():
+    rewrite = ChunkRewriter(drop_fields=["x_groq"])
+    data = b'{"choices":[{"delta":{"content":"a\\"b\\u00e9"}}],"x_groq":{"id":"q"}}'
+    assert json.loads(rewrite(data)) == {"choices": [{"delta": {"content": 'a"b\u00e9'}}]}
+    assert rewrite.fallback == 1
@@ -0,0 +1,88 @@
+import json
+
+from src.sse import SSEParser
+from src.stream_assembly import CompletionAccumulator
+
+
+def chunk(delta=None, finish_reason=None, index=0, **extra):
+    data = {"id": "c", "created": 1, "model": "m",
+            "choices": [{"index": index, "delta": delta or {}, "finish_reason": finish_reason}]}
+    data.update(extra)
+    return json.dumps(data).encode("utf-8")
+
+
+def call(index, arguments, id=None, name=None):
+    delta = {"index": index, "function": {"arguments": arguments}}
+    if id:
+        delta.update(id=id, type="function")
+        delta["function"]["name"] = name
+    return {"tool_calls": [delta]}
+
+
+def test_tool_call_arguments_across_chunks():
+    accumulator = CompletionAccumulator()
+    for data in (
+        chunk({"role": "assistant", "content": None}),
+        chunk(call(0, "", id="call_a", name="get_weather")),
+        chunk(call(0, '{"city": ')),
+        chunk(call(1, '{"q"', id="call_b", name="search")),
+        chunk(call(0, '"Paris"}')),
+        chunk(call(1, ': "é"}')),
+        chunk(finish_reason="tool_calls", usage={"prompt_tokens": 3, "completion_tokens": 5, "total_tokens": 8}),
+    ):
+        accumulator.feed(data)
+    assert accumulator.finished
+    completion = accumulator.completion()
+    assert completion["usage"]["total_tokens"] == 8
+    (choice,) = completion["choices"]
+    assert choice["finish_reason"] == "tool_calls"
+    assert choice["message"]["tool_calls"] == [
+        {"id": "call_a", "type": "function", "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'}},
+        {"id": "call_b", "type": "function", "function": {"name": "search", "arguments": '{"q": "é"}'}},
+    ]
+    assert json.loads(choice["message"]["tool_calls"][1]["function"]["arguments"]) == {"q": "é"}
+
+
+def test_content_reasoning_and_groq_usage():
+    accumulator = CompletionAccumulator()
+    accumulator.feed(chunk({"role": "assistant", "reasoning": "hm"}))
+    accumulator.feed(chunk({"reasoning_content": ", ok"}))
+    accumulator.feed(chunk({"content": "Hi"}))
+    assert not accumulator.finished
+    accumulator.feed(chunk({"content": " there"}, finish_reason="stop",
+                           x_groq={"usage": {"total_tokens": 4}}))
+    assert accumulator.content == "Hi there"
+    message = accumulator.completion()["choices"][0]["message"]
+    assert message == {"role": "assistant", "content": "Hi there", "reasoning_content": "hm, ok"}
+    assert accumulator.usage == {"total_tokens": 4}
+
+
+def test_choices_are_kept_apart_and_all_must_finish():
+    accumulator = CompletionAccumulator()
+    accumulator.feed(chunk({"content": "a"}, index=1))
+    accumulator.feed(chunk({"content": "b"}, index=0, finish_reason="stop"))
+    assert not accumulator.finished
+    accumulator.feed(chunk({"content": "c"}, index=1, finish_reason="length"))
+    assert accumulator.finished
+    assert [c["message"]["content"] for c in accumulator.completion()["choices"]] == ["b", "ac"]
+
+
+def test_invalid_events_and_errors():
+    accumulator = CompletionAccumulator()
+    accumulator.feed(b"not json")
+    accumulator.feed(chunk({"content": "x"}, finish_reason="stop", error={"message": "overloaded"}))
+    assert accumulator.invalid == 1 and accumulator.events == 2
+    assert not accumulator.finished
+    assert accumulator.completion()["error"] == {"message": "overloaded"}
+
+
+def test_events_parsed_from_split_chunks():
+    stream = b"".join(b"data: " + data + b"\n\n" for data in (
+        chunk(call(0, '{"a": ', id="call_a", name="f")),
+        chunk(call(0, "1}"), finish_reason="tool_calls"),
+    ))
+    parser, accumulator = SSEParser(), CompletionAccumulator()
+    for i in range(0, len(stream), 5):
+        for data in parser.feed(stream[i:i + 5]):
+            accumulator.feed(data)
+    assert accumulator.completion()["choices"][0]["message"]["tool_calls"][0]["function"]["arguments"] == '{"a": 1}'
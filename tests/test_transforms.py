@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from src import codec
+from src.transforms import TransformChain
+
+
+def chunk(content=None, finish_reason=None, index=0, **extra):
+    delta = {} if content is None else {"content": content}
+    data = {"id": "c", "model": "deepseek-r1",
+            "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}]}
+    data.update(extra)
+    return codec.dumps(data)
+
+
+def run(pieces, spec=None, last_finish="stop"):
+    transform = TransformChain(dict({"extract_reasoning": True}, **(spec or {}))).stream()
+    events = [json.loads(transform(chunk(piece))) for piece in pieces[:-1]]
+    events.append(json.loads(transform(chunk(pieces[-1], finish_reason=last_finish))))
+    reasoning = "".join(e["choices"][0]["delta"].get("reasoning_content", "") for e in events)
+    content = "".join(e["choices"][0]["delta"].get("content") or "" for e in events)
+    return events, reasoning, content
+
+
+@pytest.mark.parametrize("pieces", [
+    ["<think>abc</think>\n\nreply"],
+    ["<th", "ink>abc</th", "ink>  reply"],
+    ["\n<", "think", ">a", "bc<", "/", "think>", "\n", "re", "ply"],
+    ["<think>abc</think", ">reply"],
+])
+def test_reasoning_tags_split_across_chunks(pieces):
+    events, reasoning, content = run(pieces)
+    assert (reasoning, content) == ("abc", "reply")
+    for event in events:
+        assert event["model"] == "gpt-4o-mini"
+        assert "<" not in (event["choices"][0]["delta"].get("content") or "")
+
+
+def test_partial_close_tag_is_held_back_not_lost():
+    # "</th" could start "</think>" so it is carried, then turns out to be reasoning.
+    _, reasoning, content = run(["<think>a</th", "x</think>b"])
+    assert (reasoning, content) == ("a</thx", "b")
+
+
+def test_carry_is_flushed_at_finish():
+    assert run(["<think>still thinking</thi"])[1:] == ("still thinking</thi", "")
+    assert run(["  <thi"])[1:] == ("", "  <thi")
+
+
+def test_reply_without_think_passes_through():
+    events, reasoning, content = run(["<b>bold", "</think> text"])
+    assert (reasoning, content) == ("", "<b>bold</think> text")
+
+
+def test_choices_track_reasoning_separately():
+    transform = TransformChain({"extract_reasoning": True}).stream()
+    first = json.loads(transform(chunk("<think>x</think>a", index=0)))
+    second = json.loads(transform(chunk("plain", index=1)))
+    assert first["choices"][0]["delta"] == {"content": "a", "reasoning_content": "x"}
+    assert second["choices"][0]["delta"] == {"content": "plain"}
+
+
+def test_rename_and_groq_usage_in_stream():
+    transform = TransformChain({"rename": {"reasoning": "reasoning_content"}}).stream()
+    data = codec.dumps({"choices": [{"index": 0, "delta": {"reasoning": "r"}}],
+                        "x_groq": {"id": "q", "usage": {"prompt_tokens": 1, "completion_tokens": 2,
+                                                        "total_tokens": 3, "queue_time": 0.1}}})
+    assert json.loads(transform(data)) == {
+        "choices": [{"index": 0, "delta": {"reasoning_content": "r"}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        "model": "gpt-4o-mini",
+    }
+
+
+def test_completion_extracts_leading_think():
+    chain = TransformChain({"extract_reasoning": True})
+    result = {"id": "c", "model": "deepseek-r1", "x_groq": {"id": "q"},
+              "choices": [{"index": 0, "finish_reason": "stop",
+                           "message": {"role": "assistant", "content": " <think> why </think>\n\nreply"}}]}
+    completion = chain.completion(result)
+    assert completion["model"] == "gpt-4o-mini" and "x_groq" not in completion
+    assert completion["choices"][0]["message"] == {
+        "role": "assistant", "content": "reply", "reasoning_content": "why",
+    }
+    assert completion["usage"] == {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+def test_unknown_transform_is_rejected():
+    with pytest.raises(ValueError):
+        TransformChain({"uppercase": True})